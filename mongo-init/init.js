@@ -27,11 +27,18 @@ try {
   }
 }
 
-// Ensure indexes for conversations collection
+// Ensure indexes for conversations collection.
+// Keep in sync with CONVERSATION_INDEXES in streetgpt/core.py.
 try {
   db.conversations.createIndex({ session_id: 1 }, { unique: true });
   db.conversations.createIndex({ created_at: 1 });
-  db.conversations.createIndex({ app: 1 });
+  db.conversations.createIndex({ app: 1, study_id: 1, created_at: 1 });
+  db.conversations.createIndex({ prolific_pid: 1, study_id: 1 });
+  db.conversations.createIndex({ survey_claim_id: 1, created_at: 1 });
+  db.conversations.createIndex(
+    { 'chat_outcome.extractor_status': 1, created_at: 1 },
+    { partialFilterExpression: { 'chat_outcome.extractor_status': { $exists: true } } }
+  );
   print('Indexes ensured on conversations.');
 } catch (e) {
   print('Index creation error: ' + e);
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Local stand-in for the parts of the Prolific API used by setup_prolific_qualtrics.py.
+
+Keeps studies in memory and can inject failures, so create/update/publish retries can be
+exercised without touching a real Prolific workspace:
+
+    python scripts/prolific_stub_server.py --port 8765 --fail-rate 0.3 --lose-responses
+    python scripts/setup_prolific_qualtrics.py --prolific-api-url http://127.0.0.1:8765/api/v1 \
+        --prolific-token stub --create-study --publish-study ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs
+
+API_PREFIX = "/api/v1"
+
+
+class StubState:
+    def __init__(self, fail_rate: float, lose_responses: bool, page_size: int = 20):
+        self.fail_rate = fail_rate
+        self.page_size = page_size
+        self.lose_responses = lose_responses
+        self.lock = threading.Lock()
+        self.studies: dict[str, dict[str, Any]] = {}
+
+
+class ProlificStubHandler(BaseHTTPRequestHandler):
+    state: StubState
+
+    def send_json(self, status: int, data: dict[str, Any] | None = None) -> None:
+        body = json.dumps(data or {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def route(self, method: str) -> None:
+        if not self.headers.get("Authorization", "").startswith("Token "):
+            self.send_json(401, {"error": "missing token"})
+            return
+        failing = random.random() < self.state.fail_rate
+        # Fail before doing anything, or (with --lose-responses) after committing the change
+        if failing and not self.state.lose_responses:
+            self.send_json(503, {"error": "injected failure"})
+            return
+
+        path, _, query = self.path.partition("?")
+        if not path.startswith(API_PREFIX):
+            self.send_json(404)
+            return
+        path = path[len(API_PREFIX):]
+        with self.state.lock:
+            status, data = self.handle_api(method, path, parse_qs(query))
+        if failing:
+            self.send_json(503, {"error": "injected failure after commit"})
+            return
+        self.send_json(status, data)
+
+    def list_studies(self, query: dict[str, list[str]]) -> dict[str, Any]:
+        """One page of studies with Prolific-style _links."""
+        page = max(1, int((query.get("page") or ["1"])[0]))
+        size = self.state.page_size
+        studies = list(self.state.studies.values())
+        next_link = None
+        if page * size < len(studies):
+            next_link = {"href": f"http://{self.headers.get('Host')}{API_PREFIX}/studies/?page={page + 1}"}
+        return {
+            "results": studies[(page - 1) * size:page * size],
+            "_links": {"next": next_link},
+            "meta": {"count": len(studies)},
+        }
+
+    def handle_api(self, method: str, path: str, query: dict[str, list[str]]) -> tuple[int, dict[str, Any] | None]:
+        studies = self.state.studies
+        if method == "GET" and path == "/workspaces/":
+            return 200, {"results": [{"id": "stub-workspace", "title": "Stub workspace"}]}
+        if method == "GET" and path == "/studies/":
+            return 200, self.list_studies(query)
+        if method == "POST" and path == "/studies/":
+            study = {**self.read_json(), "id": secrets.token_hex(12), "status": "UNPUBLISHED"}
+            studies[study["id"]] = study
+            return 201, study
+        match = re.fullmatch(r"/studies/([^/]+)/(transition/)?", path)
+        if not match or match.group(1) not in studies:
+            return 404, {"error": "not found"}
+        study = studies[match.group(1)]
+        if method == "GET" and not match.group(2):
+            return 200, study
+        if method == "PATCH" and not match.group(2):
+            if study["status"] != "UNPUBLISHED":
+                return 400, {"error": f"cannot update a study in status {study['status']}"}
+            study.update({**self.read_json(), "id": study["id"], "status": study["status"]})
+            return 200, study
+        if method == "POST" and match.group(2):
+            if self.read_json().get("action") != "PUBLISH":
+                return 400, {"error": "unsupported action"}
+            if study["status"] != "UNPUBLISHED":
+                return 400, {"error": f"cannot publish a study in status {study['status']}"}
+            study["status"] = "ACTIVE"
+            return 200, study
+        return 405, {"error": "method not allowed"}
+
+    def do_GET(self) -> None:
+        self.route("GET")
+
+    def do_POST(self) -> None:
+        self.route("POST")
+
+    def do_PATCH(self) -> None:
+        self.route("PATCH")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serve an in-memory stub of the Prolific API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument(
+        "--lose-responses",
+        action="store_true",
+        help="Apply the request before answering 503, like a response lost after the server committed it.",
+    )
+    parser.add_argument("--page-size", type=int, default=20, help="Studies per page of GET /studies/.")
+    args = parser.parse_args()
+
+    ProlificStubHandler.state = StubState(args.fail_rate, args.lose_responses, args.page_size)
+    server = ThreadingHTTPServer((args.host, args.port), ProlificStubHandler)
+    print(f"Prolific stub listening on http://{args.host}:{args.port}{API_PREFIX}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
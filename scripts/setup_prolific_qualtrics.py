@@ -1,18 +1,28 @@
 #!/usr/bin/env python3
-"""Prepare a Qualtrics QSF for Prolific and optionally create a Prolific study."""
+"""Prepare a Qualtrics QSF for Prolific and optionally create a Prolific study.
+
+With --manifest, many survey variants are set up in one run: QSFs are patched in
+a process pool and Prolific studies are created concurrently through one pooled,
+rate-limited ProlificClient. A combined summary is written next to the manifest.
+"""
 
 from __future__ import annotations
 
 import argparse
 import json
+import os
 import re
 import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from html import unescape
 from pathlib import Path
 from typing import Any
 from urllib.parse import quote, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 COMPLETE_CODE_PLACEHOLDER = "PROLIFIC-COMPLETE-CODE"
@@ -21,6 +31,10 @@ POOR_QUALITY_CODE_PLACEHOLDER = "PROLIFIC-POOR-QUALITY-CODE"
 PROLIFIC_COMPLETE_URL = "https://app.prolific.com/submissions/complete?cc={code}"
 PROLIFIC_API_URL = "https://api.prolific.com/api/v1"
 DEFAULT_DEVICE_COMPATIBILITY = ["desktop", "mobile", "tablet"]
+DEFAULT_PROLIFIC_REQUESTS_PER_SECOND = 4.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+DRAFT_STUDY_STATUS = "UNPUBLISHED"
+PUBLISHED_STUDY_STATUSES = {"PUBLISHING", "ACTIVE", "SCHEDULED", "PAUSED", "AWAITING REVIEW", "COMPLETED"}
 
 
 def load_env_file(path: Path) -> dict[str, str]:
@@ -86,6 +100,58 @@ def build_external_study_url(qualtrics_url: str) -> str:
     return f"{qualtrics_url}{separators}{suffix}"
 
 
+class QsfDocument:
+    """A parsed QSF with its SurveyElements indexed in a single pass."""
+
+    def __init__(self, data: dict[str, Any]):
+        self.data = data
+        self.reindex()
+
+    @classmethod
+    def load(cls, path: Path) -> "QsfDocument":
+        return cls(json.loads(path.read_text(encoding="utf-8")))
+
+    def reindex(self) -> None:
+        self.by_element: dict[str, list[dict[str, Any]]] = {}
+        self.by_primary_attribute: dict[str, list[dict[str, Any]]] = {}
+        self.questions: dict[str, dict[str, Any]] = {}
+        for element in self.elements:
+            element_type = element.get("Element")
+            primary_attribute = element.get("PrimaryAttribute")
+            self.by_element.setdefault(element_type, []).append(element)
+            self.by_primary_attribute.setdefault(primary_attribute, []).append(element)
+            if element_type == "SQ":
+                self.questions.setdefault(primary_attribute, element)
+
+    @property
+    def elements(self) -> list[dict[str, Any]]:
+        return self.data.setdefault("SurveyElements", [])
+
+    @property
+    def survey_entry(self) -> dict[str, Any]:
+        return self.data.get("SurveyEntry", {})
+
+    def first(self, element_type: str) -> dict[str, Any] | None:
+        matches = self.by_element.get(element_type)
+        return matches[0] if matches else None
+
+    def question(self, qid: str) -> dict[str, Any]:
+        question = self.questions.get(qid)
+        if question is None:
+            raise ValueError(f"Could not find question {qid} in the QSF")
+        return question
+
+    def insert_before(self, element: dict[str, Any], element_type: str) -> None:
+        # Insert ahead of the first element of element_type, or append if there is none
+        anchor = self.first(element_type)
+        index = next((i for i, item in enumerate(self.elements) if item is anchor), len(self.elements))
+        self.elements.insert(index, element)
+        self.reindex()
+
+    def dumps(self) -> str:
+        return compact_json(self.data)
+
+
 def strip_html(value: str) -> str:
     text = re.sub(r"<br\s*/?>", "\n", value, flags=re.IGNORECASE)
     text = re.sub(r"<[^>]+>", "", text)
@@ -95,23 +161,18 @@ def strip_html(value: str) -> str:
     return text.strip()
 
 
-def derive_intro_description(qsf: dict[str, Any]) -> str:
-    for element in qsf.get("SurveyElements", []):
-        if element.get("Element") != "SQ":
-            continue
-        payload = element.get("Payload", {})
-        if element.get("PrimaryAttribute") == "QID98":
-            text = strip_html(payload.get("QuestionText", ""))
-            return text[:1000]
-    survey_name = qsf.get("SurveyEntry", {}).get("SurveyName", "Qualtrics study")
+def derive_intro_description(qsf: QsfDocument) -> str:
+    question = qsf.questions.get("QID98")
+    if question is not None:
+        text = strip_html(question.get("Payload", {}).get("QuestionText", ""))
+        return text[:1000]
+    survey_name = qsf.survey_entry.get("SurveyName", "Qualtrics study")
     return f"Please complete the Qualtrics survey titled '{survey_name}'."
 
 
-def extract_existing_chatbot_url(qsf_path: Path) -> str:
-    qsf = json.loads(qsf_path.read_text(encoding="utf-8"))
-    try:
-        question = find_question(qsf, "QID399")
-    except ValueError:
+def extract_existing_chatbot_url(qsf: QsfDocument) -> str:
+    question = qsf.questions.get("QID399")
+    if question is None:
         return ""
     question_js = question.get("Payload", {}).get("QuestionJS", "")
     match = re.search(r'var CHATBOT_BASE_URL = "([^"]+)";', question_js)
@@ -120,10 +181,8 @@ def extract_existing_chatbot_url(qsf_path: Path) -> str:
     return match.group(1)
 
 
-def derive_estimated_minutes(qsf: dict[str, Any], fallback: int) -> int:
-    for element in qsf.get("SurveyElements", []):
-        if element.get("PrimaryAttribute") != "QID98":
-            continue
+def derive_estimated_minutes(qsf: QsfDocument, fallback: int) -> int:
+    for element in qsf.by_primary_attribute.get("QID98", []):
         payload = element.get("Payload", {})
         question_text = strip_html(payload.get("QuestionText", ""))
         match = re.search(r"(\d+)\s+minutes?", question_text, flags=re.IGNORECASE)
@@ -132,25 +191,19 @@ def derive_estimated_minutes(qsf: dict[str, Any], fallback: int) -> int:
     return fallback
 
 
-def find_survey_flow(qsf: dict[str, Any]) -> dict[str, Any]:
-    for element in qsf.get("SurveyElements", []):
-        if element.get("Element") == "FL":
-            return element
-    raise ValueError("Could not find the Qualtrics survey flow in the QSF")
+def find_survey_flow(qsf: QsfDocument) -> dict[str, Any]:
+    survey_flow = qsf.first("FL")
+    if survey_flow is None:
+        raise ValueError("Could not find the Qualtrics survey flow in the QSF")
+    return survey_flow
 
 
-def find_question(qsf: dict[str, Any], qid: str) -> dict[str, Any]:
-    for element in qsf.get("SurveyElements", []):
-        if element.get("Element") == "SQ" and element.get("PrimaryAttribute") == qid:
-            return element
-    raise ValueError(f"Could not find question {qid} in the QSF")
+def find_question(qsf: QsfDocument, qid: str) -> dict[str, Any]:
+    return qsf.question(qid)
 
 
-def find_chatbot_block(qsf: dict[str, Any]) -> dict[str, Any]:
-    blocks_element = next(
-        (element for element in qsf.get("SurveyElements", []) if element.get("Element") == "BL"),
-        None,
-    )
+def find_chatbot_block(qsf: QsfDocument) -> dict[str, Any]:
+    blocks_element = qsf.first("BL")
     if not blocks_element:
         raise ValueError("Could not find the Qualtrics block payload in the QSF")
 
@@ -197,7 +250,7 @@ def ensure_embedded_data_fields(flow_element: dict[str, Any], field_specs: list[
         existing_fields.add(field_name)
 
 
-def patch_prolific_redirects(qsf: dict[str, Any], codes: dict[str, str]) -> None:
+def patch_prolific_redirects(qsf: QsfDocument, codes: dict[str, str]) -> None:
     survey_flow = find_survey_flow(qsf)
 
     def patch_flow_items(items: list[dict[str, Any]]) -> None:
@@ -214,11 +267,10 @@ def patch_prolific_redirects(qsf: dict[str, Any], codes: dict[str, str]) -> None
 
     patch_flow_items(survey_flow.get("Payload", {}).get("Flow", []))
 
-    for element in qsf.get("SurveyElements", []):
-        if element.get("Element") == "SO":
-            payload = element.setdefault("Payload", {})
-            payload["EOSRedirectURL"] = PROLIFIC_COMPLETE_URL.format(code=codes["complete"])
-            break
+    survey_options = qsf.first("SO")
+    if survey_options is not None:
+        payload = survey_options.setdefault("Payload", {})
+        payload["EOSRedirectURL"] = PROLIFIC_COMPLETE_URL.format(code=codes["complete"])
 
 
 def build_chatbot_question_js(chatbot_url: str, password: str) -> str:
@@ -366,8 +418,8 @@ def build_chatbot_question_js(chatbot_url: str, password: str) -> str:
     )
 
 
-def make_chatbot_redirect_question(qsf: dict[str, Any], qid: str, chatbot_url: str, password: str) -> dict[str, Any]:
-    survey_id = qsf.get("SurveyEntry", {}).get("SurveyID")
+def make_chatbot_redirect_question(qsf: QsfDocument, qid: str, chatbot_url: str, password: str) -> dict[str, Any]:
+    survey_id = qsf.survey_entry.get("SurveyID")
     question_text = (
         "We are preparing your StreetGPT follow-up. "
         "If you are not redirected automatically within a few seconds, please wait a moment and then use the next arrow."
@@ -400,7 +452,7 @@ def make_chatbot_redirect_question(qsf: dict[str, Any], qid: str, chatbot_url: s
 
 
 def ensure_chatbot_redirect_question(
-    qsf: dict[str, Any],
+    qsf: QsfDocument,
     *,
     chatbot_url: str,
     password: str,
@@ -409,16 +461,9 @@ def ensure_chatbot_redirect_question(
     chatbot_block = find_chatbot_block(qsf)
     chatbot_block["BlockElements"] = [{"Type": "Question", "QuestionID": question_id}]
 
-    try:
-        question = find_question(qsf, question_id)
-    except ValueError:
-        question = make_chatbot_redirect_question(qsf, question_id, chatbot_url, password)
-        elements = qsf.setdefault("SurveyElements", [])
-        insert_index = next(
-            (index for index, element in enumerate(elements) if element.get("Element") == "STAT"),
-            len(elements),
-        )
-        elements.insert(insert_index, question)
+    question = qsf.questions.get(question_id)
+    if question is None:
+        qsf.insert_before(make_chatbot_redirect_question(qsf, question_id, chatbot_url, password), "STAT")
         return
 
     payload = question.setdefault("Payload", {})
@@ -437,13 +482,12 @@ def ensure_chatbot_redirect_question(
 
 
 def prepare_qsf(
-    qsf_path: Path,
+    qsf: QsfDocument,
     output_path: Path,
     chatbot_url: str,
     password: str,
     codes: dict[str, str],
-) -> dict[str, Any]:
-    qsf = json.loads(qsf_path.read_text(encoding="utf-8"))
+) -> QsfDocument:
     survey_flow = find_survey_flow(qsf)
     ensure_embedded_data_fields(
         survey_flow,
@@ -469,7 +513,7 @@ def prepare_qsf(
         password=password,
     )
 
-    output_path.write_text(compact_json(qsf), encoding="utf-8")
+    output_path.write_text(qsf.dumps(), encoding="utf-8")
     return qsf
 
 
@@ -505,11 +549,11 @@ def make_prolific_completion_actions(
 
 def build_study_payload(
     args: argparse.Namespace,
-    qsf: dict[str, Any],
+    qsf: QsfDocument,
     external_study_url: str,
     codes: dict[str, str],
 ) -> dict[str, Any]:
-    survey_name = qsf.get("SurveyEntry", {}).get("SurveyName", "Qualtrics study")
+    survey_name = qsf.survey_entry.get("SurveyName", "Qualtrics study")
     estimated_minutes = args.estimated_completion_time or derive_estimated_minutes(qsf, 20)
     description = args.description or derive_intro_description(qsf)
 
@@ -565,22 +609,157 @@ def build_study_payload(
     return payload
 
 
-def prolific_request(method: str, token: str, path: str, payload: dict[str, Any] | None = None) -> dict[str, Any]:
-    headers = {
-        "Authorization": f"Token {token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.request(
-        method,
-        f"{PROLIFIC_API_URL}{path}",
-        headers=headers,
-        json=payload,
-        timeout=30,
-    )
-    response.raise_for_status()
-    if response.content:
-        return response.json()
-    return {}
+class RateLimiter:
+    """Space calls at least 1/per_second apart across threads."""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ProlificClient:
+    """Prolific API client over one keep-alive session.
+
+    Every request is retried with exponential backoff on connection errors, 429
+    and 5xx responses. Retrying a create or publish is made safe by checking
+    first whether an earlier attempt already took effect. base_url can point at a
+    local stub such as scripts/prolific_stub_server.py.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = PROLIFIC_API_URL,
+        *,
+        pool_size: int = 4,
+        rate_limiter: RateLimiter | None = None,
+        max_attempts: int = 5,
+        backoff_s: float = 1.0,
+        timeout: tuple[float, float] = (5, 30),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Token {token}", "Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _retry_delay(self, attempt: int, response: requests.Response | None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_s * (2 ** attempt) * (0.5 + secrets.randbelow(1000) / 1000)
+
+    def request(self, method: str, path: str, payload: dict[str, Any] | None = None, *, before_retry=None) -> dict[str, Any]:
+        """Send one API call. before_retry() may return a result to use instead of retrying."""
+        for attempt in range(self.max_attempts):
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+            response = None
+            try:
+                # Pagination links are absolute URLs
+                url = path if path.startswith(("http://", "https://")) else f"{self.base_url}{path}"
+                response = self.session.request(method, url, json=payload, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json() if response.content else {}
+            except (requests.ConnectionError, requests.Timeout):
+                pass
+            if attempt + 1 == self.max_attempts:
+                if response is not None:
+                    response.raise_for_status()
+                raise requests.ConnectionError(f"{method} {path} failed after {self.max_attempts} attempts")
+            time.sleep(self._retry_delay(attempt, response))
+            if before_retry:
+                result = before_retry()
+                if result is not None:
+                    return result
+        return {}
+
+    def validate_token(self) -> dict[str, Any]:
+        return self.request("GET", "/workspaces/")
+
+    def find_study(self, internal_name: str, external_study_url: str) -> dict[str, Any] | None:
+        """Find a draft study with this internal name and URL on any page of the study list.
+
+        Only drafts match, so a published study from an earlier wave that reused
+        the same names is never picked up.
+        """
+        path: str | None = "/studies/"
+        while path:
+            page = self.request("GET", path)
+            for study in page.get("results", []):
+                if (
+                    study.get("internal_name") == internal_name
+                    and study.get("external_study_url") == external_study_url
+                    and study.get("status") == DRAFT_STUDY_STATUS
+                ):
+                    return study
+            path = ((page.get("_links") or {}).get("next") or {}).get("href")
+        return None
+
+    def get_study(self, study_id: str) -> dict[str, Any]:
+        return self.request("GET", f"/studies/{study_id}/")
+
+    def update_study(self, study_id: str, payload: dict[str, Any]) -> dict[str, Any]:
+        return self.request("PATCH", f"/studies/{study_id}/", payload)
+
+    def create_study(self, payload: dict[str, Any], study_id: str = "") -> tuple[dict[str, Any], bool]:
+        """Create a draft study, or reuse the draft recorded by an earlier run (study_id) or matching by name and URL.
+
+        Only drafts are reused, and they are updated with payload so their completion
+        codes match the ones just written into the QSF. Returns (study, reused).
+        """
+        existing = None
+        if study_id:
+            try:
+                recorded = self.get_study(study_id)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+            else:
+                if recorded.get("status") == DRAFT_STUDY_STATUS:
+                    existing = recorded
+        internal_name = payload.get("internal_name", "")
+        external_study_url = payload.get("external_study_url", "")
+        existing = existing or self.find_study(internal_name, external_study_url)
+        if existing:
+            return self.update_study(existing["id"], payload), True
+        # A timed-out POST may still have created the study; look before posting again
+        study = self.request(
+            "POST",
+            "/studies/",
+            payload,
+            before_retry=lambda: self.find_study(internal_name, external_study_url),
+        )
+        return study, False
+
+    def publish_study(self, study_id: str) -> bool:
+        """Publish a draft study. Returns False if it was already published."""
+
+        def already_published():
+            return {} if self.get_study(study_id).get("status") in PUBLISHED_STUDY_STATUSES else None
+
+        if already_published() is not None:
+            return False
+        self.request("POST", f"/studies/{study_id}/transition/", {"action": "PUBLISH"}, before_retry=already_published)
+        return True
 
 
 def require_token(args: argparse.Namespace, env: dict[str, str]) -> str:
@@ -590,6 +769,10 @@ def require_token(args: argparse.Namespace, env: dict[str, str]) -> str:
     return token
 
 
+def prolific_api_url(args: argparse.Namespace, env: dict[str, str]) -> str:
+    return (args.prolific_api_url or env.get("PROLIFIC_API_URL", "") or PROLIFIC_API_URL).strip()
+
+
 def write_setup_summary(summary_path: Path, summary: dict[str, Any]) -> None:
     summary_path.write_text(json.dumps(summary, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
 
@@ -616,6 +799,10 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--chatbot-url", help="Explicit public StreetGPT URL.")
     parser.add_argument("--password", help="StreetGPT URL password override.")
     parser.add_argument("--prolific-token", help="Prolific API token override.")
+    parser.add_argument(
+        "--prolific-api-url",
+        help="Prolific API base URL, e.g. http://127.0.0.1:8765/api/v1 for scripts/prolific_stub_server.py.",
+    )
     parser.add_argument("--study-name", help="Participant-facing Prolific study name.")
     parser.add_argument("--internal-name", help="Internal Prolific study name.")
     parser.add_argument("--description", help="Participant-facing Prolific description.")
@@ -640,13 +827,26 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--publish-study", action="store_true", help="Publish the created study after draft creation.")
     parser.add_argument("--validate-token", action="store_true", help="Validate the Prolific API token.")
     parser.add_argument("--filters", type=json.loads, help="Optional raw JSON array of Prolific filters.")
+    parser.add_argument(
+        "--manifest",
+        help="JSON manifest of survey variants to set up in one run (see run_batch).",
+    )
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 4, help="Parallel workers in batch mode.")
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=DEFAULT_PROLIFIC_REQUESTS_PER_SECOND,
+        help="Maximum Prolific API requests per second in batch mode.",
+    )
     return parser.parse_args()
 
 
-def main() -> int:
-    args = parse_args()
-    env = load_env_file(Path(args.env_file))
+def summary_path_for(output_path: Path) -> Path:
+    return output_path.with_name(f"{slugify_filename(output_path.stem)}.setup.json")
 
+
+def patch_variant(args: argparse.Namespace, env: dict[str, str]) -> dict[str, Any]:
+    """Patch one QSF and build its Prolific payload; no network access."""
     qsf_path = Path(args.qsf)
     if not qsf_path.exists():
         raise FileNotFoundError(f"QSF file not found: {qsf_path}")
@@ -658,7 +858,9 @@ def main() -> int:
     if not password:
         raise ValueError("PASSWORD is missing. Add it to .env or pass --password.")
 
-    existing_chatbot_url = extract_existing_chatbot_url(qsf_path)
+    # Parse once; every lookup and patch below runs against this index
+    qsf = QsfDocument.load(qsf_path)
+    existing_chatbot_url = extract_existing_chatbot_url(qsf)
     chatbot_url = normalize_public_chatbot_url(
         args.chatbot_url
         or env.get("CHATBOT_PUBLIC_URL", "")
@@ -666,14 +868,13 @@ def main() -> int:
         or existing_chatbot_url
     )
     codes = build_completion_codes(args)
-    qsf = prepare_qsf(qsf_path, output_path, chatbot_url, password, codes)
+    prepare_qsf(qsf, output_path, chatbot_url, password, codes)
 
     qualtrics_url = (args.qualtrics_url or env.get("QUALTRICS_SURVEY_URL", "")).strip()
     external_study_url = build_external_study_url(qualtrics_url) if qualtrics_url else ""
     payload = build_study_payload(args, qsf, external_study_url, codes) if external_study_url else None
 
-    summary_path = output_path.with_name(f"{slugify_filename(output_path.stem)}.setup.json")
-    summary: dict[str, Any] = {
+    return {
         "input_qsf": str(qsf_path),
         "output_qsf": str(output_path),
         "chatbot_public_url": chatbot_url,
@@ -685,34 +886,42 @@ def main() -> int:
         "published": False,
     }
 
-    token: str | None = None
-    if args.validate_token or args.create_study:
-        token = require_token(args, env)
-
-    if args.validate_token and token:
-        summary["token_check"] = prolific_request("GET", token, "/workspaces/")
-
-    if args.create_study:
-        if not external_study_url:
-            raise ValueError("A live Qualtrics URL is required to create a Prolific study.")
-        if args.reward is None or args.total_available_places is None:
-            raise ValueError("--reward and --total-available-places are required when --create-study is used.")
-        result = prolific_request("POST", token, "/studies/", payload)
-        summary["prolific_result"] = result
-        if args.publish_study:
-            prolific_request("POST", token, f"/studies/{result['id']}/transition/", {"action": "PUBLISH"})
-            summary["published"] = True
 
-    write_setup_summary(summary_path, summary)
+def recorded_study_id(summary: dict[str, Any]) -> str:
+    """Study ID from an earlier run's summary for the same output QSF and Qualtrics URL."""
+    summary_path = summary_path_for(Path(summary["output_qsf"]))
+    try:
+        previous = json.loads(summary_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return ""
+    if previous.get("external_study_url") != summary["external_study_url"]:
+        return ""
+    return (previous.get("prolific_result") or {}).get("id", "")
+
 
-    print(f"Patched QSF written to: {output_path}")
+def create_variant_study(args: argparse.Namespace, client: ProlificClient, summary: dict[str, Any]) -> None:
+    if not summary["external_study_url"]:
+        raise ValueError("A live Qualtrics URL is required to create a Prolific study.")
+    if args.reward is None or args.total_available_places is None:
+        raise ValueError("--reward and --total-available-places are required when --create-study is used.")
+    result, reused = client.create_study(summary["prolific_payload"], recorded_study_id(summary))
+    summary["prolific_result"] = result
+    summary["reused_existing_study"] = reused
+    if args.publish_study:
+        client.publish_study(result["id"])
+        summary["published"] = True
+
+
+def print_summary(summary: dict[str, Any], summary_path: Path) -> None:
+    codes = summary["completion_codes"]
+    print(f"Patched QSF written to: {summary['output_qsf']}")
     print(f"Setup summary written to: {summary_path}")
-    print(f"Chatbot public URL: {chatbot_url}")
+    print(f"Chatbot public URL: {summary['chatbot_public_url']}")
     print(f"Completed code: {codes['complete']}")
     print(f"Screen-out code: {codes['screenout']}")
     print(f"Poor-quality code: {codes['poor_quality']}")
-    if external_study_url:
-        print(f"Prolific external study URL: {external_study_url}")
+    if summary["external_study_url"]:
+        print(f"Prolific external study URL: {summary['external_study_url']}")
     else:
         print("Prolific external study URL: <missing Qualtrics URL>")
     if summary["prolific_result"]:
@@ -720,8 +929,115 @@ def main() -> int:
         print(f"Study status: {summary['prolific_result'].get('status')}")
     if summary["published"]:
         print("Study publish action: PUBLISH")
+
+
+def run_single(args: argparse.Namespace, env: dict[str, str]) -> int:
+    summary = patch_variant(args, env)
+
+    if args.validate_token or args.create_study:
+        client = ProlificClient(require_token(args, env), prolific_api_url(args, env))
+        try:
+            if args.validate_token:
+                summary["token_check"] = client.validate_token()
+            if args.create_study:
+                create_variant_study(args, client, summary)
+        finally:
+            client.close()
+
+    summary_path = summary_path_for(Path(summary["output_qsf"]))
+    write_setup_summary(summary_path, summary)
+    print_summary(summary, summary_path)
     return 0
 
 
+def variant_args(base: argparse.Namespace, defaults: dict[str, Any], variant: dict[str, Any]) -> argparse.Namespace:
+    # Manifest keys mirror the CLI options, e.g. "study-name" or "study_name"
+    values = vars(base).copy()
+    for key, value in {**defaults, **variant}.items():
+        values[key.replace("-", "_")] = value
+    return argparse.Namespace(**values)
+
+
+def run_batch(args: argparse.Namespace, env: dict[str, str]) -> int:
+    """Set up every variant in a manifest such as:
+
+    {
+      "defaults": {"reward": 300, "total_available_places": 200, "create_study": true},
+      "variants": [
+        {"qsf": "election_conspiracy_experiment_files/2025_American_Survey_original.qsf",
+         "qualtrics_url": "https://...", "study_name": "Survey (control)"},
+        {"qsf": "...", "qualtrics_url": "https://...", "study_name": "Survey (chatbot)"}
+      ],
+      "summary": "election_conspiracy_experiment_files/setup_summary.json"
+    }
+    """
+    manifest_path = Path(args.manifest)
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    variants = [variant_args(args, manifest.get("defaults", {}), variant) for variant in manifest.get("variants", [])]
+    if not variants:
+        raise ValueError(f"No variants in {manifest_path}")
+    jobs = max(1, args.jobs)
+
+    results: list[dict[str, Any]] = [{} for _ in variants]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(variants))) as pool:
+        futures = [pool.submit(patch_variant, variant, env) for variant in variants]
+        for index, future in enumerate(futures):
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = {"input_qsf": variants[index].qsf, "error": f"{type(e).__name__}: {e}"}
+
+    creating = [i for i, variant in enumerate(variants) if variant.create_study and "error" not in results[i]]
+    token_check = None
+    if creating or args.validate_token:
+        client = ProlificClient(
+            require_token(args, env),
+            prolific_api_url(args, env),
+            pool_size=jobs,
+            rate_limiter=RateLimiter(args.rate_limit),
+        )
+        if args.validate_token:
+            token_check = client.validate_token()
+
+        def create(index: int) -> None:
+            try:
+                create_variant_study(variants[index], client, results[index])
+            except Exception as e:
+                results[index]["error"] = f"{type(e).__name__}: {e}"
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(create, creating))
+        client.close()
+
+    for summary in results:
+        if "output_qsf" in summary:
+            summary_path = summary_path_for(Path(summary["output_qsf"]))
+            write_setup_summary(summary_path, summary)
+            summary["setup_summary"] = str(summary_path)
+
+    combined_path = Path(manifest.get("summary") or manifest_path.with_name(f"{manifest_path.stem}.setup.json"))
+    combined: dict[str, Any] = {"manifest": str(manifest_path), "variants": results}
+    if token_check is not None:
+        combined["token_check"] = token_check
+    write_setup_summary(combined_path, combined)
+
+    failed = [summary for summary in results if "error" in summary]
+    for summary in results:
+        status = summary.get("error") or (
+            f"study {summary['prolific_result']['id']}" if summary.get("prolific_result") else "patched"
+        )
+        print(f"{summary.get('input_qsf')}: {status}")
+    print(f"Combined setup summary written to: {combined_path}")
+    return 1 if failed else 0
+
+
+def main() -> int:
+    args = parse_args()
+    env = load_env_file(Path(args.env_file))
+    if args.manifest:
+        return run_batch(args, env)
+    return run_single(args, env)
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
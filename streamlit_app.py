@@ -1,152 +1,75 @@
 import html
 import json
-import os
-import random
-import re
-import string
-from datetime import datetime
-from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
-
-import pytz
+import threading
+import time
+from functools import partial
+
 import streamlit as st
 import streamlit.components.v1 as components
-import tiktoken
-import yaml
-from openai import OpenAI
-from pymongo import ASCENDING, MongoClient
+from pymongo import MongoClient
 from pymongo.errors import PyMongoError
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from tenacity import RetryError, retry, stop_after_attempt, wait_random_exponential
 
-### Setup ##
-
-def get_secret(name: str, default=None):
-    # Read only from environment to avoid requiring a secrets.toml
-    env_val = os.getenv(name)
-    return env_val if (env_val is not None and env_val != "") else default
-
-
-def get_query_param(url_params: dict[str, list[str]], name: str, default=""):
-    value = url_params.get(name, [default])
-    if not value:
-        return default
-    return value[0]
-
-
-def parse_int_param(value, default=0) -> int:
-    try:
-        return int(str(value).strip())
-    except (TypeError, ValueError):
-        return default
-
-
-def normalize_claim(value):
-    if value is None:
-        return 0
-    claim = str(value).strip()
-    return claim if claim else 0
-
-
-def normalize_language(value) -> str:
-    language = str(value or "english").strip().lower()
-    return language if language in {"english", "german"} else "english"
-
-
-def parse_bool_param(value, default=False) -> bool:
-    if value is None:
-        return default
-    normalized = str(value).strip().lower()
-    if not normalized:
-        return default
-    if normalized in {"1", "true", "yes", "y", "on", "control"}:
-        return True
-    if normalized in {"0", "false", "no", "n", "off", "treatment"}:
-        return False
-    return default
+from streetgpt.admin import render_admin_page
+from streetgpt.admission import (
+    WAITING_ROOM_REFRESH_S,
+    load_screenout_codes,
+    make_admission_controller,
+    screenout_message,
+    screenout_url,
+    waiting_room_message,
+)
+from streetgpt.cache import first_turn_cache_key, iter_cached_deltas, make_first_turn_cache
+from streetgpt.claims import CLAIMS_COLLECTION, apply_claim_registry, load_claim_registry, prompt_claims
+from streetgpt.core import (
+    ASSISTANT_AVATAR,
+    DUPLICATE_PARTICIPANT_MESSAGE,
+    USER_AVATAR,
+    append_chat_outcome_to_return_url,
+    build_chat_outcome,
+    conversation_status_fields,
+    find_previous_participation,
+    generate_random_id,
+    get_current_time_in_berlin,
+    get_duplicate_participant_policy,
+    get_opening_message,
+    get_query_param,
+    get_secret,
+    get_system_message,
+    iter_response_deltas,
+    load_conversation_state,
+    load_system_messages,
+    make_openai_client,
+    new_conversation_document,
+    num_tokens_from_prompt,
+    parse_int_param,
+    parse_query_context,
+    reactivate_conversation,
+    should_end_chat,
+    stored_input_active,
+)
+from streetgpt.errors import error_entry, push_errors
+from streetgpt.metrics import METRICS
+from streetgpt.routing import count_user_turns, make_model_router
+from streetgpt.session import SESSION_REGISTRY, ChatMessage, ErrorLog, IdleSessionReaper, shared_text
+from streetgpt.speculative import consent_reply, make_first_turn_speculator, make_generate, wait_for_speculation
+from streetgpt.tracing import NOOP_SPAN, NOOP_TRACE, make_tracer, turn_attributes
+from streetgpt.warmup import warm_up
 
+### Setup ##
 
 def read_query_context():
-    url_params = st.experimental_get_query_params()
-    legacy_claim = normalize_claim(get_query_param(url_params, "claim", ""))
-    legacy_credence = parse_int_param(get_query_param(url_params, "credence", 0), 0)
-    survey_claim = normalize_claim(
-        get_query_param(
-            url_params,
-            "survey_claim",
-            get_query_param(url_params, "evaluation_claim", legacy_claim),
-        )
-    )
-    survey_claim_initial_credence = parse_int_param(
-        get_query_param(
-            url_params,
-            "survey_claim_initial_credence",
-            get_query_param(
-                url_params,
-                "survey_credence",
-                get_query_param(url_params, "evaluation_credence", legacy_credence),
-            ),
-        ),
-        0,
-    )
-    control_flag = parse_bool_param(
-        get_query_param(url_params, "control_flag", get_query_param(url_params, "control", "0")),
-        False,
-    )
-    control_claim = normalize_claim(
-        get_query_param(url_params, "control_claim", get_query_param(url_params, "control_claim_text", "")),
-    )
-    discussion_claim_override = normalize_claim(
-        get_query_param(url_params, "discussion_claim_seed", get_query_param(url_params, "discussion_claim", "")),
-    )
-    if discussion_claim_override not in (None, 0, "0"):
-        discussion_claim_seed = discussion_claim_override
-    else:
-        discussion_claim_seed = survey_claim
-
-    return {
-        "password": get_query_param(url_params, "password", "na"),
-        "survey_claim": survey_claim,
-        "survey_claim_initial_credence": survey_claim_initial_credence,
-        "control_flag": control_flag,
-        "control_claim": control_claim,
-        "discussion_claim_seed": discussion_claim_seed,
-        "launch_nonce": str(get_query_param(url_params, "launch_nonce", "")).strip(),
-        "id": str(get_query_param(url_params, "id", "")).strip(),
-        "language": normalize_language(get_query_param(url_params, "language", "english")),
-        "prolific_pid": str(get_query_param(url_params, "prolific_pid", "")).strip(),
-        "study_id": str(get_query_param(url_params, "study_id", "")).strip(),
-        "session_id": str(get_query_param(url_params, "session_id", "")).strip(),
-        "return_url": str(get_query_param(url_params, "return_url", "")).strip(),
-    }
-
-# ---- Helper utilities (must be defined before first use) ----
-def generate_random_id(length=10):
-    letters = string.ascii_letters + string.digits
-    result_str = ''.join(random.choice(letters) for i in range(length))
-    return result_str
+    return parse_query_context(st.experimental_get_query_params())
 
-def get_current_time_in_berlin():
-    berlin_tz = pytz.timezone('Europe/Berlin')
-    current_time = datetime.now(berlin_tz)
-    formatted_time = current_time.strftime("%Y-%m-%d %H:%M:%S %Z%z")
-    return formatted_time
 
-def num_tokens_from_prompt(prompt, encoding_name="cl100k_base") -> int:
-    """Returns the number of tokens in a text string."""
-    string_buf = ""
-    for dic in prompt:
-        content = dic.get("content")
-        string_buf += f"{content}\n"
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string_buf))
-    return num_tokens
+def current_session_key() -> str:
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else ""
 
 
-def should_end_chat(response: str) -> bool:
-    lowered = response.lower()
-    return "goodbye" in lowered or "return to the survey" in lowered
-
-
-def render_return_handoff(return_url: str):
+def render_return_handoff(return_url: str, label: str = "Return to the survey"):
     if not return_url:
         return
 
@@ -157,7 +80,7 @@ def render_return_handoff(return_url: str):
             f'<a href="{safe_return_url}" target="_self" '
             'style="display:inline-block;padding:0.6rem 1rem;'
             'border-radius:0.5rem;border:1px solid #d0d7de;'
-            'text-decoration:none;font-weight:600;">Return to the survey</a>'
+            f'text-decoration:none;font-weight:600;">{html.escape(label)}</a>'
             '</div>'
         ),
         unsafe_allow_html=True,
@@ -175,165 +98,77 @@ def render_return_handoff(return_url: str):
     )
 
 
-def truncate_text(value: str, limit: int = 500) -> str:
-    collapsed = re.sub(r"\s+", " ", str(value or "")).strip()
-    return collapsed[:limit]
+def render_waiting_room_refresh(ticket: str, delay_s: int):
+    # The browser reloads the page, so no script thread is held while the participant waits;
+    # the ticket in the URL keeps their place in the queue across reloads.
+    components.html(
+        f"""
+        <script>
+        window.setTimeout(function() {{
+          var url = new URL(window.top.location.href);
+          url.searchParams.set("admission_ticket", {json.dumps(ticket)});
+          window.top.location.replace(url.toString());
+        }}, {delay_s * 1000});
+        </script>
+        """,
+        height=0,
+    )
+
+
+def record_error(stage: str, message, error_type: str = ""):
+    st.session_state["errors"].add(error_entry(stage, message, error_type))
 
 
-def normalize_credence(value, default=None):
-    parsed = parse_int_param(value, 0)
-    if 1 <= parsed <= 10:
-        return parsed
-    return default
+def record_exception(stage: str, e: Exception):
+    record_error(stage, str(e), type(e).__name__)
 
 
-def extract_json_object(raw_text: str) -> dict:
-    text = (raw_text or "").strip()
-    if text.startswith("```"):
-        text = re.sub(r"^```(?:json)?\s*", "", text)
-        text = re.sub(r"\s*```$", "", text)
-    start = text.find("{")
-    end = text.rfind("}")
-    if start == -1 or end == -1 or end < start:
-        raise ValueError("No JSON object found in extractor response")
-    return json.loads(text[start:end + 1])
+def current_return_url() -> str:
+    # Only the base URL is kept in session state; outcome fields are appended on demand.
+    return_url_base = st.session_state.get("return_url_base", "")
+    chat_outcome = st.session_state.get("chat_outcome") or {}
+    if not chat_outcome:
+        return return_url_base
+    return append_chat_outcome_to_return_url(return_url_base, chat_outcome)
 
 
-def compose_chat_outcome(discussion_claim: str, initial_credence, final_credence) -> dict:
+def outcome_fields() -> dict:
+    chat_outcome = st.session_state.get("chat_outcome") or {}
     return {
-        "discussion_claim": discussion_claim,
-        "discussion_claim_initial_credence": initial_credence,
-        "discussion_claim_final_credence": final_credence,
+        "discussion_claim": chat_outcome.get("discussion_claim", ""),
+        "discussion_claim_initial_credence": chat_outcome.get("discussion_claim_initial_credence"),
+        "discussion_claim_final_credence": chat_outcome.get("discussion_claim_final_credence"),
     }
 
 
-def normalize_chat_outcome(raw_outcome: dict, seeded_discussion_claim) -> dict:
-    seeded_claim_text = ""
-    if seeded_discussion_claim not in (None, 0, "0"):
-        seeded_claim_text = truncate_text(seeded_discussion_claim)
+# Setup MongoDB
+@st.cache_resource
+def get_mongo_client(uri: str):
+    return MongoClient(uri)
 
-    discussion_claim = truncate_text(
-        raw_outcome.get("discussion_claim")
-        or raw_outcome.get("discussion_claim_text")
-        or raw_outcome.get("revised_claim")
-        or raw_outcome.get("revised_claim_text")
-        or raw_outcome.get("clarified_claim")
-        or seeded_claim_text
-    )
-    initial_credence = normalize_credence(
-        raw_outcome.get("discussion_claim_initial_credence")
-        or raw_outcome.get("revised_claim_initial_credence")
-        or raw_outcome.get("clarified_claim_initial_confidence"),
-        default=None,
-    )
-    final_credence = normalize_credence(
-        raw_outcome.get("discussion_claim_final_credence")
-        or raw_outcome.get("revised_claim_final_credence")
-        or raw_outcome.get("clarified_claim_final_confidence"),
-        default=None,
-    )
-    return compose_chat_outcome(discussion_claim, initial_credence, final_credence)
-
-
-def build_chat_outcome(
-    messages,
-    seeded_discussion_claim,
-    survey_claim="",
-    control_flag=False,
-    control_claim="",
-):
-    transcript_lines = []
-    for message in messages:
-        content = str(message.get("content", "")).strip()
-        role = str(message.get("role", "")).strip().lower()
-        if content and role in {"assistant", "user"}:
-            transcript_lines.append(f"{role.upper()}: {content}")
-    transcript = "\n\n".join(transcript_lines)
-
-    fallback = normalize_chat_outcome({}, seeded_discussion_claim)
-    fallback["extractor_status"] = "fallback"
-    fallback["extractor_model"] = ""
-
-    if not transcript:
-        fallback["extractor_error"] = "empty_transcript"
-        return fallback
-
-    extraction_system = (
-        "You extract structured study outcomes from a finished Street Epistemology chat. "
-        "Return JSON only with keys discussion_claim, discussion_claim_initial_credence, and discussion_claim_final_credence. "
-        "discussion_claim should be the clarified or rephrased version of the SURVEY CLAIM that the participant settled on near the start of the chat. "
-        "discussion_claim_initial_credence should be the 1-10 confidence they gave for that clarified survey claim near the start of the chat, after clarification. "
-        "discussion_claim_final_credence should be the 1-10 confidence they gave at the end for that same clarified survey claim. "
-        "If this is a control-condition transcript, the middle of the conversation may discuss a separate control claim. Ignore that and still extract only the clarified survey claim and its baseline/endline confidence. "
-        "Use null for missing values. Do not infer a final credence unless the participant explicitly gives one."
-    )
-    seeded_claim_text = "" if seeded_discussion_claim in (None, 0, "0") else str(seeded_discussion_claim)
-    survey_claim_text = "" if survey_claim in (None, 0, "0") else str(survey_claim)
-    control_claim_text = "" if control_claim in (None, 0, "0") else str(control_claim)
-    extraction_user = (
-        f"Condition: {'control' if control_flag else 'treatment'}\n"
-        f"Survey claim measured in Qualtrics outside the chatbot: {survey_claim_text or 'null'}\n"
-        f"Seeded discussion claim for the chatbot: {seeded_claim_text or 'null'}\n\n"
-        f"Separate control-claim discussion topic, if any: {control_claim_text or 'null'}\n\n"
-        f"Transcript:\n{transcript}"
-    )
-    model = st.session_state.get("openai_model", get_secret("OPENAI_MODEL", "gpt-5"))
+@st.cache_resource
+def get_mongo_db(_client: MongoClient, db_name: str):
+    return _client[db_name]
 
-    try:
-        request_kwargs = {
-            "model": model,
-            "input": [
-                {"role": "system", "content": extraction_system},
-                {"role": "user", "content": extraction_user},
-            ],
-        }
-        if str(model).lower().startswith("gpt-5"):
-            request_kwargs["reasoning"] = {"effort": "low"}
-        response = client.responses.create(**request_kwargs)
-        parsed = extract_json_object(response.output_text or "")
-        outcome = normalize_chat_outcome(parsed, seeded_discussion_claim)
-        outcome["extractor_status"] = "ok"
-        outcome["extractor_model"] = model
-        return outcome
-    except Exception as e:
-        st.session_state["error_messages"] += f"chat_outcome_extract_error: {type(e).__name__}: {e}\n"
-        fallback["extractor_error"] = f"{type(e).__name__}: {e}"
-        fallback["extractor_model"] = model
-        return fallback
-
-
-def append_chat_outcome_to_return_url(return_url: str, chat_outcome: dict) -> str:
-    if not return_url:
-        return return_url
-
-    split_url = urlsplit(return_url)
-    params = dict(parse_qsl(split_url.query, keep_blank_values=True))
-    for legacy_field_name in (
-        "revised_claim",
-        "revised_claim_text",
-        "revised_claim_initial_credence",
-        "revised_claim_final_credence",
-    ):
-        params.pop(legacy_field_name, None)
-    for field_name in (
-        "discussion_claim",
-        "discussion_claim_initial_credence",
-        "discussion_claim_final_credence",
-    ):
-        value = chat_outcome.get(field_name)
-        if value in (None, ""):
-            params.pop(field_name, None)
-        else:
-            params[field_name] = str(value)
-    return urlunsplit(
-        (
-            split_url.scheme,
-            split_url.netloc,
-            split_url.path,
-            urlencode(params, doseq=True),
-            split_url.fragment,
-        )
+MONGO_URI = get_secret("MONGO_URI")
+MONGO_DB_NAME = get_secret("MONGO_DB_NAME", "streetgpt")
+mongo_client = get_mongo_client(MONGO_URI)
+mongo_db = get_mongo_db(mongo_client, MONGO_DB_NAME)
+conversations_col = mongo_db["conversations"]
+
+APP_NAME = get_secret("APP_NAME", "streetgpt")
+
+# Operator view, guarded by its own secret
+url_params = st.experimental_get_query_params()
+if get_query_param(url_params, "view", "") == "admin":
+    admin_secret = get_secret("ADMIN_PASSWORD", "")
+    if not admin_secret or get_query_param(url_params, "admin_password", "") != admin_secret:
+        st.write("Wrong password in URL parameter 'admin_password'")
+        st.stop()
+    render_admin_page(
+        SESSION_REGISTRY, conversations_col, APP_NAME, parse_int_param(get_query_param(url_params, "refresh_s", "0"), 0)
     )
+    st.stop()
 
 query_context = read_query_context()
 st.session_state["password"] = query_context["password"]
@@ -350,152 +185,184 @@ if st.session_state["password_correct"] == False:
     st.write("Wrong password in URL parameter 'password'")
     st.stop()
 
-# Setup MongoDB
+# Canonical claim texts and stable claim IDs, loaded once per process
 @st.cache_resource
-def get_mongo_client(uri: str):
-    return MongoClient(uri)
+def get_claim_registry(_db):
+    return load_claim_registry(_db[CLAIMS_COLLECTION], on_error=st.error)
+
+query_context = apply_claim_registry(query_context, get_claim_registry(mongo_db), mongo_db[CLAIMS_COLLECTION])
+
 
+def close_streamlit_session(session_key: str):
+    Runtime.instance().close_session(session_key)
+
+# Evict sessions idle for longer than IDLE_SESSION_TIMEOUT_MINUTES (0 disables).
+# Unfinished conversations are flushed and marked abandoned; rehydration resumes them.
 @st.cache_resource
-def get_mongo_db(_client: MongoClient, db_name: str):
-    return _client[db_name]
+def start_idle_reaper(_collection, idle_timeout_minutes: float):
+    if idle_timeout_minutes <= 0:
+        return None
+    reaper = IdleSessionReaper(
+        SESSION_REGISTRY,
+        _collection,
+        close_session=close_streamlit_session,
+        idle_timeout_s=idle_timeout_minutes * 60,
+    )
+    reaper.start()
+    return reaper
 
-MONGO_URI = get_secret("MONGO_URI")
-MONGO_DB_NAME = get_secret("MONGO_DB_NAME", "streetgpt")
-mongo_client = get_mongo_client(MONGO_URI)
-mongo_db = get_mongo_db(mongo_client, MONGO_DB_NAME)
-conversations_col = mongo_db["conversations"]
+start_idle_reaper(conversations_col, float(get_secret("IDLE_SESSION_TIMEOUT_MINUTES", "30")))
 
-# Ensure indexes (idempotent)
-try:
-    conversations_col.create_index([("session_id", ASCENDING)], unique=True)
-    conversations_col.create_index([("created_at", ASCENDING)])
-    conversations_col.create_index([("app", ASCENDING)])
-except Exception:
-    pass
 
+def restore_conversation_state(stored: dict):
+    st.session_state["messages"] = [
+        ChatMessage(m.get("role", ""), m.get("content", "")) for m in stored.get("messages") or []
+    ]
+    st.session_state["prompt_tokens"] = stored.get("prompt_tokens") or 0
+    st.session_state["completion_tokens"] = stored.get("completion_tokens") or 0
+    st.session_state["last_model"] = stored.get("last_model") or ""
+    st.session_state["chat_outcome"] = stored.get("chat_outcome") or {}
+    st.session_state["input_active"] = stored_input_active(stored)
 
-APP_NAME = get_secret("APP_NAME", "streetgpt")
+# Load system messages from YAML config once per process
+@st.cache_resource
+def get_system_messages():
+    return load_system_messages(on_error=st.error)
 
-# Load system messages from YAML config
-def load_system_messages():
-    # Default path inside container, fallback to local dev path
-    default_path = "/app/config/system_messages.yaml"
-    path = get_secret("SYSTEM_MESSAGES_FILE", default_path)
-    if not os.path.isfile(path):
-        # local fallback for non-docker runs
-        local_fallback = os.path.join(os.path.dirname(__file__), "config", "system_messages.yaml")
-        if os.path.isfile(local_fallback):
-            path = local_fallback
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f) or {}
-    except Exception as e:
-        st.error(f"Failed to load system messages from {path}: {e}")
-        return {}
-
-SYSTEM_MESSAGES = load_system_messages()
-
-def get_system_message(
-    survey_claim: str | int,
-    survey_claim_initial_credence: int,
-    discussion_claim_seed: str | int,
-    control_claim: str | int,
-    control_flag: bool,
-    language: str,
-):
-    is_claim = 0 if discussion_claim_seed == 0 else 1
-    lang_key = "german" if language == "german" else "english"
-    if is_claim:
-        template_key = "with_claim_control" if control_flag else "with_claim"
-        template = ((SYSTEM_MESSAGES.get(template_key, {}) or {}).get(lang_key))
-        if not template:
-            template = ((SYSTEM_MESSAGES.get("with_claim", {}) or {}).get(lang_key))
-        if not template:
-            template = "You are StreetGPT. Keep answers concise. Claim: {claim}."
-        try:
-            return template.format(
-                claim=discussion_claim_seed,
-                credence=survey_claim_initial_credence,
-                survey_claim=survey_claim,
-                survey_credence=survey_claim_initial_credence,
-                survey_claim_initial_credence=survey_claim_initial_credence,
-                discussion_claim=discussion_claim_seed,
-                control_claim=control_claim,
-            )
-        except Exception:
-            return template
-    else:
-        message = (
-            (SYSTEM_MESSAGES.get("no_claim", {}) or {}).get(lang_key)
-        )
-        if not message:
-            message = "You are StreetGPT. Keep answers concise."
-        return message
+SYSTEM_MESSAGES = get_system_messages()
 
 # ---- OpenAI client and chat helpers (defined before UI logic) ----
-client = OpenAI(api_key=get_secret("OPENAI_API_KEY"))  # Initialize OpenAI client once
+@st.cache_resource
+def get_openai_client():
+    return make_openai_client()
+
+client = get_openai_client()  # Initialize OpenAI client once per process
+
+# Build indexes and fill the Mongo and OpenAI pools once per process, off the
+# participant's critical path (the container entrypoint already ran the same warmup).
+@st.cache_resource
+def start_backend_warmup(_collection, _client):
+    thread = threading.Thread(target=warm_up, args=(_collection, _client), name="backend-warmup", daemon=True)
+    thread.start()
+    return thread
+
+start_backend_warmup(conversations_col, client)
+
+# Shared first-turn response cache; None unless FIRST_TURN_CACHE is set
+@st.cache_resource
+def get_first_turn_cache(_db):
+    return make_first_turn_cache(_db)
 
-def handle_chat_completion(client, model, messages, minimal_reasoning=True):
+first_turn_cache = get_first_turn_cache(mongo_db)
+
+# Background generation of the reply to "yes"; None unless SPECULATIVE_FIRST_TURN is set
+@st.cache_resource
+def get_first_turn_speculator():
+    return make_first_turn_speculator()
+
+first_turn_speculator = get_first_turn_speculator()
+
+# Model and reasoning effort per turn type from config/model_routing.yaml
+@st.cache_resource
+def get_model_router():
+    return make_model_router(on_error=st.error)
+
+MODEL_ROUTER = get_model_router()
+
+# Per-turn spans to TRACE_FILE and/or an OTLP collector; a no-op unless configured
+@st.cache_resource
+def get_tracer():
+    return make_tracer("streetgpt-streamlit")
+
+tracer = get_tracer()
+
+def handle_chat_completion(client, model, messages, reasoning_effort="low", span=NOOP_SPAN):
     full_response = ""
     message_placeholder = st.empty()
+
+    def on_error(message):
+        span.set_attribute("openai.fallback", True)
+        METRICS.count("openai_fallback")
+        record_error("responses_fallback", message)
+
+    METRICS.count("openai_attempt")
+    started = time.perf_counter()
     try:
-        # Prefer Responses API for GPT‑5 (supports reasoning controls)
-        if str(model).lower().startswith("gpt-5"):
-            kwargs = {"model": model, "messages": messages}
-            if minimal_reasoning:
-                kwargs["reasoning"] = {"effort": "low"}
-            try:
-                with client.responses.stream(**kwargs) as stream:
-                    for event in stream:
-                        # event.delta can be a string or missing; guard accordingly
-                        if getattr(event, "type", "").startswith("response.output_text"):
-                            delta = getattr(event, "delta", "") or ""
-                            if delta:
-                                full_response += str(delta)
-                                message_placeholder.markdown(full_response + "▌")
-                                st.session_state["completion_tokens"] += 1
-                    _ = stream.get_final_response()
-                return full_response
-            except Exception as e_resp:
-                # Fall through to Chat Completions on any Responses error
-                st.session_state["error_messages"] += f"responses_api_error: {type(e_resp).__name__}: {e_resp}\n"
-
-        # Fallback: Chat Completions streaming (works across many models)
-        stream = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=True,
-        )
-        for chunk in stream:
-            # delta may be an object (with .content) or a dict; guard both
-            delta_obj = getattr(chunk.choices[0], "delta", None)
-            delta = ""
-            if isinstance(delta_obj, dict):
-                delta = delta_obj.get("content", "")
-            else:
-                delta = getattr(delta_obj, "content", "") or ""
-            if delta:
+        with METRICS.inflight("openai"), METRICS.timer("openai_stream_ms"):
+            for delta in iter_response_deltas(client, model, messages, reasoning_effort, on_error=on_error):
+                if not full_response:
+                    first_delta_ms = (time.perf_counter() - started) * 1000
+                    span.set_attribute("openai.first_delta_ms", round(first_delta_ms, 1))
+                    METRICS.observe("openai_first_delta_ms", first_delta_ms)
                 full_response += delta
                 message_placeholder.markdown(full_response + "▌")
                 st.session_state["completion_tokens"] += 1
         return full_response
     except Exception as e2:
-        st.session_state["error_messages"] += f"from handle (chat streaming failed): {type(e2).__name__}: {e2}\n"
+        METRICS.count("openai_error")
+        record_exception("chat_stream", e2)
         raise e2
 
+def replay_cached_response(text):
+    full_response = ""
+    message_placeholder = st.empty()
+    for delta in iter_cached_deltas(text):
+        full_response += delta
+        message_placeholder.markdown(full_response + "▌")
+    return full_response
+
 @retry(
     stop=stop_after_attempt(2),
     wait=wait_random_exponential(min=2, max=5)
 )
-def chat_completion_with_backoff(messages):
-    model = st.session_state.get("openai_model", get_secret("OPENAI_MODEL", "gpt-5"))
-    full_response = handle_chat_completion(client=client, model=model, messages=messages, minimal_reasoning=True)
+def chat_completion_with_backoff(messages, route, trace=NOOP_TRACE):
+    with trace.span("openai_stream", attempt=trace.count("openai_stream") + 1) as span:
+        full_response = handle_chat_completion(
+            client=client, model=route.model, messages=messages, reasoning_effort=route.reasoning_effort, span=span
+        )
     return full_response
 
 if "openai_model" not in st.session_state:
     # Model comes from env var OPENAI_MODEL; default to gpt-5 if unset.
     st.session_state["openai_model"] = get_secret("OPENAI_MODEL", "gpt-5")
 
+# Waiting room in front of new conversations; None unless ADMISSION_CONTROL is set
+@st.cache_resource
+def get_admission_controller():
+    return make_admission_controller()
+
+@st.cache_resource
+def get_screenout_codes():
+    return load_screenout_codes()
+
+admission_controller = get_admission_controller()
+
+if admission_controller and not st.session_state.get("admitted"):
+    # Conversations that already exist are resumed without queueing
+    resumed = False
+    if query_context["id"]:
+        try:
+            resumed = bool(load_conversation_state(conversations_col, query_context["id"], {"_id": 1}))
+        except PyMongoError:
+            pass
+    ticket = (
+        query_context["id"]
+        or query_context["prolific_pid"]
+        or (url_params.get("admission_ticket") or [""])[0]
+        or generate_random_id()
+    )
+    admission = None if resumed else admission_controller.check(ticket)
+    if admission is None or admission.admitted:
+        st.session_state["admitted"] = True
+    elif admission.screened_out:
+        st.markdown(screenout_message(query_context["language"]))
+        render_return_handoff(screenout_url(get_screenout_codes(), query_context["study_id"]), "Return to Prolific")
+        st.stop()
+    else:
+        st.markdown(waiting_room_message(query_context["language"], admission.position))
+        render_waiting_room_refresh(ticket, WAITING_ROOM_REFRESH_S)
+        st.stop()
+
 
 launch_signature = json.dumps(
     {
@@ -516,7 +383,7 @@ launch_signature = json.dumps(
 
 if st.session_state.get("launch_signature") != launch_signature:
     st.session_state["launch_signature"] = launch_signature
-    st.session_state["error_messages"] = ""
+    st.session_state["errors"] = ErrorLog()
     st.session_state["last_model"] = ""
 
     st.session_state["survey_claim"] = query_context["survey_claim"]
@@ -524,16 +391,12 @@ if st.session_state.get("launch_signature") != launch_signature:
     st.session_state["control_flag"] = query_context["control_flag"]
     st.session_state["control_claim"] = query_context["control_claim"]
     st.session_state["discussion_claim_seed"] = query_context["discussion_claim_seed"]
-    st.session_state["discussion_claim"] = ""
-    st.session_state["discussion_claim_initial_credence"] = None
-    st.session_state["discussion_claim_final_credence"] = None
     st.session_state["id"] = query_context["id"]
     st.session_state["language"] = query_context["language"]
     st.session_state["prolific_pid"] = query_context["prolific_pid"]
     st.session_state["study_id"] = query_context["study_id"]
     st.session_state["session_id"] = query_context["session_id"]
     st.session_state["return_url_base"] = query_context["return_url"]
-    st.session_state["return_url"] = query_context["return_url"]
     st.session_state["chat_outcome"] = {}
 
     # If no id is passed, generate random id and write to db
@@ -548,230 +411,288 @@ if st.session_state.get("launch_signature") != launch_signature:
     st.session_state["input_active"] = 1
     st.session_state["messages"] = []
 
-    # Create conversation document (upsert by session_id)
-    current_time = get_current_time_in_berlin()
+    # Determine system message from YAML config with the canonical claim texts;
+    # sessions with the same prompt share one string
+    st.session_state["system_message"] = shared_text(get_system_message(
+        SYSTEM_MESSAGES,
+        **prompt_claims(query_context),
+        survey_claim_initial_credence=st.session_state["survey_claim_initial_credence"],
+        control_flag=st.session_state["control_flag"],
+        language=st.session_state["language"],
+    ))
+
+    # Resume the stored conversation after a page reload or dropped websocket
+    stored_state = None
+    if query_context["id"]:
+        try:
+            stored_state = load_conversation_state(conversations_col, st.session_state["id"])
+        except PyMongoError as e:
+            record_exception("mongo_rehydrate", e)
+
+    # Same Prolific participant, new Qualtrics response: resume, block or flag per policy
+    duplicate_policy = get_duplicate_participant_policy()
+    duplicate_of = ""
+    if not stored_state and duplicate_policy != "off":
+        try:
+            previous = find_previous_participation(
+                conversations_col,
+                st.session_state["prolific_pid"],
+                st.session_state["study_id"],
+                st.session_state["id"],
+            )
+        except PyMongoError as e:
+            record_exception("mongo_duplicate_lookup", e)
+            previous = None
+        if previous and duplicate_policy == "block":
+            # Re-check on every rerun instead of continuing with this launch
+            st.session_state.pop("launch_signature", None)
+            st.write(DUPLICATE_PARTICIPANT_MESSAGE)
+            st.stop()
+        if previous and duplicate_policy == "resume":
+            st.session_state["id"] = previous["session_id"]
+            stored_state = previous
+        elif previous:
+            duplicate_of = previous["session_id"]
+
+    if stored_state:
+        restore_conversation_state(stored_state)
+        if stored_state.get("status") == "abandoned":
+            try:
+                reactivate_conversation(conversations_col, st.session_state["id"], get_current_time_in_berlin())
+            except PyMongoError as e:
+                record_exception("mongo_reactivate", e)
+    else:
+        # Create conversation document (upsert by session_id)
+        current_time = get_current_time_in_berlin()
+        document = new_conversation_document(
+            session_id=st.session_state["id"],
+            app_name=APP_NAME,
+            context=query_context,
+            password=st.session_state["password"],
+            current_time=current_time,
+        )
+        if duplicate_of:
+            document["duplicate_of"] = duplicate_of
+        try:
+            conversations_col.update_one(
+                {"session_id": st.session_state["id"]},
+                {"$setOnInsert": document},
+                upsert=True
+            )
+        except PyMongoError as e:
+            st.error(f"Failed to initialize conversation in MongoDB: {e}")
+            st.stop()
+
+        # Prepare the answer to the usual consent while the participant reads the opening message
+        speculative_context = [{"role": "system", "content": st.session_state["system_message"]}]
+        speculative_route = MODEL_ROUTER.for_turn(1, st.session_state["control_flag"])
+        if first_turn_speculator and not (
+            first_turn_cache and first_turn_cache.get(first_turn_cache_key(
+                speculative_context, consent_reply(st.session_state["language"]), speculative_route.model
+            ))
+        ):
+            first_turn_speculator.start(
+                st.session_state["id"],
+                speculative_context,
+                st.session_state["language"],
+                speculative_route.model,
+                make_generate(client, speculative_route.model, speculative_route.reasoning_effort),
+            )
+
+    # Persist selected system_message once per conversation, with any errors from the launch
+    launch_errors = st.session_state["errors"].take_pending()
     try:
         conversations_col.update_one(
             {"session_id": st.session_state["id"]},
-            {"$setOnInsert": {
-                "session_id": st.session_state["id"],
-                "app": APP_NAME,
-                "created_at": current_time,
-                "updated_at": current_time,
+            {"$set": {
+                "system_message": st.session_state["system_message"],
+                "discussion_claim_seed": st.session_state["discussion_claim_seed"],
+                "language": st.session_state["language"],
                 "survey_claim": st.session_state["survey_claim"],
                 "survey_claim_initial_credence": st.session_state["survey_claim_initial_credence"],
                 "control_flag": st.session_state["control_flag"],
                 "control_claim": st.session_state["control_claim"],
-                "discussion_claim": st.session_state["discussion_claim"],
-                "discussion_claim_initial_credence": st.session_state["discussion_claim_initial_credence"],
-                "discussion_claim_final_credence": st.session_state["discussion_claim_final_credence"],
-                "prolific_pid": st.session_state["prolific_pid"],
-                "study_id": st.session_state["study_id"],
-                "prolific_session_id": st.session_state["session_id"],
-                "return_url_base": st.session_state["return_url_base"],
-                "return_url": st.session_state["return_url"],
-                "chat_outcome": st.session_state["chat_outcome"],
+                **outcome_fields(),
+                "prolific_pid": st.session_state.get("prolific_pid", ""),
+                "study_id": st.session_state.get("study_id", ""),
+                "prolific_session_id": st.session_state.get("session_id", ""),
+                "return_url_base": st.session_state.get("return_url_base", ""),
+                "return_url": current_return_url(),
+                "chat_outcome": st.session_state.get("chat_outcome", {}),
                 "password_used": st.session_state["password"],
-                "last_model": "",
-                "error_messages": "",
-                "prompt_tokens": 0,
-                "completion_tokens": 0,
-                "messages": []
-            }},
-            upsert=True
+            }, **({"$push": push_errors(launch_errors)} if launch_errors else {})},
+            upsert=False,
         )
     except PyMongoError as e:
-        st.error(f"Failed to initialize conversation in MongoDB: {e}")
-        st.stop()
-    
-    
-opening_message_english = "Hi there! I'm Chip. I'm here to help you explore and reflect on your beliefs. Before we start: this is a conversation about how we know things. Some questions can feel probing; you can skip any or stop anytime. Okay to proceed?"
-opening_message_german = "Hallo, mein Name ist Chip. Ich kann dir helfen, deine Überzeugungen zu hinterfragen. Bevor wir beginnen: Dies ist ein Gespräch darüber, woher ir Dinge wissen. Du kannst jederzeit eine Frage überspringen oder ganz aufhören. Einverstanden, dass wir fortfahren?"
-   
-if st.session_state["discussion_claim_seed"] == 0:
-    # No initial claim provided
-    if st.session_state["language"] == 'german':
-        opening_message = opening_message_german
-    else:
-        opening_message = opening_message_english
-else:
-    # Claim provided
-    if st.session_state["language"] == 'german':
-        opening_message = opening_message_german
-    else:
-        opening_message = opening_message_english
-
-# Determine system message from YAML config
-system_message = get_system_message(
-    survey_claim=st.session_state["survey_claim"],
-    survey_claim_initial_credence=st.session_state["survey_claim_initial_credence"],
-    discussion_claim_seed=st.session_state["discussion_claim_seed"],
-    control_claim=st.session_state["control_claim"],
-    control_flag=st.session_state["control_flag"],
-    language=st.session_state["language"],
-)
+        st.session_state["errors"].requeue(launch_errors)
+        record_exception("mongo_launch_update", e)
 
-# Persist selected system_message once per conversation
-try:
-    conversations_col.update_one(
-        {"session_id": st.session_state["id"]},
-        {"$set": {
-            "system_message": system_message,
-            "survey_claim": st.session_state["survey_claim"],
-            "survey_claim_initial_credence": st.session_state["survey_claim_initial_credence"],
-            "control_flag": st.session_state["control_flag"],
-            "control_claim": st.session_state["control_claim"],
-            "discussion_claim": st.session_state.get("discussion_claim", ""),
-            "discussion_claim_initial_credence": st.session_state.get("discussion_claim_initial_credence"),
-            "discussion_claim_final_credence": st.session_state.get("discussion_claim_final_credence"),
-            "prolific_pid": st.session_state.get("prolific_pid", ""),
-            "study_id": st.session_state.get("study_id", ""),
-            "prolific_session_id": st.session_state.get("session_id", ""),
-            "return_url_base": st.session_state.get("return_url_base", ""),
-            "return_url": st.session_state.get("return_url", ""),
-            "chat_outcome": st.session_state.get("chat_outcome", {}),
-            "password_used": st.session_state["password"],
-        }},
-        upsert=False,
-    )
-except PyMongoError as e:
-    st.session_state["error_messages"] += f"Mongo update system_message error: {e}\n"
+
+opening_message = get_opening_message(st.session_state["language"])
+system_message = st.session_state["system_message"]
 
 ### Main App ##
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
-    st.session_state.messages.append({"role": "assistant", "content": opening_message, "avatar": "🧑‍🎤"})
+    st.session_state.messages.append(ChatMessage("assistant", opening_message))
 
 # Show chat messages in streamlit
 for message in st.session_state.messages:
-    with st.chat_message(message["role"], avatar=message["avatar"]):
-        st.markdown(message["content"])
+    with st.chat_message(message.role, avatar=message.avatar):
+        st.markdown(message.content)
 
-# allow users to send messages and process them 
+# allow users to send messages and process them
 if st.session_state["input_active"] == 1:
-  
+
     if prompt := st.chat_input("Write a message", key="input"):
-        st.session_state.messages.append({"role": "user", "content": prompt, "avatar": "🧐"})
-        with st.chat_message("user", avatar="🧐"):
-            st.markdown(prompt)
-        
+        trace = tracer.turn(turn_attributes(
+            st.session_state["id"], st.session_state["control_flag"], st.session_state["language"]
+        ))
+        turn_started = time.perf_counter()
+        METRICS.count("turn")
+        METRICS.touch_session(st.session_state["id"])
+        with trace.span("input"):
+            st.session_state.messages.append(ChatMessage("user", prompt))
+            with st.chat_message("user", avatar=USER_AVATAR):
+                st.markdown(prompt)
+
         # Create promt to OpenAI
-        with st.chat_message("assistant", avatar="🧑‍🎤"):
-            
-            # Create a list to store the complete prompt sent to OpenAI
-            complete_prompt = [{"role": "system", "content": system_message}] + \
-                            [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-        
-            # Send the prompt to OpenAI, and get a response  
-            try:
-                st.session_state["last_model"] = st.session_state.get("openai_model", get_secret("OPENAI_MODEL", "gpt-5"))
-                full_response = chat_completion_with_backoff(messages=complete_prompt)
-            except RetryError:
-                # If retries exhausted, surface the error
-                raise
-            
+        with st.chat_message("assistant", avatar=ASSISTANT_AVATAR), trace:
+
+            with trace.span("prompt_assembly"):
+                # Create a list to store the complete prompt sent to OpenAI
+                complete_prompt = [{"role": "system", "content": system_message}] + \
+                                [m.as_prompt() for m in st.session_state.messages]
+
+                route = MODEL_ROUTER.for_turn(count_user_turns(st.session_state.messages), st.session_state["control_flag"])
+                st.session_state["last_model"] = route.model
+            trace.set_attributes({"llm.model": route.model, "llm.turn_type": route.turn_type})
+
+            with trace.span("first_turn_lookup") as span:
+                cache_key = ""
+                if first_turn_cache:
+                    cache_key = first_turn_cache_key(complete_prompt[:-1], prompt, st.session_state["last_model"])
+                cached_response = first_turn_cache.get(cache_key) if cache_key else None
+                speculative_response = None
+                if first_turn_speculator:
+                    handle = first_turn_speculator.take(
+                        st.session_state["id"], complete_prompt[:-1], st.session_state["language"], prompt, st.session_state["last_model"]
+                    )
+                    if handle and not cached_response:
+                        speculative_response = wait_for_speculation(handle)
+                span.set_attribute("cache.hit", bool(cached_response))
+                span.set_attribute("speculation.used", bool(speculative_response))
+
+            if cached_response:
+                with trace.span("cached_replay"):
+                    full_response = replay_cached_response(cached_response)
+            elif speculative_response:
+                with trace.span("cached_replay"):
+                    full_response = replay_cached_response(speculative_response.text)
+                st.session_state["prompt_tokens"] += speculative_response.prompt_tokens
+                st.session_state["completion_tokens"] += speculative_response.completion_tokens
+                if cache_key and not should_end_chat(full_response):
+                    first_turn_cache.put(cache_key, full_response, st.session_state["last_model"])
+            else:
+                # Send the prompt to OpenAI, and get a response
+                METRICS.count("openai_request")
+                try:
+                    full_response = chat_completion_with_backoff(messages=complete_prompt, route=route, trace=trace)
+                except RetryError:
+                    # If retries exhausted, surface the error
+                    raise
+                if cache_key and not should_end_chat(full_response):
+                    first_turn_cache.put(cache_key, full_response, st.session_state["last_model"])
+
+                # Update vars for counting tokens
+                # Estimating tokens for the prompt
+                with trace.span("token_count"):
+                    prompt_tokens = num_tokens_from_prompt(complete_prompt)
+                st.session_state["prompt_tokens"] += prompt_tokens
+
             # Update session state with new response
-            st.session_state.messages.append({"role": "assistant", "content": full_response, "avatar": "🧑‍🎤"})
+            st.session_state.messages.append(ChatMessage("assistant", full_response))
 
-            # Update vars for counting tokens
-            # Estimating tokens for the prompt
-            prompt_tokens = num_tokens_from_prompt(complete_prompt)
-            st.session_state["prompt_tokens"] += prompt_tokens
-            
+            with trace.span("end_detection") as span:
+                chat_ended = should_end_chat(full_response)
+                span.set_attribute("chat.ended", chat_ended)
             # Stop the chat once the handoff message is given.
-            if should_end_chat(full_response):
-                chat_outcome = build_chat_outcome(
-                    messages=st.session_state.messages,
-                    seeded_discussion_claim=st.session_state.get("discussion_claim_seed", ""),
-                    survey_claim=st.session_state.get("survey_claim", ""),
-                    control_flag=st.session_state.get("control_flag", False),
-                    control_claim=st.session_state.get("control_claim", ""),
-                )
+            if chat_ended:
+                extraction_route = MODEL_ROUTER.for_extraction(st.session_state.get("control_flag", False))
+                with trace.span("outcome_extraction", **{"llm.model": extraction_route.model}), METRICS.timer("extraction_ms"):
+                    chat_outcome = build_chat_outcome(
+                        client=client,
+                        model=extraction_route.model,
+                        messages=[m.as_prompt() for m in st.session_state.messages],
+                        seeded_discussion_claim=st.session_state.get("discussion_claim_seed", ""),
+                        survey_claim=st.session_state.get("survey_claim", ""),
+                        control_flag=st.session_state.get("control_flag", False),
+                        control_claim=st.session_state.get("control_claim", ""),
+                        on_error=partial(record_error, "extraction"),
+                        reasoning_effort=extraction_route.reasoning_effort,
+                    )
                 st.session_state["chat_outcome"] = chat_outcome
-                st.session_state["discussion_claim"] = chat_outcome.get("discussion_claim", "")
-                st.session_state["discussion_claim_initial_credence"] = chat_outcome.get("discussion_claim_initial_credence")
-                st.session_state["discussion_claim_final_credence"] = chat_outcome.get("discussion_claim_final_credence")
-                st.session_state["return_url"] = append_chat_outcome_to_return_url(
-                    st.session_state.get("return_url_base", st.session_state.get("return_url", "")),
-                    chat_outcome,
-                )
                 st.session_state["input_active"] = 0
 
-            
+            with trace.span("return_url"):
+                return_url = current_return_url()
+
             # Persist conversation to MongoDB
+            turn_errors = st.session_state["errors"].take_pending()
             try:
                 # Append the latest user and assistant messages only (not the system message)
                 messages_to_append = [
                     {"role": "user", "content": prompt, "ts": get_current_time_in_berlin()},
-                    {"role": "assistant", "content": full_response, "ts": get_current_time_in_berlin()},
+                    {"role": "assistant", "content": full_response, "ts": get_current_time_in_berlin(), **route.as_log()},
                 ]
-                conversations_col.update_one(
-                    {"session_id": st.session_state["id"]},
-                    {
-                        "$set": {
-                            "updated_at": get_current_time_in_berlin(),
-                            "last_model": st.session_state["last_model"],
-                            "error_messages": st.session_state["error_messages"],
-                            "prompt_tokens": st.session_state["prompt_tokens"],
-                            "completion_tokens": st.session_state["completion_tokens"],
-                            "password_used": st.session_state["password"],
-                            "survey_claim": st.session_state.get("survey_claim", ""),
-                            "survey_claim_initial_credence": st.session_state.get("survey_claim_initial_credence", 0),
-                            "control_flag": st.session_state.get("control_flag", False),
-                            "control_claim": st.session_state.get("control_claim", ""),
-                            "discussion_claim": st.session_state.get("discussion_claim", ""),
-                            "discussion_claim_initial_credence": st.session_state.get("discussion_claim_initial_credence"),
-                            "discussion_claim_final_credence": st.session_state.get("discussion_claim_final_credence"),
-                            "prolific_pid": st.session_state.get("prolific_pid", ""),
-                            "study_id": st.session_state.get("study_id", ""),
-                            "prolific_session_id": st.session_state.get("session_id", ""),
-                            "return_url_base": st.session_state.get("return_url_base", ""),
-                            "return_url": st.session_state.get("return_url", ""),
-                            "chat_outcome": st.session_state.get("chat_outcome", {}),
-                            "system_message": system_message,
+                with trace.span("mongo_write"), METRICS.timer("mongo_write_ms"):
+                    conversations_col.update_one(
+                        {"session_id": st.session_state["id"]},
+                        {
+                            "$set": {
+                                "updated_at": get_current_time_in_berlin(),
+                                **conversation_status_fields(st.session_state["input_active"], get_current_time_in_berlin()),
+                                "last_model": st.session_state["last_model"],
+                                "prompt_tokens": st.session_state["prompt_tokens"],
+                                "completion_tokens": st.session_state["completion_tokens"],
+                                "input_active": st.session_state["input_active"],
+                                "password_used": st.session_state["password"],
+                                "survey_claim": st.session_state.get("survey_claim", ""),
+                                "survey_claim_initial_credence": st.session_state.get("survey_claim_initial_credence", 0),
+                                "control_flag": st.session_state.get("control_flag", False),
+                                "control_claim": st.session_state.get("control_claim", ""),
+                                **outcome_fields(),
+                                "prolific_pid": st.session_state.get("prolific_pid", ""),
+                                "study_id": st.session_state.get("study_id", ""),
+                                "prolific_session_id": st.session_state.get("session_id", ""),
+                                "return_url_base": st.session_state.get("return_url_base", ""),
+                                "return_url": return_url,
+                                "chat_outcome": st.session_state.get("chat_outcome", {}),
+                                "system_message": system_message,
+                                **({"first_turn_cached": True} if cached_response else {}),
+                                **({"first_turn_speculative": True} if speculative_response else {}),
+                            },
+                            "$push": {"messages": {"$each": messages_to_append}, **push_errors(turn_errors)}
                         },
-                        "$push": {"messages": {"$each": messages_to_append}}
-                    },
-                    upsert=True
-                )
+                        upsert=True
+                    )
             except PyMongoError as e:
-                st.session_state["error_messages"] += f"Mongo persist error: {e}\n"
+                st.session_state["errors"].requeue(turn_errors)
+                record_exception("mongo_persist", e)
+            METRICS.observe("turn_ms", (time.perf_counter() - turn_started) * 1000)
 
 else:
     st.chat_input("Write a message", key="input", disabled=True)
     if "input" in st.session_state:
         del st.session_state["input"]
-    render_return_handoff(st.session_state.get("return_url", ""))
-
-# To generate random IDs
-def generate_random_id(length=10):
-    letters = string.ascii_letters + string.digits
-    result_str = ''.join(random.choice(letters) for i in range(length))
-    return result_str
-
-# To return current time in Berlin
-def get_current_time_in_berlin():
-    berlin_tz = pytz.timezone('Europe/Berlin')
-    current_time = datetime.now(berlin_tz)
-    formatted_time = current_time.strftime("%Y-%m-%d %H:%M:%S %Z%z")
-    return formatted_time
-
-# Count number of prompt tokens
-def num_tokens_from_prompt(prompt, encoding_name="cl100k_base") -> int:
-    """Returns the number of tokens in a text string."""
-    string = ""
-    for dic in prompt:
-        content = dic.get("content")
-        string += f"{content}\n"
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
-
-# (moved chat helpers above)
+    render_return_handoff(current_return_url())
+
+# Per-session memory accounting for the admin view
+SESSION_REGISTRY.record(current_session_key(), st.session_state.to_dict())
 
 def write_to_db(db, row_number, column, value):
     db.update_cell(row_number, column, value)
-   
+
 def read_from_db(db, row, column):
     return db.cell(row, column).value
@@ -0,0 +1 @@
+"""Shared StreetGPT chat logic and alternative runtimes."""
@@ -0,0 +1,157 @@
+"""Operator view for the Streamlit app, served at ?view=admin&admin_password=...
+
+Add &refresh_s=10 to reload the page periodically during a wave.
+"""
+
+from __future__ import annotations
+
+import resource
+import time
+import tracemalloc
+
+import streamlit as st
+import streamlit.components.v1 as components
+from pymongo.errors import PyMongoError
+
+from streetgpt.analytics import STUDY_SUMMARY_TTL_S, study_summary
+from streetgpt.errors import error_counts
+from streetgpt.metrics import METRICS, Metrics
+from streetgpt.session import SessionRegistry
+
+
+def format_bytes(value: int) -> str:
+    size = float(value)
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def format_ms(value) -> str:
+    return "–" if value is None else f"{value:,.0f} ms"
+
+
+def format_rate(value) -> str:
+    return "–" if value is None else f"{value:.1%}"
+
+
+def render_live_section(metrics: Metrics, registry: SessionRegistry):
+    st.subheader("Live")
+    snapshot = metrics.snapshot()
+    first_delta = snapshot["latency"]["openai_first_delta_ms"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("OpenAI in flight", snapshot["inflight"].get("openai", 0))
+    col2.metric("Active sessions (5 min)", snapshot["active_sessions"])
+    col3.metric("Open sessions", registry.totals()["sessions"])
+    col4.metric("Turns", snapshot["turns"])
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("First delta p50", format_ms(first_delta["p50_ms"]))
+    col2.metric("First delta p90", format_ms(first_delta["p90_ms"]))
+    col3.metric("Retry rate", format_rate(snapshot["retry_rate"]))
+    col4.metric("Fallback rate", format_rate(snapshot["fallback_rate"]))
+
+    rows = [
+        {
+            "stage": name,
+            "samples": values["count"],
+            "p50": format_ms(values["p50_ms"]),
+            "p90": format_ms(values["p90_ms"]),
+            "p99": format_ms(values["p99_ms"]),
+            "max": format_ms(values["max_ms"]),
+        }
+        for name, values in snapshot["latency"].items()
+    ]
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    admission = snapshot["admission"]
+    st.caption(
+        f"Waiting room: {snapshot['gauges'].get('admission_queue', 0)} waiting now · "
+        f"{admission['admitted']} admitted · {admission['queued']} queued · {admission['screened_out']} screened out"
+    )
+    st.caption(
+        f"This process, last {snapshot['window_s'] // 60} minutes · "
+        f"peak OpenAI in flight {snapshot['peak_inflight'].get('openai', 0)} · "
+        f"peak speculative in flight {snapshot['peak_inflight'].get('speculative', 0)} · "
+        f"{snapshot['openai_errors']} OpenAI errors · up {snapshot['uptime_s'] // 60} min"
+    )
+
+
+def render_auto_refresh(refresh_s: int):
+    components.html(
+        f"""
+        <script>
+        window.setTimeout(function() {{ window.top.location.reload(); }}, {int(refresh_s) * 1000});
+        </script>
+        """,
+        height=0,
+    )
+
+
+def render_memory_section(registry: SessionRegistry):
+    st.subheader("Session memory")
+    totals = registry.totals()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Sessions", totals["sessions"])
+    col2.metric("Session state total", format_bytes(totals["state_bytes"]))
+    col3.metric("Mean per session", format_bytes(totals["mean_state_bytes"]))
+    col4.metric("Largest session", format_bytes(totals["max_state_bytes"]))
+
+    # ru_maxrss is reported in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    caption = f"Process peak RSS: {format_bytes(peak_rss)}"
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        caption += f" · tracemalloc current {format_bytes(current)}, peak {format_bytes(peak)}"
+    st.caption(caption)
+
+    now = time.time()
+    rows = [
+        {
+            "conversation": stats.conversation_id,
+            "study_id": stats.study_id,
+            "messages": stats.messages,
+            "input_active": stats.input_active,
+            "state": format_bytes(stats.state_bytes),
+            "idle_s": int(now - stats.last_seen),
+        }
+        for stats in sorted(registry.snapshot().values(), key=lambda s: s.state_bytes, reverse=True)
+    ]
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+
+def render_study_section(collection, app_name: str):
+    st.subheader("Studies")
+    col1, col2 = st.columns(2)
+    study_id = col1.text_input("study_id", "", help="Leave empty for all studies of this app.")
+    since = col2.text_input("created since", "", help="Date prefix such as 2025-03-01.")
+    try:
+        rows = study_summary(collection, app_name, study_id.strip(), since.strip())
+    except PyMongoError as e:
+        st.error(f"Failed to load the study summary from MongoDB: {e}")
+        return
+    st.caption(f"app={app_name} · aggregated in Mongo, cached for {STUDY_SUMMARY_TTL_S}s")
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.write("No conversations match.")
+
+
+def render_error_section():
+    st.subheader("Errors")
+    rows = error_counts()
+    st.caption("Counted by stage and type in this process since it started")
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.write("No errors.")
+
+
+def render_admin_page(registry: SessionRegistry, collection, app_name: str, refresh_s: int = 0):
+    st.title("StreetGPT admin")
+    render_live_section(METRICS, registry)
+    render_study_section(collection, app_name)
+    render_error_section()
+    render_memory_section(registry)
+    if refresh_s > 0:
+        render_auto_refresh(refresh_s)
@@ -0,0 +1,191 @@
+"""Admission control and waiting room for new conversations.
+
+When OpenAI is rate limiting or the host is saturated, starting more
+conversations only makes them fail halfway. New launches are admitted while
+there is headroom: fewer OpenAI calls in flight than ADMISSION_MAX_INFLIGHT,
+recent time-to-first-delta under ADMISSION_MAX_FIRST_DELTA_MS and, optionally,
+fewer than ADMISSION_MAX_PER_MINUTE admissions in the last minute. Everyone else
+waits in a FIFO queue and polls for their position. After ADMISSION_MAX_WAIT_S
+a waiting participant is screened out and sent back to Prolific with the
+screen-out code the setup script created for the study.
+
+Resumed conversations are never queued. The queue lives in process memory, like
+the metrics it is based on. Enable with ADMISSION_CONTROL=1.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from pathlib import Path
+
+from streetgpt.core import get_secret, parse_bool_param, parse_int_param
+from streetgpt.metrics import METRICS, Metrics
+
+logger = logging.getLogger(__name__)
+
+# Same redirect the setup script writes into the Qualtrics end-of-survey options
+PROLIFIC_COMPLETE_URL = "https://app.prolific.com/submissions/complete?cc={code}"
+LATENCY_WINDOW_S = 60
+# Waiting participants poll every WAITING_ROOM_REFRESH_S; tickets not polled for
+# STALE_TICKET_S have left and give up their place.
+WAITING_ROOM_REFRESH_S = 5
+STALE_TICKET_S = 30
+
+WAITING_ROOM_MESSAGES = {
+    "english": (
+        "Many people are taking part right now. Please keep this page open: the "
+        "conversation starts automatically when it is your turn.\n\n"
+        "Your place in the queue: **{position}**"
+    ),
+    "german": (
+        "Gerade nehmen sehr viele Personen teil. Bitte lassen Sie diese Seite geöffnet: "
+        "Das Gespräch beginnt automatisch, sobald Sie an der Reihe sind.\n\n"
+        "Ihr Platz in der Warteschlange: **{position}**"
+    ),
+}
+SCREENOUT_MESSAGES = {
+    "english": (
+        "We are sorry, the study is at capacity right now. You will be returned to "
+        "Prolific and compensated for your time."
+    ),
+    "german": (
+        "Es tut uns leid, die Studie ist gerade ausgelastet. Sie werden zu Prolific "
+        "zurückgeleitet und für Ihre Zeit entschädigt."
+    ),
+}
+
+
+def waiting_room_message(language: str, position: int) -> str:
+    return WAITING_ROOM_MESSAGES.get(language, WAITING_ROOM_MESSAGES["english"]).format(position=position)
+
+
+def screenout_message(language: str) -> str:
+    return SCREENOUT_MESSAGES.get(language, SCREENOUT_MESSAGES["english"])
+
+
+### Screen-out codes ##
+
+def screenout_codes_from_summary(summary: dict) -> dict[str, str]:
+    """Study ID -> screen-out code from a setup summary (single variant or batch)."""
+    codes = {}
+    for variant in summary.get("variants") or [summary]:
+        code = (variant.get("completion_codes") or {}).get("screenout")
+        study_id = (variant.get("prolific_result") or {}).get("id", "")
+        if code:
+            codes[study_id] = code
+    return codes
+
+
+def load_screenout_codes() -> dict[str, str]:
+    """Codes from SCREENOUT_CODES_FILE, with PROLIFIC_SCREENOUT_CODE as the default ("")."""
+    codes = {}
+    path = get_secret("SCREENOUT_CODES_FILE", "")
+    if path:
+        try:
+            codes.update(screenout_codes_from_summary(json.loads(Path(path).read_text(encoding="utf-8"))))
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load screen-out codes from %s: %s", path, e)
+    default_code = get_secret("PROLIFIC_SCREENOUT_CODE", "")
+    if default_code:
+        codes[""] = default_code
+    return codes
+
+
+def screenout_url(codes: dict[str, str], study_id: str) -> str:
+    code = codes.get(study_id) or codes.get("")
+    return PROLIFIC_COMPLETE_URL.format(code=code) if code else ""
+
+
+### Admission ##
+
+@dataclass(slots=True)
+class Admission:
+    admitted: bool
+    position: int = 0
+    waited_s: float = 0.0
+    screened_out: bool = False
+
+
+class AdmissionController:
+    """FIFO waiting room in front of new conversations."""
+
+    def __init__(
+        self,
+        max_inflight: int,
+        max_first_delta_ms: float,
+        max_wait_s: float,
+        max_per_minute: int = 0,
+        metrics: Metrics = METRICS,
+    ):
+        self.max_inflight = max_inflight
+        self.max_first_delta_ms = max_first_delta_ms
+        self.max_wait_s = max_wait_s
+        self.max_per_minute = max_per_minute
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        # ticket -> [enqueued_at, last_seen]
+        self._queue: OrderedDict[str, list[float]] = OrderedDict()
+        self._recent_admissions: deque = deque()
+
+    def headroom(self, now: float) -> int:
+        """How many participants may start right now."""
+        first_delta = self.metrics.latency("openai_first_delta_ms", LATENCY_WINDOW_S)["p90_ms"]
+        if first_delta is not None and first_delta > self.max_first_delta_ms:
+            return 0
+        headroom = self.max_inflight - self.metrics.current_inflight("openai")
+        if self.max_per_minute:
+            while self._recent_admissions and self._recent_admissions[0] < now - 60:
+                self._recent_admissions.popleft()
+            headroom = min(headroom, self.max_per_minute - len(self._recent_admissions))
+        return max(0, headroom)
+
+    def _admit(self, now: float, waited_s: float = 0.0) -> Admission:
+        self._recent_admissions.append(now)
+        self.metrics.count("admission_admitted")
+        if waited_s:
+            self.metrics.observe("admission_wait_ms", waited_s * 1000)
+        return Admission(True, waited_s=waited_s)
+
+    def check(self, ticket: str) -> Admission:
+        """Admit, keep waiting or screen out the launch identified by ticket."""
+        now = time.time()
+        with self._lock:
+            for stale in [key for key, (_, seen) in self._queue.items() if seen < now - STALE_TICKET_S and key != ticket]:
+                del self._queue[stale]
+            headroom = self.headroom(now)
+            if ticket not in self._queue:
+                if not self._queue and headroom > 0:
+                    return self._admit(now)
+                self._queue[ticket] = [now, now]
+                self.metrics.count("admission_queued")
+            entry = self._queue[ticket]
+            entry[1] = now
+            position = list(self._queue).index(ticket) + 1
+            waited_s = now - entry[0]
+            if position <= headroom:
+                del self._queue[ticket]
+                admission = self._admit(now, waited_s)
+            elif waited_s >= self.max_wait_s:
+                del self._queue[ticket]
+                self.metrics.count("admission_screened_out")
+                admission = Admission(False, position, waited_s, screened_out=True)
+            else:
+                admission = Admission(False, position, waited_s)
+            self.metrics.set_gauge("admission_queue", len(self._queue))
+            return admission
+
+
+def make_admission_controller() -> AdmissionController | None:
+    if not parse_bool_param(get_secret("ADMISSION_CONTROL", "0"), False):
+        return None
+    return AdmissionController(
+        max_inflight=parse_int_param(get_secret("ADMISSION_MAX_INFLIGHT", "50"), 50),
+        max_first_delta_ms=parse_int_param(get_secret("ADMISSION_MAX_FIRST_DELTA_MS", "8000"), 8000),
+        max_wait_s=parse_int_param(get_secret("ADMISSION_MAX_WAIT_S", "300"), 300),
+        max_per_minute=parse_int_param(get_secret("ADMISSION_MAX_PER_MINUTE", "0"), 0),
+    )
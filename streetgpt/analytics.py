@@ -0,0 +1,95 @@
+"""Live study monitoring computed inside Mongo with aggregation pipelines.
+
+Only the per-study totals leave the database; transcripts stay where they are.
+Results are cached for STUDY_SUMMARY_TTL_S seconds, so a dashboard polled by
+several operators runs each pipeline at most once per interval.
+"""
+
+from __future__ import annotations
+
+import threading
+
+from cachetools import TTLCache
+
+STUDY_SUMMARY_TTL_S = 30
+
+_summary_cache: TTLCache = TTLCache(maxsize=128, ttl=STUDY_SUMMARY_TTL_S)
+_summary_lock = threading.Lock()
+
+
+def study_match(app: str, study_id: str = "", since: str = "") -> dict:
+    # Matches the {app, study_id, created_at} index prefix
+    match = {"app": app}
+    if study_id:
+        match["study_id"] = study_id
+    if since:
+        match["created_at"] = {"$gte": since}
+    return match
+
+
+def study_summary_pipeline(app: str, study_id: str = "", since: str = "") -> list[dict]:
+    initial = "$chat_outcome.discussion_claim_initial_credence"
+    final = "$chat_outcome.discussion_claim_final_credence"
+    return [
+        {"$match": study_match(app, study_id, since)},
+        {"$project": {
+            "_id": 0,
+            "study_id": {"$ifNull": ["$study_id", ""]},
+            "control_flag": {"$ifNull": ["$control_flag", False]},
+            "completed": {"$cond": [{"$eq": ["$input_active", 0]}, 1, 0]},
+            "abandoned": {"$cond": [{"$eq": ["$status", "abandoned"]}, 1, 0]},
+            "turns": {"$size": {"$filter": {
+                "input": {"$ifNull": ["$messages", []]},
+                "cond": {"$eq": ["$$this.role", "user"]},
+            }}},
+            "extracted": {"$cond": [{"$ifNull": ["$chat_outcome.extractor_status", False]}, 1, 0]},
+            "fallback": {"$cond": [{"$eq": ["$chat_outcome.extractor_status", "fallback"]}, 1, 0]},
+            "credence_shift": {"$cond": [
+                {"$and": [{"$isNumber": initial}, {"$isNumber": final}]},
+                {"$subtract": [final, initial]},
+                None,
+            ]},
+            "prompt_tokens": {"$ifNull": ["$prompt_tokens", 0]},
+            "completion_tokens": {"$ifNull": ["$completion_tokens", 0]},
+        }},
+        {"$group": {
+            "_id": {"study_id": "$study_id", "control_flag": "$control_flag"},
+            "sessions": {"$sum": 1},
+            "completed": {"$sum": "$completed"},
+            "abandoned": {"$sum": "$abandoned"},
+            "median_turns": {"$median": {"input": "$turns", "method": "approximate"}},
+            "extracted": {"$sum": "$extracted"},
+            "fallbacks": {"$sum": "$fallback"},
+            "mean_credence_shift": {"$avg": "$credence_shift"},
+            "prompt_tokens": {"$sum": "$prompt_tokens"},
+            "completion_tokens": {"$sum": "$completion_tokens"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "study_id": "$_id.study_id",
+            "control_flag": "$_id.control_flag",
+            "sessions": 1,
+            "completed": 1,
+            "abandoned": 1,
+            "completion_rate": {"$cond": [{"$gt": ["$sessions", 0]}, {"$divide": ["$completed", "$sessions"]}, None]},
+            "median_turns": 1,
+            "fallback_rate": {"$cond": [{"$gt": ["$extracted", 0]}, {"$divide": ["$fallbacks", "$extracted"]}, None]},
+            "mean_credence_shift": 1,
+            "prompt_tokens": 1,
+            "completion_tokens": 1,
+        }},
+        {"$sort": {"study_id": 1, "control_flag": 1}},
+    ]
+
+
+def study_summary(collection, app: str, study_id: str = "", since: str = "") -> list[dict]:
+    """Per (study_id, control_flag) totals for one app, cached for STUDY_SUMMARY_TTL_S."""
+    key = (collection.full_name, app, study_id, since)
+    with _summary_lock:
+        cached = _summary_cache.get(key)
+    if cached is not None:
+        return cached
+    rows = list(collection.aggregate(study_summary_pipeline(app, study_id, since)))
+    with _summary_lock:
+        _summary_cache[key] = rows
+    return rows
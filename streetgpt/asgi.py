@@ -0,0 +1,578 @@
+"""Lightweight ASGI chat backend, an alternative to the Streamlit runtime.
+
+Serves a static chat page and two JSON/SSE endpoints that reuse the same query
+parameters, system messages, Mongo schema and outcome extraction as
+``streamlit_app.py``. Conversation state lives in Mongo only, so a worker holds
+nothing per participant between turns.
+
+Run with:
+    uvicorn streetgpt.asgi:app --host 0.0.0.0 --port 8000
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import logging
+import random
+import time
+from pathlib import Path
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from streetgpt.admission import (
+    WAITING_ROOM_REFRESH_S,
+    load_screenout_codes,
+    make_admission_controller,
+    screenout_message,
+    screenout_url,
+    waiting_room_message,
+)
+from streetgpt.analytics import study_summary
+from streetgpt.cache import aiter_cached_deltas, first_turn_cache_key, make_first_turn_cache
+from streetgpt.claims import CLAIMS_COLLECTION, apply_claim_registry, load_claim_registry, prompt_claims
+from streetgpt.core import (
+    DUPLICATE_PARTICIPANT_MESSAGE,
+    abuild_chat_outcome,
+    aiter_response_deltas,
+    append_chat_outcome_to_return_url,
+    conversation_status_fields,
+    ensure_conversation_indexes,
+    find_previous_participation,
+    generate_random_id,
+    get_current_time_in_berlin,
+    get_duplicate_participant_policy,
+    get_opening_message,
+    get_secret,
+    get_system_message,
+    load_conversation_state,
+    load_system_messages,
+    make_async_openai_client,
+    new_conversation_document,
+    num_tokens_from_prompt,
+    parse_query_context,
+    reactivate_conversation,
+    should_end_chat,
+    stored_input_active,
+)
+from streetgpt.errors import error_counts, error_entry, push_errors
+from streetgpt.metrics import METRICS
+from streetgpt.routing import count_user_turns, make_model_router
+from streetgpt.session import SessionErrorLogs
+from streetgpt.speculative import await_speculation, consent_reply, make_agenerate, make_first_turn_speculator
+from streetgpt.tracing import NOOP_TRACE, atraced, make_tracer, turn_attributes
+from streetgpt.warmup import awarm_openai, warm_tokenizer
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = Path(__file__).parent / "static"
+
+APP_NAME = get_secret("APP_NAME", "streetgpt")
+CHAT_ATTEMPTS = 2
+# A turn still marked as running after this long is assumed dropped before it started streaming
+ACTIVE_TURN_TIMEOUT_S = 300
+
+# Fields needed to answer a launch for an existing conversation
+LAUNCH_PROJECTION = {
+    "_id": 0,
+    "messages.role": 1,
+    "messages.content": 1,
+    "input_active": 1,
+    "chat_outcome": 1,
+    "return_url": 1,
+    "language": 1,
+    "status": 1,
+}
+
+# Fields needed to run one turn
+TURN_PROJECTION = {
+    "_id": 0,
+    "messages.role": 1,
+    "messages.content": 1,
+    "system_message": 1,
+    "discussion_claim_seed": 1,
+    "survey_claim": 1,
+    "control_flag": 1,
+    "control_claim": 1,
+    "input_active": 1,
+    "chat_outcome": 1,
+    "return_url_base": 1,
+    "return_url": 1,
+    "language": 1,
+}
+
+
+class ActiveTurns:
+    """Sessions with a turn in progress in this process; used on the event loop only."""
+
+    def __init__(self, timeout_s: float = ACTIVE_TURN_TIMEOUT_S):
+        self.timeout_s = timeout_s
+        self._started: dict[str, float] = {}
+
+    def begin(self, session_id: str) -> bool:
+        """Mark a turn as started; False if one is already running for this session."""
+        now = time.monotonic()
+        started = self._started.get(session_id)
+        if started is not None and now - started < self.timeout_s:
+            return False
+        self._started[session_id] = now
+        return True
+
+    def end(self, session_id: str):
+        self._started.pop(session_id, None)
+
+    async def released(self, session_id: str, events):
+        """Wrap a turn's event stream so the session is freed when the stream ends."""
+        try:
+            async for event in events:
+                yield event
+        finally:
+            self.end(session_id)
+
+    def __len__(self):
+        return len(self._started)
+
+
+def password_ok(password: str) -> bool:
+    # Centralized password: single PASSWORD from env, same as the Streamlit app
+    password_secret = get_secret("PASSWORD", "")
+    return bool(password_secret) and password == password_secret
+
+
+def admin_password_ok(password: str) -> bool:
+    admin_secret = get_secret("ADMIN_PASSWORD", "")
+    return bool(admin_secret) and password == admin_secret
+
+
+def query_params_as_lists(request: Request) -> dict[str, list[str]]:
+    return {key: request.query_params.getlist(key) for key in request.query_params.keys()}
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def chat_page(request: Request):
+    return FileResponse(STATIC_DIR / "chat.html", media_type="text/html")
+
+
+async def admin_page(request: Request):
+    # The page is static; every data endpoint it polls checks admin_password
+    return FileResponse(STATIC_DIR / "admin.html", media_type="text/html")
+
+
+async def health(request: Request):
+    return PlainTextResponse("ok")
+
+
+async def study_stats(request: Request):
+    if not admin_password_ok(request.query_params.get("admin_password", "")):
+        return JSONResponse({"error": "Wrong password in URL parameter 'admin_password'"}, status_code=403)
+    try:
+        rows = await run_in_threadpool(
+            study_summary,
+            request.app.state.conversations,
+            request.query_params.get("app", APP_NAME),
+            request.query_params.get("study_id", ""),
+            request.query_params.get("since", ""),
+        )
+    except PyMongoError as e:
+        return JSONResponse({"error": f"Aggregation failed: {e}"}, status_code=500)
+    return JSONResponse({"studies": rows})
+
+
+async def metrics_stats(request: Request):
+    if not admin_password_ok(request.query_params.get("admin_password", "")):
+        return JSONResponse({"error": "Wrong password in URL parameter 'admin_password'"}, status_code=403)
+    return JSONResponse(METRICS.snapshot())
+
+
+async def error_stats(request: Request):
+    if not admin_password_ok(request.query_params.get("admin_password", "")):
+        return JSONResponse({"error": "Wrong password in URL parameter 'admin_password'"}, status_code=403)
+    return JSONResponse({"errors": error_counts()})
+
+
+async def launch_session(request: Request):
+    context = parse_query_context(query_params_as_lists(request))
+    if not password_ok(context["password"]):
+        return JSONResponse({"error": "Wrong password in URL parameter 'password'"}, status_code=403)
+
+    conversations_col = request.app.state.conversations
+    session_id = context["id"] or generate_random_id()
+    context = await run_in_threadpool(
+        apply_claim_registry, context, request.app.state.claim_registry, request.app.state.claims
+    )
+
+    # Resume the stored conversation after a page reload or dropped connection
+    stored = None
+    if context["id"]:
+        try:
+            stored = await run_in_threadpool(load_conversation_state, conversations_col, session_id, LAUNCH_PROJECTION)
+        except PyMongoError as e:
+            logger.warning("Mongo rehydrate error for %s: %s", session_id, e)
+
+    # Same Prolific participant, new Qualtrics response: resume, block or flag per policy
+    duplicate_policy = get_duplicate_participant_policy()
+    duplicate_of = ""
+    if not stored and duplicate_policy != "off":
+        try:
+            previous = await run_in_threadpool(
+                find_previous_participation,
+                conversations_col,
+                context["prolific_pid"],
+                context["study_id"],
+                session_id,
+            )
+        except PyMongoError as e:
+            logger.warning("Mongo duplicate lookup error for %s: %s", session_id, e)
+            previous = None
+        if previous and duplicate_policy == "block":
+            return JSONResponse({"error": DUPLICATE_PARTICIPANT_MESSAGE}, status_code=409)
+        if previous and duplicate_policy == "resume":
+            # Continue the earlier chat but hand back to this launch's survey response
+            session_id = previous["session_id"]
+            return_url = context["return_url"]
+            if previous.get("chat_outcome"):
+                return_url = append_chat_outcome_to_return_url(return_url, previous["chat_outcome"])
+            try:
+                await run_in_threadpool(
+                    conversations_col.update_one,
+                    {"session_id": session_id},
+                    {"$set": {"return_url_base": context["return_url"], "return_url": return_url}},
+                )
+                stored = await run_in_threadpool(load_conversation_state, conversations_col, session_id, LAUNCH_PROJECTION)
+            except PyMongoError as e:
+                logger.warning("Mongo resume error for %s: %s", session_id, e)
+                return JSONResponse({"error": f"Failed to resume conversation in MongoDB: {e}"}, status_code=503)
+        elif previous:
+            duplicate_of = previous["session_id"]
+
+    if stored:
+        if stored.get("status") == "abandoned":
+            try:
+                await run_in_threadpool(reactivate_conversation, conversations_col, session_id, get_current_time_in_berlin())
+            except PyMongoError as e:
+                logger.warning("Mongo reactivate error for %s: %s", session_id, e)
+        return JSONResponse({
+            "session_id": session_id,
+            "opening_message": get_opening_message(stored.get("language") or context["language"]),
+            "messages": [
+                {"role": m.get("role", ""), "content": m.get("content", "")}
+                for m in stored.get("messages") or []
+            ],
+            "input_active": stored_input_active(stored),
+            "return_url": stored.get("return_url") or context["return_url"],
+        })
+
+    # New conversations wait while OpenAI is saturated; resumed ones above never queue
+    admission_controller = request.app.state.admission_controller
+    if admission_controller:
+        ticket = context["id"] or context["prolific_pid"] or request.query_params.get("ticket") or generate_random_id()
+        admission = admission_controller.check(ticket)
+        if admission.screened_out:
+            return JSONResponse({
+                "screened_out": True,
+                "message": screenout_message(context["language"]),
+                "return_url": screenout_url(request.app.state.screenout_codes, context["study_id"]),
+            })
+        if not admission.admitted:
+            return JSONResponse({
+                "waiting": True,
+                "ticket": ticket,
+                "position": admission.position,
+                "message": waiting_room_message(context["language"], admission.position),
+                "retry_after_s": WAITING_ROOM_REFRESH_S,
+            }, status_code=202)
+
+    document = new_conversation_document(
+        session_id=session_id,
+        app_name=APP_NAME,
+        context=context,
+        password=context["password"],
+        current_time=get_current_time_in_berlin(),
+    )
+    document["system_message"] = get_system_message(
+        request.app.state.system_messages,
+        **prompt_claims(context),
+        survey_claim_initial_credence=context["survey_claim_initial_credence"],
+        control_flag=context["control_flag"],
+        language=context["language"],
+    )
+    if duplicate_of:
+        document["duplicate_of"] = duplicate_of
+    try:
+        await run_in_threadpool(
+            conversations_col.update_one,
+            {"session_id": session_id},
+            {"$setOnInsert": document},
+            upsert=True,
+        )
+    except PyMongoError as e:
+        return JSONResponse({"error": f"Failed to initialize conversation in MongoDB: {e}"}, status_code=500)
+
+    # Prepare the answer to the usual consent while the participant reads the opening message
+    speculator = request.app.state.first_turn_speculator
+    if speculator:
+        route = request.app.state.model_router.for_turn(1, context["control_flag"])
+        speculative_context = [{"role": "system", "content": document["system_message"]}]
+        first_turn_cache = request.app.state.first_turn_cache
+        cached = first_turn_cache and await run_in_threadpool(
+            first_turn_cache.get, first_turn_cache_key(speculative_context, consent_reply(context["language"]), route.model)
+        )
+        if not cached:
+            speculator.astart(
+                session_id,
+                speculative_context,
+                context["language"],
+                route.model,
+                make_agenerate(request.app.state.openai, route.model, route.reasoning_effort),
+            )
+
+    return JSONResponse({
+        "session_id": session_id,
+        "opening_message": get_opening_message(context["language"]),
+        "messages": [],
+        "input_active": 1,
+        "return_url": context["return_url"],
+    })
+
+
+async def run_turn(app, session_id: str, stored: dict, prompt: str, trace=NOOP_TRACE):
+    # Errors stay pending here until a conversation update writes them
+    errors = app.state.error_logs.get(session_id)
+    turn_started = time.perf_counter()
+    METRICS.count("turn")
+    METRICS.touch_session(session_id)
+
+    def error_recorder(stage: str):
+        return lambda message: errors.add(error_entry(stage, message))
+
+    with trace.span("prompt_assembly"):
+        complete_prompt = [{"role": "system", "content": stored.get("system_message") or ""}] + [
+            {"role": m.get("role", ""), "content": m.get("content", "")} for m in stored.get("messages") or []
+        ] + [{"role": "user", "content": prompt}]
+        route = app.state.model_router.for_turn(count_user_turns(complete_prompt), stored.get("control_flag", False))
+        model = route.model
+    trace.set_attributes({"llm.model": model, "llm.turn_type": route.turn_type})
+
+    with trace.span("first_turn_lookup") as span:
+        first_turn_cache = app.state.first_turn_cache
+        cache_key = first_turn_cache_key(complete_prompt[:-1], prompt, model) if first_turn_cache else ""
+        cached_response = await run_in_threadpool(first_turn_cache.get, cache_key) if cache_key else None
+        speculative_response = None
+        if app.state.first_turn_speculator:
+            handle = app.state.first_turn_speculator.take(
+                session_id, complete_prompt[:-1], stored.get("language") or "english", prompt, model
+            )
+            if handle and not cached_response:
+                speculative_response = await await_speculation(handle)
+        span.set_attribute("cache.hit", bool(cached_response))
+        span.set_attribute("speculation.used", bool(speculative_response))
+
+    full_response = ""
+    completion_tokens = 0
+    prompt_tokens = 0
+    if cached_response or speculative_response:
+        with trace.span("cached_replay"):
+            async for delta in aiter_cached_deltas(cached_response or speculative_response.text):
+                full_response += delta
+                yield sse_event("delta", {"text": delta})
+            if speculative_response:
+                prompt_tokens = speculative_response.prompt_tokens
+                completion_tokens = speculative_response.completion_tokens
+                if cache_key and not should_end_chat(full_response):
+                    await run_in_threadpool(first_turn_cache.put, cache_key, full_response, model)
+    else:
+        METRICS.count("openai_request")
+        for attempt in range(CHAT_ATTEMPTS):
+            full_response = ""
+            completion_tokens = 0
+            try:
+                with trace.span("openai_stream", attempt=attempt + 1) as span:
+                    on_fallback = error_recorder("responses_fallback")
+
+                    def on_error(message):
+                        span.set_attribute("openai.fallback", True)
+                        METRICS.count("openai_fallback")
+                        on_fallback(message)
+
+                    METRICS.count("openai_attempt")
+                    started = time.perf_counter()
+                    with METRICS.inflight("openai"), METRICS.timer("openai_stream_ms"):
+                        async for delta in aiter_response_deltas(
+                            app.state.openai, model, complete_prompt, route.reasoning_effort, on_error=on_error
+                        ):
+                            if not full_response:
+                                first_delta_ms = (time.perf_counter() - started) * 1000
+                                span.set_attribute("openai.first_delta_ms", round(first_delta_ms, 1))
+                                METRICS.observe("openai_first_delta_ms", first_delta_ms)
+                            full_response += delta
+                            completion_tokens += 1
+                            yield sse_event("delta", {"text": delta})
+                    span.set_attribute("openai.deltas", completion_tokens)
+                break
+            except Exception as e:
+                METRICS.count("openai_error")
+                errors.add(error_entry("chat_stream", str(e), type(e).__name__))
+                if attempt + 1 == CHAT_ATTEMPTS:
+                    yield sse_event("error", {"message": "The assistant is unavailable right now. Please try again."})
+                    return
+                await asyncio.sleep(random.uniform(2, 5))
+                yield sse_event("reset", {})
+
+        with trace.span("token_count"):
+            prompt_tokens = num_tokens_from_prompt(complete_prompt)
+        if cache_key and not should_end_chat(full_response):
+            await run_in_threadpool(first_turn_cache.put, cache_key, full_response, model)
+
+    input_active = 1
+    chat_outcome = stored.get("chat_outcome") or {}
+    return_url = stored.get("return_url") or ""
+    with trace.span("end_detection") as span:
+        chat_ended = should_end_chat(full_response)
+        span.set_attribute("chat.ended", chat_ended)
+    # Stop the chat once the handoff message is given.
+    if chat_ended:
+        messages = complete_prompt[1:] + [{"role": "assistant", "content": full_response}]
+        extraction_route = app.state.model_router.for_extraction(stored.get("control_flag", False))
+        with trace.span("outcome_extraction", **{"llm.model": extraction_route.model}), METRICS.timer("extraction_ms"):
+            chat_outcome = await abuild_chat_outcome(
+                app.state.openai,
+                extraction_route.model,
+                messages,
+                seeded_discussion_claim=stored.get("discussion_claim_seed", ""),
+                survey_claim=stored.get("survey_claim", ""),
+                control_flag=stored.get("control_flag", False),
+                control_claim=stored.get("control_claim", ""),
+                on_error=error_recorder("extraction"),
+                reasoning_effort=extraction_route.reasoning_effort,
+            )
+        with trace.span("return_url"):
+            return_url = append_chat_outcome_to_return_url(stored.get("return_url_base") or return_url, chat_outcome)
+        input_active = 0
+
+    # Persist conversation to MongoDB
+    messages_to_append = [
+        {"role": "user", "content": prompt, "ts": get_current_time_in_berlin()},
+        {"role": "assistant", "content": full_response, "ts": get_current_time_in_berlin(), **route.as_log()},
+    ]
+    turn_errors = errors.take_pending()
+    try:
+        with trace.span("mongo_write"), METRICS.timer("mongo_write_ms"):
+            await run_in_threadpool(
+                app.state.conversations.update_one,
+                {"session_id": session_id},
+                {
+                    "$set": {
+                        "updated_at": get_current_time_in_berlin(),
+                        **conversation_status_fields(input_active, get_current_time_in_berlin()),
+                        "last_model": model,
+                        "input_active": input_active,
+                        "discussion_claim": chat_outcome.get("discussion_claim", ""),
+                        "discussion_claim_initial_credence": chat_outcome.get("discussion_claim_initial_credence"),
+                        "discussion_claim_final_credence": chat_outcome.get("discussion_claim_final_credence"),
+                        "return_url": return_url,
+                        "chat_outcome": chat_outcome,
+                        **({"first_turn_cached": True} if cached_response else {}),
+                        **({"first_turn_speculative": True} if speculative_response else {}),
+                    },
+                    "$inc": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+                    "$push": {"messages": {"$each": messages_to_append}, **push_errors(turn_errors)},
+                },
+            )
+    except PyMongoError as e:
+        errors.requeue(turn_errors)
+        errors.add(error_entry("mongo_persist", str(e), type(e).__name__))
+        logger.warning("Mongo persist error for %s: %s", session_id, e)
+
+    METRICS.observe("turn_ms", (time.perf_counter() - turn_started) * 1000)
+    yield sse_event("done", {"input_active": input_active, "return_url": return_url})
+
+
+async def chat_turn(request: Request):
+    # Rejected requests are never finished, so only real turns are exported
+    trace = request.app.state.tracer.turn()
+    with trace.span("input"):
+        try:
+            payload = await request.json()
+        except ValueError:
+            return JSONResponse({"error": "Expected a JSON body"}, status_code=400)
+        if not password_ok(str(payload.get("password", ""))):
+            return JSONResponse({"error": "Wrong password in URL parameter 'password'"}, status_code=403)
+
+        session_id = str(payload.get("session_id", "")).strip()
+        prompt = str(payload.get("message", "")).strip()
+        if not session_id or not prompt:
+            return JSONResponse({"error": "session_id and message are required"}, status_code=400)
+
+        stored = await run_in_threadpool(
+            load_conversation_state, request.app.state.conversations, session_id, TURN_PROJECTION
+        )
+        if not stored:
+            return JSONResponse({"error": "Unknown session"}, status_code=404)
+        if stored_input_active(stored) != 1:
+            return JSONResponse({"error": "This conversation has ended"}, status_code=409)
+        # A double submit or retried request would append a second turn to the same history
+        active_turns = request.app.state.active_turns
+        if not active_turns.begin(session_id):
+            return JSONResponse({"error": "The previous message is still being answered"}, status_code=409)
+    trace.set_attributes(turn_attributes(session_id, stored.get("control_flag", False), stored.get("language") or ""))
+
+    return StreamingResponse(
+        active_turns.released(session_id, atraced(trace, run_turn(request.app, session_id, stored, prompt, trace))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    mongo_client = MongoClient(get_secret("MONGO_URI"))
+    mongo_db = mongo_client[get_secret("MONGO_DB_NAME", "streetgpt")]
+    app.state.conversations = mongo_db["conversations"]
+    app.state.error_logs = SessionErrorLogs()
+    app.state.active_turns = ActiveTurns()
+    await run_in_threadpool(ensure_conversation_indexes, app.state.conversations)
+    app.state.first_turn_cache = await run_in_threadpool(make_first_turn_cache, mongo_db)
+    app.state.first_turn_speculator = make_first_turn_speculator()
+    app.state.model_router = make_model_router(on_error=logger.error)
+    app.state.claims = mongo_db[CLAIMS_COLLECTION]
+    app.state.claim_registry = await run_in_threadpool(load_claim_registry, app.state.claims, logger.error)
+    app.state.system_messages = load_system_messages(on_error=logger.error)
+    app.state.openai = make_async_openai_client()
+    app.state.tracer = make_tracer("streetgpt-asgi")
+    app.state.admission_controller = make_admission_controller()
+    app.state.screenout_codes = load_screenout_codes()
+    # Warm up before uvicorn reports the app as started
+    await run_in_threadpool(warm_tokenizer)
+    if get_secret("OPENAI_API_KEY"):
+        await awarm_openai(app.state.openai)
+    try:
+        yield
+    finally:
+        await app.state.openai.close()
+        app.state.tracer.close()
+        mongo_client.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/", chat_page),
+        Route("/healthz", health),
+        Route("/admin", admin_page),
+        Route("/api/session", launch_session, methods=["POST"]),
+        Route("/api/chat", chat_turn, methods=["POST"]),
+        Route("/api/admin/studies", study_stats),
+        Route("/api/admin/errors", error_stats),
+        Route("/api/admin/metrics", metrics_stats),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,156 @@
+"""Opt-in cache for the first assistant turn.
+
+Every treatment conversation opens with the same fixed message and, for a given
+seeded claim, the same system prompt. When the participant's first reply is a
+short consent such as "yes" or "ok", the model's answer depends on nothing else,
+so it can be reused across participants. Entries live in an in-process LRU with
+a TTL and, optionally, in a Mongo collection shared by all workers. Hits are
+replayed word by word so the chat still looks streamed.
+
+Enable with FIRST_TURN_CACHE=1 (and FIRST_TURN_CACHE_MONGO=1 for the shared tier).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from cachetools import TTLCache
+from pymongo.errors import PyMongoError
+
+from streetgpt.core import get_secret, parse_bool_param, parse_int_param
+
+logger = logging.getLogger(__name__)
+
+FIRST_TURN_CACHE_COLLECTION = "first_turn_cache"
+# Longer replies are rarely shared between participants and may contain personal details
+MAX_CACHEABLE_REPLY_CHARS = 40
+REPLAY_DELAY_S = 0.015
+
+
+def normalize_reply(text: str) -> str:
+    """Lowercase, drop punctuation and emoji, and collapse whitespace."""
+    words = re.sub(r"[^\w\s]", " ", str(text or "").lower()).split()
+    return " ".join(words)
+
+
+def first_turn_key(context: list[dict], reply: str, model: str) -> str:
+    """Hash of the prompt before the reply, the normalized reply and the model.
+
+    The rendered system message in ``context`` already carries the template, the
+    claim and the language; the opening message is included when the runtime
+    sends it to the model.
+    """
+    payload = [[m.get("role", ""), m.get("content", "")] for m in context]
+    payload.append(["user", normalize_reply(reply)])
+    payload.append(["model", str(model or "")])
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def is_first_turn(context: list[dict]) -> bool:
+    """True while no user message has been answered yet."""
+    return all(m.get("role") != "user" for m in context)
+
+
+def is_cacheable_reply(reply: str) -> bool:
+    normalized = normalize_reply(reply)
+    return bool(normalized) and len(normalized) <= MAX_CACHEABLE_REPLY_CHARS
+
+
+def first_turn_cache_key(context: list[dict], reply: str, model: str) -> str:
+    """Cache key for this turn, or "" when the turn is not a cacheable first reply."""
+    if not is_first_turn(context) or not is_cacheable_reply(reply):
+        return ""
+    return first_turn_key(context, reply, model)
+
+
+def replay_words(text: str) -> list[str]:
+    # Keep the whitespace with each word so the chunks join back to the original
+    return re.findall(r"\S+\s*|\s+", text or "")
+
+
+def iter_cached_deltas(text: str, delay_s: float = REPLAY_DELAY_S):
+    for chunk in replay_words(text):
+        yield chunk
+        if delay_s:
+            time.sleep(delay_s)
+
+
+async def aiter_cached_deltas(text: str, delay_s: float = REPLAY_DELAY_S):
+    for chunk in replay_words(text):
+        yield chunk
+        if delay_s:
+            await asyncio.sleep(delay_s)
+
+
+class FirstTurnCache:
+    """LRU+TTL map from first_turn_key to the assistant's reply, with an optional Mongo tier."""
+
+    def __init__(self, ttl_s: int = 3600, maxsize: int = 512, collection=None):
+        self.ttl_s = ttl_s
+        self.collection = collection
+        self._memory: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_s)
+        self._lock = threading.Lock()
+        if collection is not None:
+            try:
+                collection.create_index("created_at", expireAfterSeconds=ttl_s)
+            except PyMongoError as e:
+                logger.warning("Could not create first-turn cache TTL index: %s", e)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            text = self._memory.get(key)
+        if text is not None or self.collection is None:
+            return text
+        try:
+            doc = self.collection.find_one({"_id": key}, {"_id": 0, "text": 1, "created_at": 1})
+        except PyMongoError as e:
+            logger.warning("First-turn cache lookup failed: %s", e)
+            return None
+        if not doc:
+            return None
+        # Mongo's TTL monitor only runs once a minute
+        created_at = doc.get("created_at")
+        if created_at and (datetime.now(timezone.utc) - created_at.replace(tzinfo=timezone.utc)).total_seconds() > self.ttl_s:
+            return None
+        text = doc.get("text")
+        if text:
+            with self._lock:
+                self._memory[key] = text
+        return text
+
+    def put(self, key: str, text: str, model: str = ""):
+        if not text:
+            return
+        with self._lock:
+            self._memory[key] = text
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one(
+                {"_id": key},
+                {"$setOnInsert": {"text": text, "model": model, "created_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            logger.warning("First-turn cache write failed: %s", e)
+
+
+def make_first_turn_cache(db=None) -> FirstTurnCache | None:
+    """Build the cache from FIRST_TURN_CACHE* settings, or None when disabled."""
+    if not parse_bool_param(get_secret("FIRST_TURN_CACHE"), False):
+        return None
+    collection = None
+    if db is not None and parse_bool_param(get_secret("FIRST_TURN_CACHE_MONGO"), False):
+        collection = db[FIRST_TURN_CACHE_COLLECTION]
+    return FirstTurnCache(
+        ttl_s=parse_int_param(get_secret("FIRST_TURN_CACHE_TTL_S"), 3600),
+        maxsize=parse_int_param(get_secret("FIRST_TURN_CACHE_SIZE"), 512),
+        collection=collection,
+    )
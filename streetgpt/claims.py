@@ -0,0 +1,193 @@
+"""Registry of seeded claims with stable IDs.
+
+Claims reach the app as free text in URL parameters, so the same survey item can
+arrive with different whitespace, quotes or trailing punctuation. Each claim is
+reduced to a match key (casefolded, punctuation-free); every text with the same
+key gets one claim ID and one canonical text. The canonical text is what goes
+into the system prompt, so equivalent launches share one prompt, one prompt-cache
+prefix and one first-turn cache entry. The participant's own wording is kept
+unchanged in the conversation and in the return URL; the ID and canonical text
+are stored next to it.
+
+Known claims and their aliases come from config/claims.yaml and the ``claims``
+collection in Mongo. Claims not listed there still get a stable ID derived from
+their match key, and are recorded in Mongo the first time a process sees them.
+Since those arrive as URL input, only the most recent MAX_UNLISTED_CLAIMS of
+them are kept in memory.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from pymongo.errors import PyMongoError
+
+from streetgpt.core import ErrorCallback, get_current_time_in_berlin, get_secret
+
+logger = logging.getLogger(__name__)
+
+CLAIMS_COLLECTION = "claims"
+MAX_UNLISTED_CLAIMS = 10000
+# Context fields that hold a claim, and the fields that store its ID and canonical text
+CLAIM_FIELDS = {
+    "survey_claim": ("survey_claim_id", "survey_claim_canonical"),
+    "discussion_claim_seed": ("discussion_claim_seed_id", "discussion_claim_seed_canonical"),
+    "control_claim": ("control_claim_id", "control_claim_canonical"),
+}
+
+_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'", "‚": "'", "–": "-", "—": "-"})
+
+
+def clean_claim_text(text: str) -> str:
+    """Unicode-normalize, straighten quotes and dashes, and collapse whitespace."""
+    cleaned = unicodedata.normalize("NFKC", str(text or "")).translate(_QUOTES)
+    cleaned = " ".join(cleaned.split())
+    # Qualtrics piping sometimes wraps the claim in quotes
+    if len(cleaned) > 1 and cleaned[0] == cleaned[-1] and cleaned[0] in "\"'":
+        cleaned = cleaned[1:-1].strip()
+    return cleaned
+
+
+def claim_match_key(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", clean_claim_text(text).casefold()).split())
+
+
+def derived_claim_id(text: str) -> str:
+    return "c_" + hashlib.sha256(claim_match_key(text).encode("utf-8")).hexdigest()[:12]
+
+
+def _remember(lru: OrderedDict, key, value, max_size: int):
+    lru[key] = value
+    lru.move_to_end(key)
+    if len(lru) > max_size:
+        lru.popitem(last=False)
+
+
+class ClaimRegistry:
+    """In-memory map from claim match key to (claim ID, canonical text).
+
+    Listed claims (config and Mongo) are kept for the life of the process;
+    unlisted claims seen in launch URLs and the IDs already recorded in Mongo
+    are kept in LRUs of max_unlisted entries.
+    """
+
+    def __init__(self, max_unlisted: int = MAX_UNLISTED_CLAIMS):
+        self._by_key: dict[str, tuple[str, str]] = {}
+        self._unlisted: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._recorded: OrderedDict[str, None] = OrderedDict()
+        self._max_unlisted = max_unlisted
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.claims())
+
+    def claims(self) -> dict[str, str]:
+        """Claim ID -> canonical text of every claim currently known."""
+        with self._lock:
+            return dict([*self._by_key.values(), *self._unlisted.values()])
+
+    def add(self, claim_id: str, text: str, aliases=()):
+        text = clean_claim_text(text)
+        with self._lock:
+            for variant in (text, *aliases):
+                key = claim_match_key(variant)
+                if key:
+                    self._by_key[key] = (claim_id, text)
+
+    def load_config(self, data: dict):
+        for entry in (data or {}).get("claims") or []:
+            if entry.get("id") and entry.get("text"):
+                self.add(str(entry["id"]), entry["text"], entry.get("aliases") or ())
+
+    def load_mongo(self, collection):
+        # Config entries win over IDs that were only ever derived and recorded
+        for doc in collection.find({}, {"_id": 1, "text": 1, "aliases": 1}):
+            if claim_match_key(doc.get("text", "")) not in self._by_key:
+                self.add(str(doc["_id"]), doc.get("text", ""), doc.get("aliases") or ())
+
+    def resolve(self, text) -> tuple[str, str]:
+        """(claim_id, canonical_text) for a claim; ("", "") when there is no claim."""
+        if text in (None, 0, "0"):
+            return "", ""
+        key = claim_match_key(text)
+        if not key:
+            return "", ""
+        with self._lock:
+            if key in self._by_key:
+                return self._by_key[key]
+            # The first wording seen for an unlisted claim becomes its canonical text
+            resolved = self._unlisted.get(key) or (derived_claim_id(text), clean_claim_text(text))
+            _remember(self._unlisted, key, resolved, self._max_unlisted)
+            return resolved
+
+    def record(self, collection, claim_id: str, text: str):
+        """Insert a claim into Mongo once per process; existing entries are left alone."""
+        if not claim_id:
+            return
+        with self._lock:
+            if claim_id in self._recorded:
+                self._recorded.move_to_end(claim_id)
+                return
+        try:
+            collection.update_one(
+                {"_id": claim_id},
+                {"$setOnInsert": {"text": text, "first_seen": get_current_time_in_berlin()}},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            logger.warning("Could not record claim %s: %s", claim_id, e)
+            return
+        with self._lock:
+            _remember(self._recorded, claim_id, None, self._max_unlisted)
+
+
+def load_claim_registry(claims_collection=None, on_error: ErrorCallback = None) -> ClaimRegistry:
+    import yaml
+
+    registry = ClaimRegistry()
+    path = get_secret("CLAIMS_FILE", "/app/config/claims.yaml")
+    if not os.path.isfile(path):
+        # local fallback for non-docker runs
+        local_fallback = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "claims.yaml")
+        if os.path.isfile(local_fallback):
+            path = local_fallback
+    if os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                registry.load_config(yaml.safe_load(f))
+        except Exception as e:
+            if on_error:
+                on_error(f"Failed to load claims from {path}: {e}")
+    if claims_collection is not None:
+        try:
+            registry.load_mongo(claims_collection)
+        except PyMongoError as e:
+            if on_error:
+                on_error(f"Failed to load claims from Mongo: {e}")
+    return registry
+
+
+def apply_claim_registry(context: dict, registry: ClaimRegistry, claims_collection=None) -> dict:
+    """Add the claim ID and canonical text of each claim to a query context; the claims stay as given."""
+    resolved = dict(context)
+    for field, (id_field, canonical_field) in CLAIM_FIELDS.items():
+        claim_id, text = registry.resolve(context.get(field))
+        resolved[id_field] = claim_id
+        resolved[canonical_field] = text
+        if claim_id and claims_collection is not None:
+            registry.record(claims_collection, claim_id, text)
+    return resolved
+
+
+def prompt_claims(context: dict) -> dict:
+    """Claim keyword arguments for get_system_message: canonical texts where known, else the claims as given."""
+    return {
+        field: context.get(canonical_field) or context.get(field, 0)
+        for field, (_, canonical_field) in CLAIM_FIELDS.items()
+    }
@@ -0,0 +1,728 @@
+"""Runtime-independent chat logic shared by the Streamlit app and the ASGI backend."""
+
+from __future__ import annotations
+
+import functools
+import json
+import os
+import random
+import re
+import string
+from datetime import datetime
+from typing import Callable
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from pymongo import ASCENDING
+
+# tiktoken, openai, pytz and yaml are imported where first needed so a cold
+# process can serve its first page before they are loaded.
+
+ErrorCallback = Callable[[str], None] | None
+
+OPENING_MESSAGE_ENGLISH = "Hi there! I'm Chip. I'm here to help you explore and reflect on your beliefs. Before we start: this is a conversation about how we know things. Some questions can feel probing; you can skip any or stop anytime. Okay to proceed?"
+OPENING_MESSAGE_GERMAN = "Hallo, mein Name ist Chip. Ich kann dir helfen, deine Überzeugungen zu hinterfragen. Bevor wir beginnen: Dies ist ein Gespräch darüber, woher ir Dinge wissen. Du kannst jederzeit eine Frage überspringen oder ganz aufhören. Einverstanden, dass wir fortfahren?"
+
+ASSISTANT_AVATAR = "🧑‍🎤"
+USER_AVATAR = "🧐"
+
+
+def get_secret(name: str, default=None):
+    # Read only from environment to avoid requiring a secrets.toml
+    env_val = os.getenv(name)
+    return env_val if (env_val is not None and env_val != "") else default
+
+
+### Query parameters ##
+
+def get_query_param(url_params: dict[str, list[str]], name: str, default=""):
+    value = url_params.get(name, [default])
+    if not value:
+        return default
+    return value[0]
+
+
+def parse_int_param(value, default=0) -> int:
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_claim(value):
+    if value is None:
+        return 0
+    claim = str(value).strip()
+    return claim if claim else 0
+
+
+def normalize_language(value) -> str:
+    language = str(value or "english").strip().lower()
+    return language if language in {"english", "german"} else "english"
+
+
+def parse_bool_param(value, default=False) -> bool:
+    if value is None:
+        return default
+    normalized = str(value).strip().lower()
+    if not normalized:
+        return default
+    if normalized in {"1", "true", "yes", "y", "on", "control"}:
+        return True
+    if normalized in {"0", "false", "no", "n", "off", "treatment"}:
+        return False
+    return default
+
+
+def parse_query_context(url_params: dict[str, list[str]]) -> dict:
+    legacy_claim = normalize_claim(get_query_param(url_params, "claim", ""))
+    legacy_credence = parse_int_param(get_query_param(url_params, "credence", 0), 0)
+    survey_claim = normalize_claim(
+        get_query_param(
+            url_params,
+            "survey_claim",
+            get_query_param(url_params, "evaluation_claim", legacy_claim),
+        )
+    )
+    survey_claim_initial_credence = parse_int_param(
+        get_query_param(
+            url_params,
+            "survey_claim_initial_credence",
+            get_query_param(
+                url_params,
+                "survey_credence",
+                get_query_param(url_params, "evaluation_credence", legacy_credence),
+            ),
+        ),
+        0,
+    )
+    control_flag = parse_bool_param(
+        get_query_param(url_params, "control_flag", get_query_param(url_params, "control", "0")),
+        False,
+    )
+    control_claim = normalize_claim(
+        get_query_param(url_params, "control_claim", get_query_param(url_params, "control_claim_text", "")),
+    )
+    discussion_claim_override = normalize_claim(
+        get_query_param(url_params, "discussion_claim_seed", get_query_param(url_params, "discussion_claim", "")),
+    )
+    if discussion_claim_override not in (None, 0, "0"):
+        discussion_claim_seed = discussion_claim_override
+    else:
+        discussion_claim_seed = survey_claim
+
+    return {
+        "password": get_query_param(url_params, "password", "na"),
+        "survey_claim": survey_claim,
+        "survey_claim_initial_credence": survey_claim_initial_credence,
+        "control_flag": control_flag,
+        "control_claim": control_claim,
+        "discussion_claim_seed": discussion_claim_seed,
+        "launch_nonce": str(get_query_param(url_params, "launch_nonce", "")).strip(),
+        "id": str(get_query_param(url_params, "id", "")).strip(),
+        "language": normalize_language(get_query_param(url_params, "language", "english")),
+        "prolific_pid": str(get_query_param(url_params, "prolific_pid", "")).strip(),
+        "study_id": str(get_query_param(url_params, "study_id", "")).strip(),
+        "session_id": str(get_query_param(url_params, "session_id", "")).strip(),
+        "return_url": str(get_query_param(url_params, "return_url", "")).strip(),
+    }
+
+
+### Helpers ##
+
+def generate_random_id(length=10):
+    letters = string.ascii_letters + string.digits
+    result_str = ''.join(random.choice(letters) for i in range(length))
+    return result_str
+
+
+@functools.cache
+def get_berlin_timezone():
+    import pytz
+
+    return pytz.timezone('Europe/Berlin')
+
+
+def get_current_time_in_berlin():
+    berlin_tz = get_berlin_timezone()
+    current_time = datetime.now(berlin_tz)
+    formatted_time = current_time.strftime("%Y-%m-%d %H:%M:%S %Z%z")
+    return formatted_time
+
+
+@functools.cache
+def get_token_encoding(encoding_name="cl100k_base"):
+    # Reads the BPE ranks from TIKTOKEN_CACHE_DIR, which the image pre-populates
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def num_tokens_from_prompt(prompt, encoding_name="cl100k_base") -> int:
+    """Returns the number of tokens in a text string."""
+    string_buf = ""
+    for dic in prompt:
+        content = dic.get("content")
+        string_buf += f"{content}\n"
+    encoding = get_token_encoding(encoding_name)
+    num_tokens = len(encoding.encode(string_buf))
+    return num_tokens
+
+
+def should_end_chat(response: str) -> bool:
+    lowered = response.lower()
+    return "goodbye" in lowered or "return to the survey" in lowered
+
+
+def get_opening_message(language: str) -> str:
+    if language == "german":
+        return OPENING_MESSAGE_GERMAN
+    return OPENING_MESSAGE_ENGLISH
+
+
+### System messages ##
+
+def load_system_messages(on_error: ErrorCallback = None) -> dict:
+    import yaml
+
+    # Default path inside container, fallback to local dev path
+    default_path = "/app/config/system_messages.yaml"
+    path = get_secret("SYSTEM_MESSAGES_FILE", default_path)
+    if not os.path.isfile(path):
+        # local fallback for non-docker runs
+        local_fallback = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "system_messages.yaml")
+        if os.path.isfile(local_fallback):
+            path = local_fallback
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    except Exception as e:
+        if on_error:
+            on_error(f"Failed to load system messages from {path}: {e}")
+        return {}
+
+
+def get_system_message(
+    system_messages: dict,
+    survey_claim: str | int,
+    survey_claim_initial_credence: int,
+    discussion_claim_seed: str | int,
+    control_claim: str | int,
+    control_flag: bool,
+    language: str,
+):
+    is_claim = 0 if discussion_claim_seed == 0 else 1
+    lang_key = "german" if language == "german" else "english"
+    if is_claim:
+        template_key = "with_claim_control" if control_flag else "with_claim"
+        template = ((system_messages.get(template_key, {}) or {}).get(lang_key))
+        if not template:
+            template = ((system_messages.get("with_claim", {}) or {}).get(lang_key))
+        if not template:
+            template = "You are StreetGPT. Keep answers concise. Claim: {claim}."
+        try:
+            return template.format(
+                claim=discussion_claim_seed,
+                credence=survey_claim_initial_credence,
+                survey_claim=survey_claim,
+                survey_credence=survey_claim_initial_credence,
+                survey_claim_initial_credence=survey_claim_initial_credence,
+                discussion_claim=discussion_claim_seed,
+                control_claim=control_claim,
+            )
+        except Exception:
+            return template
+    else:
+        message = (
+            (system_messages.get("no_claim", {}) or {}).get(lang_key)
+        )
+        if not message:
+            message = "You are StreetGPT. Keep answers concise."
+        return message
+
+
+### OpenAI ##
+
+def openai_http_settings() -> dict:
+    """Connection-pool limits and timeouts shared by the sync and async OpenAI clients."""
+    import httpx
+
+    max_connections = parse_int_param(get_secret("OPENAI_MAX_CONNECTIONS"), 100)
+    return {
+        # One connection per concurrently streaming participant; keep most of them warm
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=120,
+        ),
+        # Fail fast on connect; the read timeout is the longest gap between streamed chunks
+        "timeout": httpx.Timeout(
+            parse_int_param(get_secret("OPENAI_READ_TIMEOUT_S"), 90),
+            connect=parse_int_param(get_secret("OPENAI_CONNECT_TIMEOUT_S"), 5),
+        ),
+        "http2": True,
+    }
+
+
+def make_openai_client():
+    import httpx
+    from openai import OpenAI
+
+    settings = openai_http_settings()
+    return OpenAI(
+        api_key=get_secret("OPENAI_API_KEY"),
+        timeout=settings["timeout"],
+        http_client=httpx.Client(**settings),
+    )
+
+
+def make_async_openai_client():
+    import httpx
+    from openai import AsyncOpenAI
+
+    settings = openai_http_settings()
+    return AsyncOpenAI(
+        api_key=get_secret("OPENAI_API_KEY"),
+        timeout=settings["timeout"],
+        http_client=httpx.AsyncClient(**settings),
+    )
+
+
+def _chat_chunk_delta(chunk) -> str:
+    # delta may be an object (with .content) or a dict; guard both
+    delta_obj = getattr(chunk.choices[0], "delta", None)
+    if isinstance(delta_obj, dict):
+        return delta_obj.get("content", "") or ""
+    return getattr(delta_obj, "content", "") or ""
+
+
+def _response_kwargs(model, messages, reasoning_effort: str | None) -> dict:
+    kwargs = {"model": model, "input": messages}
+    if reasoning_effort:
+        kwargs["reasoning"] = {"effort": reasoning_effort}
+    return kwargs
+
+
+def iter_response_deltas(client, model, messages, reasoning_effort: str | None = "low", on_error: ErrorCallback = None):
+    """Yield streamed text deltas, preferring the Responses API and falling back to Chat Completions."""
+    # Prefer Responses API for GPT‑5 (supports reasoning controls)
+    if str(model).lower().startswith("gpt-5"):
+        kwargs = _response_kwargs(model, messages, reasoning_effort)
+        try:
+            with client.responses.stream(**kwargs) as stream:
+                for event in stream:
+                    # event.delta can be a string or missing; guard accordingly
+                    if getattr(event, "type", "").startswith("response.output_text"):
+                        delta = getattr(event, "delta", "") or ""
+                        if delta:
+                            yield str(delta)
+                _ = stream.get_final_response()
+            return
+        except Exception as e_resp:
+            # Fall through to Chat Completions on any Responses error
+            if on_error:
+                on_error(f"responses_api_error: {type(e_resp).__name__}: {e_resp}")
+
+    # Fallback: Chat Completions streaming (works across many models)
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+    )
+    for chunk in stream:
+        delta = _chat_chunk_delta(chunk)
+        if delta:
+            yield delta
+
+
+async def aiter_response_deltas(
+    client, model, messages, reasoning_effort: str | None = "low", on_error: ErrorCallback = None
+):
+    """Async counterpart of iter_response_deltas for an AsyncOpenAI client."""
+    if str(model).lower().startswith("gpt-5"):
+        kwargs = _response_kwargs(model, messages, reasoning_effort)
+        try:
+            async with client.responses.stream(**kwargs) as stream:
+                async for event in stream:
+                    if getattr(event, "type", "").startswith("response.output_text"):
+                        delta = getattr(event, "delta", "") or ""
+                        if delta:
+                            yield str(delta)
+                _ = await stream.get_final_response()
+            return
+        except Exception as e_resp:
+            if on_error:
+                on_error(f"responses_api_error: {type(e_resp).__name__}: {e_resp}")
+
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+    )
+    async for chunk in stream:
+        delta = _chat_chunk_delta(chunk)
+        if delta:
+            yield delta
+
+
+### Chat outcome ##
+
+EXTRACTION_SYSTEM_MESSAGE = (
+    "You extract structured study outcomes from a finished Street Epistemology chat. "
+    "Return JSON only with keys discussion_claim, discussion_claim_initial_credence, and discussion_claim_final_credence. "
+    "discussion_claim should be the clarified or rephrased version of the SURVEY CLAIM that the participant settled on near the start of the chat. "
+    "discussion_claim_initial_credence should be the 1-10 confidence they gave for that clarified survey claim near the start of the chat, after clarification. "
+    "discussion_claim_final_credence should be the 1-10 confidence they gave at the end for that same clarified survey claim. "
+    "If this is a control-condition transcript, the middle of the conversation may discuss a separate control claim. Ignore that and still extract only the clarified survey claim and its baseline/endline confidence. "
+    "Use null for missing values. Do not infer a final credence unless the participant explicitly gives one."
+)
+
+
+def truncate_text(value: str, limit: int = 500) -> str:
+    collapsed = re.sub(r"\s+", " ", str(value or "")).strip()
+    return collapsed[:limit]
+
+
+def normalize_credence(value, default=None):
+    parsed = parse_int_param(value, 0)
+    if 1 <= parsed <= 10:
+        return parsed
+    return default
+
+
+def extract_json_object(raw_text: str) -> dict:
+    text = (raw_text or "").strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*", "", text)
+        text = re.sub(r"\s*```$", "", text)
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end == -1 or end < start:
+        raise ValueError("No JSON object found in extractor response")
+    return json.loads(text[start:end + 1])
+
+
+def compose_chat_outcome(discussion_claim: str, initial_credence, final_credence) -> dict:
+    return {
+        "discussion_claim": discussion_claim,
+        "discussion_claim_initial_credence": initial_credence,
+        "discussion_claim_final_credence": final_credence,
+    }
+
+
+def normalize_chat_outcome(raw_outcome: dict, seeded_discussion_claim) -> dict:
+    seeded_claim_text = ""
+    if seeded_discussion_claim not in (None, 0, "0"):
+        seeded_claim_text = truncate_text(seeded_discussion_claim)
+
+    discussion_claim = truncate_text(
+        raw_outcome.get("discussion_claim")
+        or raw_outcome.get("discussion_claim_text")
+        or raw_outcome.get("revised_claim")
+        or raw_outcome.get("revised_claim_text")
+        or raw_outcome.get("clarified_claim")
+        or seeded_claim_text
+    )
+    initial_credence = normalize_credence(
+        raw_outcome.get("discussion_claim_initial_credence")
+        or raw_outcome.get("revised_claim_initial_credence")
+        or raw_outcome.get("clarified_claim_initial_confidence"),
+        default=None,
+    )
+    final_credence = normalize_credence(
+        raw_outcome.get("discussion_claim_final_credence")
+        or raw_outcome.get("revised_claim_final_credence")
+        or raw_outcome.get("clarified_claim_final_confidence"),
+        default=None,
+    )
+    return compose_chat_outcome(discussion_claim, initial_credence, final_credence)
+
+
+def build_extraction_request(
+    messages,
+    seeded_discussion_claim,
+    survey_claim="",
+    control_flag=False,
+    control_claim="",
+):
+    """Return the extractor user prompt, or "" when the transcript is empty."""
+    transcript_lines = []
+    for message in messages:
+        content = str(message.get("content", "")).strip()
+        role = str(message.get("role", "")).strip().lower()
+        if content and role in {"assistant", "user"}:
+            transcript_lines.append(f"{role.upper()}: {content}")
+    transcript = "\n\n".join(transcript_lines)
+    if not transcript:
+        return ""
+
+    seeded_claim_text = "" if seeded_discussion_claim in (None, 0, "0") else str(seeded_discussion_claim)
+    survey_claim_text = "" if survey_claim in (None, 0, "0") else str(survey_claim)
+    control_claim_text = "" if control_claim in (None, 0, "0") else str(control_claim)
+    return (
+        f"Condition: {'control' if control_flag else 'treatment'}\n"
+        f"Survey claim measured in Qualtrics outside the chatbot: {survey_claim_text or 'null'}\n"
+        f"Seeded discussion claim for the chatbot: {seeded_claim_text or 'null'}\n\n"
+        f"Separate control-claim discussion topic, if any: {control_claim_text or 'null'}\n\n"
+        f"Transcript:\n{transcript}"
+    )
+
+
+def _extraction_kwargs(model, extraction_user: str, reasoning_effort: str | None = "low") -> dict:
+    request_kwargs = {
+        "model": model,
+        "input": [
+            {"role": "system", "content": EXTRACTION_SYSTEM_MESSAGE},
+            {"role": "user", "content": extraction_user},
+        ],
+    }
+    if str(model).lower().startswith("gpt-5") and reasoning_effort:
+        request_kwargs["reasoning"] = {"effort": reasoning_effort}
+    return request_kwargs
+
+
+def _fallback_chat_outcome(seeded_discussion_claim) -> dict:
+    fallback = normalize_chat_outcome({}, seeded_discussion_claim)
+    fallback["extractor_status"] = "fallback"
+    fallback["extractor_model"] = ""
+    return fallback
+
+
+def _parsed_chat_outcome(output_text: str, seeded_discussion_claim, model) -> dict:
+    parsed = extract_json_object(output_text or "")
+    outcome = normalize_chat_outcome(parsed, seeded_discussion_claim)
+    outcome["extractor_status"] = "ok"
+    outcome["extractor_model"] = model
+    return outcome
+
+
+def build_chat_outcome(
+    client,
+    model,
+    messages,
+    seeded_discussion_claim,
+    survey_claim="",
+    control_flag=False,
+    control_claim="",
+    on_error: ErrorCallback = None,
+    reasoning_effort: str | None = "low",
+):
+    fallback = _fallback_chat_outcome(seeded_discussion_claim)
+    extraction_user = build_extraction_request(
+        messages, seeded_discussion_claim, survey_claim, control_flag, control_claim
+    )
+    if not extraction_user:
+        fallback["extractor_error"] = "empty_transcript"
+        return fallback
+
+    try:
+        response = client.responses.create(**_extraction_kwargs(model, extraction_user, reasoning_effort))
+        return _parsed_chat_outcome(response.output_text, seeded_discussion_claim, model)
+    except Exception as e:
+        if on_error:
+            on_error(f"chat_outcome_extract_error: {type(e).__name__}: {e}")
+        fallback["extractor_error"] = f"{type(e).__name__}: {e}"
+        fallback["extractor_model"] = model
+        return fallback
+
+
+async def abuild_chat_outcome(
+    client,
+    model,
+    messages,
+    seeded_discussion_claim,
+    survey_claim="",
+    control_flag=False,
+    control_claim="",
+    on_error: ErrorCallback = None,
+    reasoning_effort: str | None = "low",
+):
+    """Async counterpart of build_chat_outcome for an AsyncOpenAI client."""
+    fallback = _fallback_chat_outcome(seeded_discussion_claim)
+    extraction_user = build_extraction_request(
+        messages, seeded_discussion_claim, survey_claim, control_flag, control_claim
+    )
+    if not extraction_user:
+        fallback["extractor_error"] = "empty_transcript"
+        return fallback
+
+    try:
+        response = await client.responses.create(**_extraction_kwargs(model, extraction_user, reasoning_effort))
+        return _parsed_chat_outcome(response.output_text, seeded_discussion_claim, model)
+    except Exception as e:
+        if on_error:
+            on_error(f"chat_outcome_extract_error: {type(e).__name__}: {e}")
+        fallback["extractor_error"] = f"{type(e).__name__}: {e}"
+        fallback["extractor_model"] = model
+        return fallback
+
+
+def append_chat_outcome_to_return_url(return_url: str, chat_outcome: dict) -> str:
+    if not return_url:
+        return return_url
+
+    split_url = urlsplit(return_url)
+    params = dict(parse_qsl(split_url.query, keep_blank_values=True))
+    for legacy_field_name in (
+        "revised_claim",
+        "revised_claim_text",
+        "revised_claim_initial_credence",
+        "revised_claim_final_credence",
+    ):
+        params.pop(legacy_field_name, None)
+    for field_name in (
+        "discussion_claim",
+        "discussion_claim_initial_credence",
+        "discussion_claim_final_credence",
+    ):
+        value = chat_outcome.get(field_name)
+        if value in (None, ""):
+            params.pop(field_name, None)
+        else:
+            params[field_name] = str(value)
+    return urlunsplit(
+        (
+            split_url.scheme,
+            split_url.netloc,
+            split_url.path,
+            urlencode(params, doseq=True),
+            split_url.fragment,
+        )
+    )
+
+
+### MongoDB ##
+
+# Fields needed to resume a conversation after a reload or dropped websocket
+CONVERSATION_STATE_PROJECTION = {
+    "_id": 0,
+    "messages.role": 1,
+    "messages.content": 1,
+    "prompt_tokens": 1,
+    "completion_tokens": 1,
+    "input_active": 1,
+    "chat_outcome": 1,
+    "return_url": 1,
+    "last_model": 1,
+    "status": 1,
+}
+
+
+# Every index on conversations, as (keys, options). mongo-init/init.js creates the
+# same set for fresh databases; streetgpt.indexes checks the queries that rely on them.
+CONVERSATION_INDEXES = [
+    ([("session_id", ASCENDING)], {"unique": True}),
+    ([("created_at", ASCENDING)], {}),
+    # Study monitoring and exports: equality on app and study, range on created_at
+    ([("app", ASCENDING), ("study_id", ASCENDING), ("created_at", ASCENDING)], {}),
+    # Returning-participant lookups
+    ([("prolific_pid", ASCENDING), ("study_id", ASCENDING)], {}),
+    # Per-claim analytics across studies
+    ([("survey_claim_id", ASCENDING), ("created_at", ASCENDING)], {}),
+    # Only finished chats carry an extractor status
+    (
+        [("chat_outcome.extractor_status", ASCENDING), ("created_at", ASCENDING)],
+        {"partialFilterExpression": {"chat_outcome.extractor_status": {"$exists": True}}},
+    ),
+]
+
+
+def ensure_conversation_indexes(collection):
+    # Ensure indexes (idempotent)
+    try:
+        for keys, options in CONVERSATION_INDEXES:
+            collection.create_index(keys, **options)
+    except Exception:
+        pass
+
+
+def load_conversation_state(collection, session_id: str, projection: dict | None = None):
+    if not session_id:
+        return None
+    return collection.find_one({"session_id": session_id}, projection or CONVERSATION_STATE_PROJECTION)
+
+
+DUPLICATE_PARTICIPANT_POLICIES = {"off", "resume", "block", "flag"}
+DUPLICATE_PARTICIPANT_MESSAGE = "You have already taken part in this study. Thank you!"
+
+
+def get_duplicate_participant_policy() -> str:
+    # What to do when a Prolific participant launches a second conversation in the same study
+    policy = str(get_secret("DUPLICATE_PARTICIPANT_POLICY", "off")).strip().lower()
+    return policy if policy in DUPLICATE_PARTICIPANT_POLICIES else "off"
+
+
+def find_previous_participation(collection, prolific_pid: str, study_id: str, session_id: str):
+    """Latest other conversation of this participant in this study, via the {prolific_pid, study_id} index."""
+    if not prolific_pid or not study_id:
+        return None
+    return collection.find_one(
+        {"prolific_pid": prolific_pid, "study_id": study_id, "session_id": {"$ne": session_id}},
+        {**CONVERSATION_STATE_PROJECTION, "session_id": 1},
+        sort=[("created_at", -1)],
+    )
+
+
+def stored_input_active(stored: dict) -> int:
+    # Older documents predate input_active; a stored outcome means the chat ended.
+    input_active = stored.get("input_active")
+    if input_active is None:
+        input_active = 0 if stored.get("chat_outcome") else 1
+    return input_active
+
+
+def conversation_status_fields(input_active: int, current_time: str) -> dict:
+    if input_active:
+        return {"status": "active"}
+    return {"status": "completed", "completed_at": current_time}
+
+
+def reactivate_conversation(collection, session_id: str, current_time: str):
+    """Clear the abandoned mark once the participant comes back."""
+    collection.update_one(
+        {"session_id": session_id, "status": "abandoned"},
+        {"$set": {"status": "active", "resumed_at": current_time}},
+    )
+
+
+def new_conversation_document(
+    session_id: str,
+    app_name: str,
+    context: dict,
+    password: str,
+    current_time: str,
+) -> dict:
+    return {
+        "session_id": session_id,
+        "app": app_name,
+        "status": "active",
+        "created_at": current_time,
+        "updated_at": current_time,
+        "survey_claim": context["survey_claim"],
+        "survey_claim_initial_credence": context["survey_claim_initial_credence"],
+        "control_flag": context["control_flag"],
+        "control_claim": context["control_claim"],
+        "discussion_claim_seed": context["discussion_claim_seed"],
+        "survey_claim_id": context.get("survey_claim_id", ""),
+        "control_claim_id": context.get("control_claim_id", ""),
+        "discussion_claim_seed_id": context.get("discussion_claim_seed_id", ""),
+        "survey_claim_canonical": context.get("survey_claim_canonical", ""),
+        "control_claim_canonical": context.get("control_claim_canonical", ""),
+        "discussion_claim_seed_canonical": context.get("discussion_claim_seed_canonical", ""),
+        "discussion_claim": "",
+        "discussion_claim_initial_credence": None,
+        "discussion_claim_final_credence": None,
+        "language": context["language"],
+        "prolific_pid": context["prolific_pid"],
+        "study_id": context["study_id"],
+        "prolific_session_id": context["session_id"],
+        "return_url_base": context["return_url"],
+        "return_url": context["return_url"],
+        "chat_outcome": {},
+        "password_used": password,
+        "last_model": "",
+        "errors": [],
+        "input_active": 1,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "messages": []
+    }
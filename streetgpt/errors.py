@@ -0,0 +1,56 @@
+"""Structured per-session errors and process-wide error counters.
+
+Each error is a small ``{ts, stage, type, message}`` document. Conversations
+keep the most recent MAX_ERROR_ENTRIES of them in an ``errors`` array that is
+appended with ``$push``/``$slice``, so a write never rewrites earlier errors and
+the array cannot grow without bound. Every entry also bumps a per-process
+counter keyed by stage and type for the admin view.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import Counter
+
+from streetgpt.core import get_current_time_in_berlin
+
+MAX_ERROR_ENTRIES = 20
+MAX_ERROR_MESSAGE_CHARS = 500
+
+# Core callbacks report "<label>: <ExceptionType>: <message>"
+_TYPED_MESSAGE = re.compile(r"^(?:\w+: )?([A-Z]\w*): (.*)$", re.DOTALL)
+
+_counts: Counter = Counter()
+_counts_lock = threading.Lock()
+
+
+def error_entry(stage: str, message: str, error_type: str = "") -> dict:
+    """Build one error document and count it."""
+    message = str(message or "")
+    if not error_type:
+        match = _TYPED_MESSAGE.match(message)
+        if match:
+            error_type, message = match.groups()
+    with _counts_lock:
+        _counts[(stage, error_type)] += 1
+    return {
+        "ts": get_current_time_in_berlin(),
+        "stage": stage,
+        "type": error_type,
+        "message": message[:MAX_ERROR_MESSAGE_CHARS],
+    }
+
+
+def error_counts() -> list[dict]:
+    """Errors seen by this process since start, most frequent first."""
+    with _counts_lock:
+        counts = _counts.most_common()
+    return [{"stage": stage, "type": error_type, "count": count} for (stage, error_type), count in counts]
+
+
+def push_errors(entries) -> dict:
+    """``$push`` spec that appends entries and keeps only the newest MAX_ERROR_ENTRIES."""
+    if not entries:
+        return {}
+    return {"errors": {"$each": list(entries), "$slice": -MAX_ERROR_ENTRIES}}
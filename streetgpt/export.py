@@ -0,0 +1,296 @@
+"""Stream conversations out of Mongo into Parquet or Arrow files.
+
+Documents are read with a projection and a batched cursor. Each batch is
+coerced to one fixed schema and written as its own row group, so an export uses
+bounded memory no matter how many sessions it covers.
+
+Run with:
+    python -m streetgpt.export --study-id 65f... --since 2025-03-01 -o conversations.parquet
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from pymongo import ASCENDING, MongoClient
+
+from streetgpt.core import get_secret, parse_int_param
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+MESSAGE_TYPE = pa.struct([
+    ("role", pa.string()),
+    ("content", pa.string()),
+    ("ts", pa.string()),
+    ("turn_type", pa.string()),
+    ("model", pa.string()),
+    ("reasoning_effort", pa.string()),
+])
+
+ERROR_TYPE = pa.struct([
+    ("ts", pa.string()),
+    ("stage", pa.string()),
+    ("type", pa.string()),
+    ("message", pa.string()),
+])
+
+# One column per exported field; every export has exactly these columns in this order.
+CONVERSATION_SCHEMA = pa.schema([
+    ("session_id", pa.string()),
+    ("app", pa.string()),
+    ("status", pa.string()),
+    ("created_at", pa.string()),
+    ("updated_at", pa.string()),
+    ("completed_at", pa.string()),
+    ("abandoned_at", pa.string()),
+    ("prolific_pid", pa.string()),
+    ("study_id", pa.string()),
+    ("prolific_session_id", pa.string()),
+    ("language", pa.string()),
+    ("survey_claim", pa.string()),
+    ("survey_claim_id", pa.string()),
+    ("survey_claim_canonical", pa.string()),
+    ("survey_claim_initial_credence", pa.int64()),
+    ("control_flag", pa.bool_()),
+    ("control_claim", pa.string()),
+    ("control_claim_id", pa.string()),
+    ("control_claim_canonical", pa.string()),
+    ("discussion_claim_seed", pa.string()),
+    ("discussion_claim_seed_id", pa.string()),
+    ("discussion_claim_seed_canonical", pa.string()),
+    ("discussion_claim", pa.string()),
+    ("discussion_claim_initial_credence", pa.int64()),
+    ("discussion_claim_final_credence", pa.int64()),
+    ("input_active", pa.int64()),
+    ("prompt_tokens", pa.int64()),
+    ("completion_tokens", pa.int64()),
+    ("last_model", pa.string()),
+    ("return_url", pa.string()),
+    ("error_messages", pa.string()),
+    ("errors", pa.list_(ERROR_TYPE)),
+    ("message_count", pa.int64()),
+    ("messages", pa.list_(MESSAGE_TYPE)),
+])
+
+EXPORT_PROJECTION = {
+    "_id": 0,
+    **{name: 1 for name in CONVERSATION_SCHEMA.names if name not in {"message_count", "messages"}},
+    "messages.role": 1,
+    "messages.content": 1,
+    "messages.ts": 1,
+    "messages.turn_type": 1,
+    "messages.model": 1,
+    "messages.reasoning_effort": 1,
+}
+
+
+def build_export_filter(app: str = "", study_id: str = "", since: str = "", until: str = "") -> dict:
+    # created_at is stored as "YYYY-MM-DD HH:MM:SS TZ", so date prefixes compare correctly as strings.
+    query = {}
+    if app:
+        query["app"] = app
+    if study_id:
+        query["study_id"] = study_id
+    created_at = {}
+    if since:
+        created_at["$gte"] = since
+    if until:
+        created_at["$lt"] = until
+    if created_at:
+        query["created_at"] = created_at
+    return query
+
+
+def _text(value) -> str | None:
+    # Claims are stored as 0 when absent
+    if value in (None, 0, "0"):
+        return None
+    return str(value)
+
+
+def _int(value) -> int | None:
+    if value is None or value == "":
+        return None
+    return parse_int_param(value, None)
+
+
+def conversation_row(doc: dict, include_messages: bool = True) -> dict:
+    messages = doc.get("messages") or []
+    errors = doc.get("errors") or []
+    return {
+        "session_id": str(doc.get("session_id", "")),
+        "app": _text(doc.get("app")),
+        "status": _text(doc.get("status")),
+        "created_at": _text(doc.get("created_at")),
+        "updated_at": _text(doc.get("updated_at")),
+        "completed_at": _text(doc.get("completed_at")),
+        "abandoned_at": _text(doc.get("abandoned_at")),
+        "prolific_pid": _text(doc.get("prolific_pid")),
+        "study_id": _text(doc.get("study_id")),
+        "prolific_session_id": _text(doc.get("prolific_session_id")),
+        "language": _text(doc.get("language")),
+        "survey_claim": _text(doc.get("survey_claim")),
+        "survey_claim_id": _text(doc.get("survey_claim_id")),
+        "survey_claim_canonical": _text(doc.get("survey_claim_canonical")),
+        "survey_claim_initial_credence": _int(doc.get("survey_claim_initial_credence")),
+        "control_flag": bool(doc.get("control_flag", False)),
+        "control_claim": _text(doc.get("control_claim")),
+        "control_claim_id": _text(doc.get("control_claim_id")),
+        "control_claim_canonical": _text(doc.get("control_claim_canonical")),
+        "discussion_claim_seed": _text(doc.get("discussion_claim_seed")),
+        "discussion_claim_seed_id": _text(doc.get("discussion_claim_seed_id")),
+        "discussion_claim_seed_canonical": _text(doc.get("discussion_claim_seed_canonical")),
+        "discussion_claim": _text(doc.get("discussion_claim")),
+        "discussion_claim_initial_credence": _int(doc.get("discussion_claim_initial_credence")),
+        "discussion_claim_final_credence": _int(doc.get("discussion_claim_final_credence")),
+        "input_active": _int(doc.get("input_active")),
+        "prompt_tokens": _int(doc.get("prompt_tokens")),
+        "completion_tokens": _int(doc.get("completion_tokens")),
+        "last_model": _text(doc.get("last_model")),
+        "return_url": _text(doc.get("return_url")),
+        # Conversations stored before structured errors only have the error_messages string
+        "error_messages": _text(doc.get("error_messages")) or "".join(
+            f"{e.get('stage', '')}: {e.get('type', '')}: {e.get('message', '')}\n" for e in errors
+        ),
+        "errors": [
+            {
+                "ts": _text(e.get("ts")),
+                "stage": _text(e.get("stage")),
+                "type": _text(e.get("type")),
+                "message": _text(e.get("message")),
+            }
+            for e in errors
+        ],
+        "message_count": len(messages),
+        "messages": [
+            {
+                "role": m.get("role", ""),
+                "content": m.get("content", ""),
+                "ts": _text(m.get("ts")),
+                "turn_type": _text(m.get("turn_type")),
+                "model": _text(m.get("model")),
+                "reasoning_effort": _text(m.get("reasoning_effort")),
+            }
+            for m in messages
+        ] if include_messages else None,
+    }
+
+
+def rows_to_batch(rows: list[dict]) -> pa.RecordBatch:
+    return pa.RecordBatch.from_pylist(rows, schema=CONVERSATION_SCHEMA)
+
+
+def iter_conversation_batches(
+    collection,
+    query: dict,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    include_messages: bool = True,
+):
+    """Yield RecordBatches of at most batch_size conversations matching query."""
+    projection = dict(EXPORT_PROJECTION)
+    if not include_messages:
+        projection = {key: value for key, value in projection.items() if not key.startswith("messages")}
+        # message_count still needs the array length
+        projection["messages.role"] = 1
+    cursor = collection.find(query, projection, batch_size=batch_size).sort("created_at", ASCENDING)
+    rows = []
+    for doc in cursor:
+        rows.append(conversation_row(doc, include_messages))
+        if len(rows) >= batch_size:
+            yield rows_to_batch(rows)
+            rows = []
+    if rows:
+        yield rows_to_batch(rows)
+
+
+def iter_conversations_by_id(
+    collection,
+    session_ids,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    include_messages: bool = True,
+):
+    """Yield RecordBatches for the given session ids, one $in query on the unique index per chunk."""
+    session_ids = list(dict.fromkeys(str(session_id) for session_id in session_ids if session_id))
+    for start in range(0, len(session_ids), batch_size):
+        chunk = session_ids[start:start + batch_size]
+        yield from iter_conversation_batches(collection, {"session_id": {"$in": chunk}}, batch_size, include_messages)
+
+
+def conversation_ids(collection, query: dict) -> list[str]:
+    return [doc["session_id"] for doc in collection.find(query, {"_id": 0, "session_id": 1}) if doc.get("session_id")]
+
+
+def write_batches(batches, path: Path, output_format: str = "parquet") -> int:
+    written = 0
+    if output_format == "parquet":
+        with pq.ParquetWriter(path, CONVERSATION_SCHEMA, compression="zstd") as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                written += batch.num_rows
+    elif output_format == "arrow":
+        with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, CONVERSATION_SCHEMA) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                written += batch.num_rows
+    else:
+        raise ValueError(f"Unsupported export format {output_format!r}")
+    return written
+
+
+def export_conversations(
+    collection,
+    path: Path,
+    query: dict,
+    output_format: str = "parquet",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    include_messages: bool = True,
+) -> int:
+    batches = iter_conversation_batches(collection, query, batch_size, include_messages)
+    return write_batches(batches, path, output_format)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export conversations from Mongo to Parquet or Arrow.")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="Output file path.")
+    parser.add_argument("--format", choices=["parquet", "arrow"], help="Output format (default: from the file suffix).")
+    parser.add_argument("--app", default="", help="Only export conversations of this APP_NAME.")
+    parser.add_argument("--study-id", default="", help="Only export conversations of this Prolific study.")
+    parser.add_argument("--since", default="", help="Earliest created_at to include, e.g. 2025-03-01.")
+    parser.add_argument("--until", default="", help="Exclusive upper bound on created_at, e.g. 2025-04-01.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Documents per cursor batch and row group.")
+    parser.add_argument("--no-messages", action="store_true", help="Leave out the message transcripts.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="[export] %(message)s")
+
+    output_format = args.format or ("arrow" if args.output.suffix in {".arrow", ".feather"} else "parquet")
+    query = build_export_filter(args.app, args.study_id, args.since, args.until)
+    mongo_client = MongoClient(get_secret("MONGO_URI"))
+    collection = mongo_client[get_secret("MONGO_DB_NAME", "streetgpt")]["conversations"]
+    try:
+        written = export_conversations(
+            collection,
+            args.output,
+            query,
+            output_format=output_format,
+            batch_size=args.batch_size,
+            include_messages=not args.no_messages,
+        )
+    finally:
+        mongo_client.close()
+    logger.info("Wrote %d conversations to %s", written, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
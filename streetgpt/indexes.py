@@ -0,0 +1,93 @@
+"""Check that every supported query on conversations is answered from an index.
+
+Each entry in QUERY_SHAPES is a query the app, the admin views or the analysis
+tools issue. ``check_query_shapes`` runs ``explain()`` on each against a real
+collection and reports any whose winning plan contains a COLLSCAN. Run it against
+a scratch database after changing CONVERSATION_INDEXES or adding a query:
+
+    python -m streetgpt.indexes            # uses MONGO_URI / MONGO_DB_NAME
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from pymongo import ASCENDING, MongoClient
+
+from streetgpt.analytics import study_match
+from streetgpt.core import CONVERSATION_STATE_PROJECTION, ensure_conversation_indexes, get_secret
+
+logger = logging.getLogger(__name__)
+
+# name -> (filter, sort)
+QUERY_SHAPES = {
+    "load_conversation_state": ({"session_id": "s"}, None),
+    "mark_abandoned": ({"session_id": "s", "input_active": 1}, None),
+    "study_summary": (study_match("streetgpt", "study", "2025-01-01"), None),
+    "study_summary_all_studies": (study_match("streetgpt"), None),
+    "export_by_study": (
+        {"app": "streetgpt", "study_id": "study", "created_at": {"$gte": "2025-01-01", "$lt": "2025-02-01"}},
+        [("created_at", ASCENDING)],
+    ),
+    "export_by_time": ({"created_at": {"$gte": "2025-01-01"}}, [("created_at", ASCENDING)]),
+    "merge_by_response_ids": ({"session_id": {"$in": ["a", "b"]}}, None),
+    "returning_participant": ({"prolific_pid": "p", "study_id": "study"}, None),
+    "participant_history": ({"prolific_pid": "p"}, None),
+    "claim_history": ({"survey_claim_id": "c", "created_at": {"$gte": "2025-01-01"}}, None),
+    "extractor_fallbacks": (
+        {"chat_outcome.extractor_status": "fallback", "created_at": {"$gte": "2025-01-01"}},
+        None,
+    ),
+}
+
+
+def plan_stages(plan: dict):
+    yield plan.get("stage", "")
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        yield from plan_stages(child)
+
+
+def winning_plan(explain: dict) -> dict:
+    planner = explain.get("queryPlanner", {})
+    plan = planner.get("winningPlan", {})
+    # Slot-based engine wraps the classic tree in queryPlan
+    return plan.get("queryPlan", plan)
+
+
+def check_query_shapes(collection) -> dict[str, list[str]]:
+    """Return the plan stages of every query shape that still scans the collection."""
+    failures = {}
+    for name, (query, sort) in QUERY_SHAPES.items():
+        cursor = collection.find(query, CONVERSATION_STATE_PROJECTION)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = list(plan_stages(winning_plan(cursor.explain())))
+        if "COLLSCAN" in stages:
+            failures[name] = stages
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Explain every supported conversations query and flag collection scans.")
+    parser.add_argument("--no-create", action="store_true", help="Do not create missing indexes before checking.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[indexes] %(message)s")
+
+    mongo_client = MongoClient(get_secret("MONGO_URI"))
+    collection = mongo_client[get_secret("MONGO_DB_NAME", "streetgpt")]["conversations"]
+    try:
+        if not args.no_create:
+            ensure_conversation_indexes(collection)
+        failures = check_query_shapes(collection)
+    finally:
+        mongo_client.close()
+
+    for name, stages in failures.items():
+        logger.error("%s scans the collection: %s", name, " <- ".join(stages))
+    logger.info("%d of %d query shapes use an index", len(QUERY_SHAPES) - len(failures), len(QUERY_SHAPES))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
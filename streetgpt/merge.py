@@ -0,0 +1,292 @@
+"""Merge Qualtrics responses with exported conversations and clean the result.
+
+One config file per study replaces the per-pilot ``Data_Merging_and_Cleaning_Script.py``
+copies. It names the join keys, the columns that determine the condition, the
+Likert label maps and the dedup policy. Every step is a column-wise pandas or
+numpy operation, so full-size samples merge without per-row Python calls.
+
+Conversations come from an exported file or, with ``conversations.source: mongo``
+(or ``--mongo``), straight from the ``conversations`` collection: the Qualtrics
+ResponseId is passed to the chatbot as ``id`` and stored as ``session_id``, so
+the matching documents are fetched in ``$in`` batches on the unique index.
+
+Run with:
+    python -m streetgpt.merge config/merge/pilot3.yaml
+    python -m streetgpt.merge config/merge/election_2025.yaml --qualtrics export.csv -o merged.parquet
+    python -m streetgpt.merge config/merge/election_2025.yaml --mongo --unmatched-report unmatched.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import yaml
+from pymongo import MongoClient
+
+from streetgpt.core import get_secret
+from streetgpt.export import CONVERSATION_SCHEMA, build_export_filter, conversation_ids, iter_conversations_by_id
+
+logger = logging.getLogger(__name__)
+
+DEDUP_POLICIES = {"most_complete", "first", "last", "none"}
+
+
+def load_merge_config(path: Path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    for section in ("qualtrics", "conversations"):
+        if not (config.get(section) or {}).get("key"):
+            raise ValueError(f"{path}: '{section}.key' is required")
+    dedup = (config.get("dedup") or {}).get("policy", "most_complete")
+    if dedup not in DEDUP_POLICIES:
+        raise ValueError(f"{path}: unknown dedup policy {dedup!r}")
+    return config
+
+
+### Reading and writing ##
+
+def read_table(path: Path, skip_rows=None) -> pd.DataFrame:
+    # skip_rows drops the extra header rows of Qualtrics exports (question text, import ids)
+    suffix = path.suffix.lower()
+    if suffix in {".xlsx", ".xls"}:
+        return pd.read_excel(path, skiprows=skip_rows)
+    if suffix == ".csv":
+        return pd.read_csv(path, skiprows=skip_rows, low_memory=False)
+    if suffix == ".parquet":
+        return pd.read_parquet(path)
+    if suffix in {".arrow", ".feather"}:
+        return pd.read_feather(path)
+    raise ValueError(f"Unsupported input file {path}")
+
+
+def write_table(df: pd.DataFrame, path: Path):
+    suffix = path.suffix.lower()
+    if suffix in {".xlsx", ".xls"}:
+        df.to_excel(path, index=False)
+    elif suffix == ".csv":
+        df.to_csv(path, index=False)
+    elif suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unsupported output file {path}")
+
+
+def read_qualtrics(paths: list[Path], key: str, skip_rows=None) -> pd.DataFrame:
+    """Stack one or more Qualtrics exports, combining rows that share a response id."""
+    frames = [read_table(path, skip_rows) for path in paths]
+    df = pd.concat(frames, ignore_index=True, sort=False) if len(frames) > 1 else frames[0]
+    if len(frames) > 1 and df[key].duplicated().any():
+        # First non-null value per column, like combine_first across the files
+        df = df.groupby(key, sort=False, dropna=False, as_index=False).first()
+    return df
+
+
+def fetch_conversations(collection, session_ids, batch_size: int = 1000, include_messages: bool = False) -> pd.DataFrame:
+    """Bulk-fetch the conversations for the given Qualtrics response ids."""
+    batches = iter_conversations_by_id(collection, session_ids, batch_size, include_messages)
+    return pa.Table.from_batches(list(batches), schema=CONVERSATION_SCHEMA).to_pandas()
+
+
+def unmatched_keys(left_ids: pd.Series, right_ids) -> pd.Series:
+    left_ids = left_ids.dropna().astype(str)
+    return left_ids[~left_ids.isin(pd.Series(right_ids, dtype=object).dropna().astype(str))].drop_duplicates()
+
+
+def unmatched_report(qualtrics_only: pd.Series, conversations_only: pd.Series) -> pd.DataFrame:
+    return pd.concat([
+        pd.DataFrame({"side": "qualtrics", "key": qualtrics_only.to_numpy()}),
+        pd.DataFrame({"side": "conversations", "key": conversations_only.to_numpy()}),
+    ], ignore_index=True)
+
+
+### Cleaning steps ##
+
+def select_columns(df: pd.DataFrame, selector) -> list[str]:
+    """Resolve a column selector: a name, a list of names, or a dict of names/prefix/suffix/contains."""
+    if isinstance(selector, str):
+        selector = {"names": [selector]}
+    elif isinstance(selector, list):
+        selector = {"names": selector}
+    columns = pd.Index(df.columns.astype(str))
+    mask = columns.isin(selector.get("names") or [])
+    if selector.get("prefix"):
+        mask |= columns.str.startswith(selector["prefix"])
+    if selector.get("suffix"):
+        mask |= columns.str.endswith(selector["suffix"])
+    if selector.get("contains"):
+        mask |= columns.str.contains(selector["contains"], regex=False)
+    return list(df.columns[mask])
+
+
+def drop_rows(df: pd.DataFrame, rules: list[dict]) -> pd.DataFrame:
+    keep = np.ones(len(df), dtype=bool)
+    for rule in rules or []:
+        column = rule["column"]
+        if column not in df:
+            continue
+        if "equals" in rule:
+            keep &= (df[column] != rule["equals"]).to_numpy()
+        if "in" in rule:
+            keep &= ~df[column].isin(rule["in"]).to_numpy()
+        if rule.get("missing"):
+            keep &= df[column].notna().to_numpy()
+    return df[keep]
+
+
+def assign_condition(df: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    """Label each row with the first matching rule: a non-empty column, or a column value in a list."""
+    conditions = []
+    choices = []
+    for rule in spec.get("rules") or []:
+        source = rule["column"]
+        if source not in df:
+            conditions.append(np.zeros(len(df), dtype=bool))
+        elif "in" in rule:
+            # Compare as lower-case text so 1, "1" and True/"true" all match
+            values = [str(v).lower() for v in rule["in"]]
+            conditions.append(df[source].astype(str).str.lower().isin(values).to_numpy())
+        else:
+            conditions.append(df[source].notna().to_numpy())
+        choices.append(rule["value"])
+    column = spec.get("column", "Condition")
+    default = spec.get("default", "unclear")
+    df = df.assign(**{column: np.select(conditions, choices, default=default) if conditions else default})
+    if spec.get("drop"):
+        df = df[~df[column].isin(spec["drop"])]
+    return df
+
+
+def recode_likert(df: pd.DataFrame, scales: list[dict]) -> pd.DataFrame:
+    """Map labelled scale points to numbers and coerce the remaining entries to numeric."""
+    df = df.copy()
+    for scale in scales or []:
+        columns = select_columns(df, scale["columns"])
+        if not columns:
+            logger.warning("Likert scale %s matched no columns", scale.get("name", scale["columns"]))
+            continue
+        df[columns] = df[columns].replace(scale.get("labels") or {}).apply(pd.to_numeric, errors="coerce")
+    return df
+
+
+def deduplicate(df: pd.DataFrame, key: str, policy: str = "most_complete") -> pd.DataFrame:
+    if policy == "none":
+        return df
+    if policy == "most_complete":
+        # Keep the row with the most filled-in answers for each response id
+        filled = df.notna().sum(axis=1).to_numpy()
+        order = np.lexsort((-filled, df[key].astype(str).to_numpy()))
+        return df.iloc[order].drop_duplicates(subset=key, keep="first").sort_index()
+    return df.drop_duplicates(subset=key, keep=policy)
+
+
+### Pipeline ##
+
+def merge_frames(qualtrics: pd.DataFrame, conversations: pd.DataFrame, config: dict) -> pd.DataFrame:
+    q_key = config["qualtrics"]["key"]
+    c_key = config["conversations"]["key"]
+    merged = qualtrics.merge(
+        conversations,
+        left_on=q_key,
+        right_on=c_key,
+        how=config["conversations"].get("how", "left"),
+        suffixes=("", "_chat"),
+    )
+    merged = merged.rename(columns=config.get("rename") or {})
+    merged = drop_rows(merged, config.get("drop_rows"))
+    if config.get("require_columns"):
+        merged = merged.dropna(subset=[c for c in config["require_columns"] if c in merged])
+    if config.get("condition"):
+        merged = assign_condition(merged, config["condition"])
+    merged = recode_likert(merged, config.get("likert"))
+    dedup = config.get("dedup") or {}
+    return deduplicate(merged, dedup.get("key", q_key), dedup.get("policy", "most_complete"))
+
+
+def read_conversations_from_mongo(config: dict, response_ids: pd.Series) -> tuple[pd.DataFrame, pd.Series]:
+    """Fetch the conversations matching response_ids and list study conversations missing from Qualtrics."""
+    spec = config["conversations"]
+    mongo_client = MongoClient(get_secret("MONGO_URI"))
+    collection = mongo_client[get_secret("MONGO_DB_NAME", "streetgpt")]["conversations"]
+    try:
+        conversations = fetch_conversations(
+            collection,
+            response_ids.dropna().astype(str),
+            batch_size=spec.get("batch_size", 1000),
+            include_messages=spec.get("include_messages", False),
+        )
+        # Only a study/app/date filter bounds "all conversations" for the other side of the report
+        study_filter = build_export_filter(
+            spec.get("app", ""), spec.get("study_id", ""), spec.get("since", ""), spec.get("until", "")
+        )
+        conversations_only = pd.Series(dtype=object)
+        if study_filter:
+            conversations_only = unmatched_keys(pd.Series(conversation_ids(collection, study_filter)), response_ids)
+    finally:
+        mongo_client.close()
+    return conversations, conversations_only
+
+
+def run_merge(
+    config: dict,
+    qualtrics_paths: list[Path],
+    conversations_path: Path | None,
+    from_mongo: bool = False,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    q_key = config["qualtrics"]["key"]
+    c_key = config["conversations"]["key"]
+    qualtrics = read_qualtrics(qualtrics_paths, q_key, skip_rows=config["qualtrics"].get("skip_rows"))
+
+    if from_mongo:
+        conversations, conversations_only = read_conversations_from_mongo(config, qualtrics[q_key])
+    else:
+        conversations = read_table(conversations_path, config["conversations"].get("skip_rows"))
+        conversations_only = unmatched_keys(conversations[c_key], qualtrics[q_key])
+    qualtrics_only = unmatched_keys(qualtrics[q_key], conversations[c_key])
+    logger.info(
+        "%d Qualtrics responses without a conversation, %d conversations without a Qualtrics response",
+        len(qualtrics_only),
+        len(conversations_only),
+    )
+    return merge_frames(qualtrics, conversations, config), unmatched_report(qualtrics_only, conversations_only)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Merge Qualtrics responses with StreetGPT conversations.")
+    parser.add_argument("config", type=Path, help="Merge config YAML, e.g. config/merge/pilot3.yaml.")
+    parser.add_argument("--qualtrics", type=Path, nargs="+", help="Qualtrics export(s); overrides qualtrics.files.")
+    parser.add_argument("--conversations", type=Path, help="Conversation export; overrides conversations.file.")
+    parser.add_argument("--mongo", action="store_true", help="Fetch conversations from MONGO_URI instead of a file.")
+    parser.add_argument("--unmatched-report", type=Path, help="Write unmatched keys from both sides to this CSV.")
+    parser.add_argument("-o", "--output", type=Path, help="Output .parquet, .xlsx or .csv; overrides output.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="[merge] %(message)s")
+    config = load_merge_config(args.config)
+
+    # Files named in the config live in data_dir, relative to the config file; CLI paths are relative to cwd
+    data_dir = args.config.parent / config.get("data_dir", ".")
+    qualtrics_paths = args.qualtrics or [data_dir / p for p in config["qualtrics"].get("files") or []]
+    from_mongo = args.mongo or config["conversations"].get("source") == "mongo"
+    conversations_path = args.conversations or data_dir / config["conversations"].get("file", "")
+    output = args.output or data_dir / config.get("output", "merged.parquet")
+    if not qualtrics_paths:
+        raise SystemExit("No Qualtrics export given (qualtrics.files or --qualtrics)")
+
+    merged, unmatched = run_merge(config, qualtrics_paths, conversations_path, from_mongo=from_mongo)
+    write_table(merged, output)
+    if args.unmatched_report:
+        unmatched.to_csv(args.unmatched_report, index=False)
+    logger.info("Wrote %d rows to %s", len(merged), output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
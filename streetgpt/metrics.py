@@ -0,0 +1,147 @@
+"""In-process performance metrics for the admin dashboard.
+
+Counters and latency samples are kept for the last WINDOW_S seconds in memory;
+nothing is persisted. Each worker process has its own view, which is what the
+admin page of that process shows.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from collections import defaultdict, deque
+
+WINDOW_S = 15 * 60
+ACTIVE_SESSION_WINDOW_S = 5 * 60
+MAX_SAMPLES = 20000
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    """Thread-safe sliding-window counters, latency samples and in-flight gauges."""
+
+    def __init__(self, window_s: float = WINDOW_S):
+        self.window_s = window_s
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._events: dict[str, deque] = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self._samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self._inflight: dict[str, int] = defaultdict(int)
+        self._peak_inflight: dict[str, int] = defaultdict(int)
+        self._gauges: dict[str, float] = {}
+        self._sessions: dict[str, float] = {}
+
+    def count(self, name: str):
+        with self._lock:
+            self._events[name].append(time.time())
+
+    def observe(self, name: str, value_ms: float):
+        with self._lock:
+            self._samples[name].append((time.time(), value_ms))
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000)
+
+    @contextlib.contextmanager
+    def inflight(self, name: str):
+        with self._lock:
+            self._inflight[name] += 1
+            self._peak_inflight[name] = max(self._peak_inflight[name], self._inflight[name])
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight[name] -= 1
+
+    def touch_session(self, session_id: str):
+        if not session_id:
+            return
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = now
+            # Prune on write so the table stays bounded by recent sessions
+            if len(self._sessions) > MAX_SAMPLES:
+                cutoff = now - self.window_s
+                self._sessions = {key: seen for key, seen in self._sessions.items() if seen >= cutoff}
+
+    def events(self, name: str) -> int:
+        cutoff = time.time() - self.window_s
+        with self._lock:
+            return sum(1 for ts in self._events.get(name, ()) if ts >= cutoff)
+
+    def latency(self, name: str, window_s: float | None = None) -> dict:
+        cutoff = time.time() - (window_s or self.window_s)
+        with self._lock:
+            values = [value for ts, value in self._samples.get(name, ()) if ts >= cutoff]
+        return {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.5),
+            "p90_ms": percentile(values, 0.9),
+            "p99_ms": percentile(values, 0.99),
+            "max_ms": max(values, default=None),
+        }
+
+    def current_inflight(self, name: str) -> int:
+        with self._lock:
+            return self._inflight.get(name, 0)
+
+    def active_sessions(self, window_s: float = ACTIVE_SESSION_WINDOW_S) -> int:
+        cutoff = time.time() - window_s
+        with self._lock:
+            return sum(1 for seen in self._sessions.values() if seen >= cutoff)
+
+    def snapshot(self) -> dict:
+        attempts = self.events("openai_attempt")
+        requests = self.events("openai_request")
+        # Every attempt beyond the first of a request is a retry
+        retries = max(0, attempts - requests)
+        with self._lock:
+            inflight = dict(self._inflight)
+            peak_inflight = dict(self._peak_inflight)
+            gauges = dict(self._gauges)
+        return {
+            "window_s": self.window_s,
+            "uptime_s": int(time.time() - self.started_at),
+            "inflight": inflight,
+            "peak_inflight": peak_inflight,
+            "gauges": gauges,
+            "active_sessions": self.active_sessions(),
+            "turns": self.events("turn"),
+            "openai_requests": requests,
+            "openai_attempts": attempts,
+            "openai_retries": retries,
+            "openai_fallbacks": self.events("openai_fallback"),
+            "openai_errors": self.events("openai_error"),
+            "retry_rate": retries / requests if requests else None,
+            "fallback_rate": self.events("openai_fallback") / attempts if attempts else None,
+            "admission": {
+                "admitted": self.events("admission_admitted"),
+                "queued": self.events("admission_queued"),
+                "screened_out": self.events("admission_screened_out"),
+            },
+            "latency": {
+                name: self.latency(name)
+                for name in (
+                    "openai_first_delta_ms", "openai_stream_ms", "extraction_ms", "mongo_write_ms", "turn_ms", "admission_wait_ms"
+                )
+            },
+        }
+
+
+METRICS = Metrics()
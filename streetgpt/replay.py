@@ -0,0 +1,349 @@
+"""Replay stored conversations against candidate system messages.
+
+Each stored transcript's user turns are sent again, in order, under a system
+message rendered from a candidate ``system_messages.yaml``; the candidate's own
+replies become the history for the next turn. A replay stops when the candidate
+gives the handoff message, and then the outcome extractor runs on the new
+transcript. Conversations are replayed concurrently up to ``--concurrency``.
+
+Several ``--variant NAME=PATH`` options are compared side by side on the same
+transcripts: user turns, tokens, per-turn latency, how often the handoff is
+reached and how often the extracted credences match the stored outcome.
+
+``--mock`` swaps the OpenAI API for a deterministic model that answers each turn
+with the stored assistant reply, so CI can check the pipeline without a key:
+
+    python -m streetgpt.replay --study-id 65f... --limit 50 --variant candidate=config/next.yaml
+    python -m streetgpt.replay --input conversations.parquet --mock --json-out replay.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import yaml
+from pymongo import ASCENDING, MongoClient
+
+from streetgpt.claims import prompt_claims
+from streetgpt.core import (
+    abuild_chat_outcome,
+    aiter_response_deltas,
+    get_secret,
+    get_system_message,
+    load_system_messages,
+    make_async_openai_client,
+    normalize_chat_outcome,
+    num_tokens_from_prompt,
+    should_end_chat,
+)
+from streetgpt.export import build_export_filter
+from streetgpt.metrics import percentile
+from streetgpt.routing import make_model_router
+
+logger = logging.getLogger(__name__)
+
+REPLAY_PROJECTION = {
+    "_id": 0,
+    "session_id": 1,
+    "language": 1,
+    "survey_claim": 1,
+    "survey_claim_initial_credence": 1,
+    "discussion_claim_seed": 1,
+    "control_flag": 1,
+    "control_claim": 1,
+    "survey_claim_canonical": 1,
+    "discussion_claim_seed_canonical": 1,
+    "control_claim_canonical": 1,
+    "chat_outcome": 1,
+    "input_active": 1,
+    "messages.role": 1,
+    "messages.content": 1,
+}
+OUTCOME_FIELDS = ("discussion_claim_initial_credence", "discussion_claim_final_credence")
+
+
+@dataclass
+class ReplayResult:
+    session_id: str
+    variant: str
+    user_turns: int = 0
+    original_user_turns: int = 0
+    ended: bool = False
+    original_ended: bool = False
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    turn_latencies_s: list[float] = field(default_factory=list)
+    first_delta_latencies_s: list[float] = field(default_factory=list)
+    outcome_agrees: bool | None = None
+    error: str = ""
+
+
+### Models ##
+
+def original_replies(doc: dict) -> list[str]:
+    """The stored assistant reply to each user message, "" where there is none."""
+    replies = []
+    messages = doc.get("messages") or []
+    for index, message in enumerate(messages):
+        if message.get("role") != "user":
+            continue
+        following = messages[index + 1] if index + 1 < len(messages) else {}
+        replies.append(following.get("content", "") if following.get("role") == "assistant" else "")
+    return replies
+
+
+def stored_outcome(doc: dict) -> dict:
+    # Exports flatten chat_outcome into top-level columns
+    return doc.get("chat_outcome") or {name: doc.get(name) for name in OUTCOME_FIELDS}
+
+
+class OpenAIReplayModel:
+    def __init__(self, client, router):
+        self.client = client
+        self.router = router
+
+    def stream(self, doc: dict, user_turn: int, messages: list[dict]):
+        route = self.router.for_turn(user_turn, bool(doc.get("control_flag")))
+        return aiter_response_deltas(self.client, route.model, messages, route.reasoning_effort)
+
+    async def outcome(self, doc: dict, transcript: list[dict]) -> dict:
+        route = self.router.for_extraction(bool(doc.get("control_flag")))
+        return await abuild_chat_outcome(
+            self.client,
+            route.model,
+            transcript,
+            seeded_discussion_claim=doc.get("discussion_claim_seed", ""),
+            survey_claim=doc.get("survey_claim", ""),
+            control_flag=bool(doc.get("control_flag")),
+            control_claim=doc.get("control_claim", ""),
+            reasoning_effort=route.reasoning_effort,
+        )
+
+
+class MockReplayModel:
+    """Answers each turn with the stored assistant reply and returns the stored outcome."""
+
+    def __init__(self, delay_s: float = 0.0):
+        self.delay_s = delay_s
+
+    async def stream(self, doc: dict, user_turn: int, messages: list[dict]):
+        replies = original_replies(doc)
+        reply = replies[user_turn - 1] if user_turn <= len(replies) else ""
+        for word in reply.split(" "):
+            if self.delay_s:
+                await asyncio.sleep(self.delay_s)
+            yield word + " "
+
+    async def outcome(self, doc: dict, transcript: list[dict]) -> dict:
+        return normalize_chat_outcome(stored_outcome(doc), doc.get("discussion_claim_seed", ""))
+
+
+### Replay ##
+
+def render_system_message(system_messages: dict, doc: dict) -> str:
+    return get_system_message(
+        system_messages,
+        **{field: claim or 0 for field, claim in prompt_claims(doc).items()},
+        survey_claim_initial_credence=doc.get("survey_claim_initial_credence") or 0,
+        control_flag=bool(doc.get("control_flag")),
+        language=doc.get("language") or "english",
+    )
+
+
+def outcome_agrees(replayed: dict, stored: dict) -> bool | None:
+    if all(stored.get(name) is None for name in OUTCOME_FIELDS):
+        return None
+    return all(replayed.get(name) == stored.get(name) for name in OUTCOME_FIELDS)
+
+
+async def replay_conversation(model, variant: str, system_messages: dict, doc: dict) -> ReplayResult:
+    user_messages = [m.get("content", "") for m in doc.get("messages") or [] if m.get("role") == "user"]
+    result = ReplayResult(
+        session_id=str(doc.get("session_id", "")),
+        variant=variant,
+        original_user_turns=len(user_messages),
+        original_ended=doc.get("input_active") == 0 or bool(doc.get("chat_outcome")),
+    )
+    history: list[dict] = []
+    system = {"role": "system", "content": render_system_message(system_messages, doc)}
+    try:
+        for user_turn, content in enumerate(user_messages, start=1):
+            prompt = [system, *history, {"role": "user", "content": content}]
+            started = time.perf_counter()
+            reply = ""
+            async for delta in model.stream(doc, user_turn, prompt):
+                if not reply:
+                    result.first_delta_latencies_s.append(time.perf_counter() - started)
+                reply += delta
+            result.turn_latencies_s.append(time.perf_counter() - started)
+            # Count tokens in the reply itself: the mock model streams words, not tokens
+            result.prompt_tokens += num_tokens_from_prompt(prompt)
+            result.completion_tokens += num_tokens_from_prompt([{"role": "assistant", "content": reply}])
+            result.user_turns = user_turn
+            history += [{"role": "user", "content": content}, {"role": "assistant", "content": reply}]
+            if should_end_chat(reply):
+                result.ended = True
+                break
+        if result.ended:
+            result.outcome_agrees = outcome_agrees(await model.outcome(doc, history), stored_outcome(doc))
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def replay_all(model, variants: dict[str, dict], docs: list[dict], concurrency: int) -> list[ReplayResult]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(variant: str, doc: dict) -> ReplayResult:
+        async with semaphore:
+            return await replay_conversation(model, variant, variants[variant], doc)
+
+    return await asyncio.gather(*(bounded(variant, doc) for variant in variants for doc in docs))
+
+
+### Reporting ##
+
+def summarize(results: list[ReplayResult]) -> dict:
+    latencies = [value for r in results for value in r.turn_latencies_s]
+    first_deltas = [value for r in results for value in r.first_delta_latencies_s]
+    agreements = [r.outcome_agrees for r in results if r.outcome_agrees is not None]
+    count = len(results) or 1
+    return {
+        "conversations": len(results),
+        "errors": sum(1 for r in results if r.error),
+        "mean_user_turns": sum(r.user_turns for r in results) / count,
+        "mean_original_user_turns": sum(r.original_user_turns for r in results) / count,
+        "prompt_tokens": sum(r.prompt_tokens for r in results),
+        "completion_tokens": sum(r.completion_tokens for r in results),
+        "turn_latency_p50_s": percentile(latencies, 0.5),
+        "turn_latency_p95_s": percentile(latencies, 0.95),
+        "first_delta_p50_s": percentile(first_deltas, 0.5),
+        "end_rate": sum(r.ended for r in results) / count,
+        "original_end_rate": sum(r.original_ended for r in results) / count,
+        "outcome_agreement": sum(agreements) / len(agreements) if agreements else None,
+    }
+
+
+def format_summary(summaries: dict[str, dict]) -> str:
+    names = list(summaries)
+    rows = list(next(iter(summaries.values())).keys()) if summaries else []
+    width = max(len(row) for row in rows) if rows else 0
+
+    def cell(value) -> str:
+        if value is None:
+            return "-"
+        return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    lines = [" " * width + "".join(f"  {name:>14}" for name in names)]
+    for row in rows:
+        lines.append(row.ljust(width) + "".join(f"  {cell(summaries[name][row]):>14}" for name in names))
+    return "\n".join(lines)
+
+
+### Loading ##
+
+def load_variants(specs: list[str]) -> dict[str, dict]:
+    if not specs:
+        return {"current": load_system_messages(on_error=logger.error)}
+    variants = {}
+    for spec in specs:
+        name, _, path = spec.partition("=")
+        if not path:
+            name, path = Path(spec).stem, spec
+        with open(path, "r", encoding="utf-8") as f:
+            variants[name] = yaml.safe_load(f) or {}
+    return variants
+
+
+def read_transcripts(path: Path) -> list[dict]:
+    if path.suffix in {".arrow", ".feather"}:
+        with pyarrow.ipc.open_file(path) as reader:
+            return reader.read_all().to_pylist()
+    return pq.read_table(path).to_pylist()
+
+
+def fetch_transcripts(collection, query: dict, limit: int = 0) -> list[dict]:
+    cursor = collection.find(query, REPLAY_PROJECTION).sort("created_at", ASCENDING)
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay stored conversations against candidate system messages.")
+    parser.add_argument(
+        "--variant",
+        action="append",
+        default=[],
+        metavar="NAME=PATH",
+        help="System-messages YAML to replay; repeat to compare. Default: the deployed file.",
+    )
+    parser.add_argument("--input", type=Path, help="Read transcripts from a streetgpt.export file instead of Mongo.")
+    parser.add_argument("--app", default="", help="Only replay conversations of this APP_NAME.")
+    parser.add_argument("--study-id", default="", help="Only replay conversations of this Prolific study.")
+    parser.add_argument("--since", default="", help="Earliest created_at to include, e.g. 2025-03-01.")
+    parser.add_argument("--until", default="", help="Exclusive upper bound on created_at.")
+    parser.add_argument("--session-id", action="append", default=[], help="Replay only this session; repeatable.")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many conversations.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversations replayed at the same time.")
+    parser.add_argument("--mock", action="store_true", help="Use the deterministic mock model instead of OpenAI.")
+    parser.add_argument("--mock-delay", type=float, default=0.0, help="Seconds the mock model waits per word.")
+    parser.add_argument("--json-out", type=Path, help="Write per-conversation results and summaries as JSON.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="[replay] %(message)s")
+
+    variants = load_variants(args.variant)
+    if args.input:
+        docs = read_transcripts(args.input)
+        if args.session_id:
+            docs = [doc for doc in docs if doc.get("session_id") in set(args.session_id)]
+        docs = docs[:args.limit] if args.limit else docs
+    else:
+        query = build_export_filter(args.app, args.study_id, args.since, args.until)
+        if args.session_id:
+            query["session_id"] = {"$in": args.session_id}
+        mongo_client = MongoClient(get_secret("MONGO_URI"))
+        try:
+            docs = fetch_transcripts(mongo_client[get_secret("MONGO_DB_NAME", "streetgpt")]["conversations"], query, args.limit)
+        finally:
+            mongo_client.close()
+    docs = [doc for doc in docs if any(m.get("role") == "user" for m in doc.get("messages") or [])]
+    logger.info("Replaying %d conversations against %d variant(s)", len(docs), len(variants))
+
+    async def run() -> list[ReplayResult]:
+        if args.mock:
+            return await replay_all(MockReplayModel(args.mock_delay), variants, docs, args.concurrency)
+        client = make_async_openai_client()
+        try:
+            return await replay_all(OpenAIReplayModel(client, make_model_router(logger.error)), variants, docs, args.concurrency)
+        finally:
+            await client.close()
+
+    results = asyncio.run(run())
+    summaries = {name: summarize([r for r in results if r.variant == name]) for name in variants}
+    print(format_summary(summaries))
+    for result in results:
+        if result.error:
+            logger.warning("%s (%s): %s", result.session_id, result.variant, result.error)
+    if args.json_out:
+        args.json_out.write_text(
+            json.dumps({"summaries": summaries, "results": [asdict(r) for r in results]}, indent=2),
+            encoding="utf-8",
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+"""Per-turn model and reasoning-effort routing.
+
+config/model_routing.yaml decides which model answers each kind of turn and
+how hard it reasons, optionally per condition. Chat turns are classified by the
+number of the participant's message: the reply to the opening message, the
+claim-clarification turns, the deep-questioning middle and the farewell stretch.
+Outcome extraction is routed separately. Every assistant message is stored with
+its turn type, model and effort so routing changes can be analysed later.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+
+from streetgpt.core import ErrorCallback, get_secret
+
+TURN_TYPES = ("opening_consent", "claim_clarification", "deep_questioning", "farewell", "extraction")
+
+DEFAULT_TURN_BOUNDS = {
+    "opening_consent_turns": 1,
+    "claim_clarification_turns": 4,
+    "farewell_from_turn": 14,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Route:
+    turn_type: str
+    model: str
+    reasoning_effort: str | None
+
+    def as_log(self) -> dict:
+        return {"turn_type": self.turn_type, "model": self.model, "reasoning_effort": self.reasoning_effort}
+
+
+class ModelRouter:
+    def __init__(self, config: dict, default_model: str):
+        config = config or {}
+        self.bounds = {**DEFAULT_TURN_BOUNDS, **(config.get("turn_types") or {})}
+        default = config.get("default") or {}
+        self.default = {
+            "model": default.get("model") or default_model,
+            "reasoning_effort": default.get("reasoning_effort", "low"),
+        }
+        self.routes = config.get("routes") or {}
+        self.conditions = config.get("conditions") or {}
+
+    def classify(self, user_turn: int) -> str:
+        """Turn type for the participant's user_turn-th message (1-based)."""
+        if user_turn <= self.bounds["opening_consent_turns"]:
+            return "opening_consent"
+        if user_turn <= self.bounds["claim_clarification_turns"]:
+            return "claim_clarification"
+        if user_turn >= self.bounds["farewell_from_turn"]:
+            return "farewell"
+        return "deep_questioning"
+
+    def route(self, turn_type: str, control_flag: bool = False) -> Route:
+        condition = "control" if control_flag else "treatment"
+        settings = dict(self.default)
+        for override in (
+            self.routes.get(turn_type),
+            ((self.conditions.get(condition) or {}).get("routes") or {}).get(turn_type),
+        ):
+            for key, value in (override or {}).items():
+                if key in settings and (value or key == "reasoning_effort"):
+                    settings[key] = value
+        return Route(turn_type, settings["model"], settings["reasoning_effort"] or None)
+
+    def for_turn(self, user_turn: int, control_flag: bool = False) -> Route:
+        return self.route(self.classify(user_turn), control_flag)
+
+    def for_extraction(self, control_flag: bool = False) -> Route:
+        return self.route("extraction", control_flag)
+
+
+def count_user_turns(messages) -> int:
+    return sum(1 for m in messages if (m.get("role") if isinstance(m, dict) else m.role) == "user")
+
+
+def load_model_routing(on_error: ErrorCallback = None) -> dict:
+    import yaml
+
+    path = get_secret("MODEL_ROUTING_FILE", "/app/config/model_routing.yaml")
+    if not os.path.isfile(path):
+        # local fallback for non-docker runs
+        local_fallback = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "model_routing.yaml")
+        if os.path.isfile(local_fallback):
+            path = local_fallback
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    except Exception as e:
+        if on_error:
+            on_error(f"Failed to load model routing from {path}: {e}")
+        return {}
+
+
+def make_model_router(on_error: ErrorCallback = None) -> ModelRouter:
+    return ModelRouter(load_model_routing(on_error), get_secret("OPENAI_MODEL", "gpt-5"))
@@ -0,0 +1,263 @@
+"""Compact per-session chat state and process-wide session accounting."""
+
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+from pymongo.errors import PyMongoError
+from pympler.asizeof import asizeof
+
+from streetgpt.core import ASSISTANT_AVATAR, USER_AVATAR, get_current_time_in_berlin
+from streetgpt.errors import MAX_ERROR_ENTRIES, push_errors
+
+logger = logging.getLogger(__name__)
+
+AVATARS = {"assistant": ASSISTANT_AVATAR, "user": USER_AVATAR}
+
+# Session-state keys that point at process-wide shared objects and are not
+# charged to an individual session.
+SHARED_STATE_KEYS = frozenset({"system_message"})
+MAX_ERROR_LOG_SESSIONS = 10000
+# Sessions not seen for STALE_SESSION_S are left out of the admin views; the table
+# never holds more than MAX_TRACKED_SESSIONS, even with the idle reaper disabled.
+STALE_SESSION_S = 60 * 60
+MAX_TRACKED_SESSIONS = 10000
+
+
+@dataclass(slots=True)
+class ChatMessage:
+    role: str
+    content: str
+
+    def __post_init__(self):
+        # Only "assistant" and "user" ever occur; share one string object per role.
+        self.role = sys.intern(self.role)
+
+    @property
+    def avatar(self) -> str:
+        return AVATARS.get(self.role, USER_AVATAR)
+
+    def as_prompt(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+
+class ErrorLog:
+    """Ring buffer of the most recent structured errors for one session.
+
+    Entries not yet written to Mongo stay pending until take_pending() hands them
+    to the next conversation update.
+    """
+
+    __slots__ = ("_entries", "_pending")
+
+    def __init__(self, entries=(), maxlen: int = MAX_ERROR_ENTRIES):
+        self._entries = deque(entries, maxlen=maxlen)
+        self._pending = deque(maxlen=maxlen)
+
+    def add(self, entry: dict):
+        self._entries.append(entry)
+        self._pending.append(entry)
+
+    def pending(self) -> list[dict]:
+        return list(self._pending)
+
+    def take_pending(self) -> list[dict]:
+        entries = list(self._pending)
+        self._pending.clear()
+        return entries
+
+    def requeue(self, entries):
+        """Put entries back after a failed write so the next one carries them."""
+        self._pending.extendleft(reversed(entries))
+
+    def entries(self) -> list[dict]:
+        return list(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SessionErrorLogs:
+    """ErrorLogs by session ID for a backend without per-session state.
+
+    Only the max_sessions most recently used sessions are kept, so pending
+    errors of long-gone sessions do not accumulate.
+    """
+
+    def __init__(self, max_sessions: int = MAX_ERROR_LOG_SESSIONS):
+        self.max_sessions = max_sessions
+        self._logs: OrderedDict[str, ErrorLog] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> ErrorLog:
+        with self._lock:
+            log = self._logs.get(session_id)
+            if log is None:
+                log = self._logs[session_id] = ErrorLog()
+            self._logs.move_to_end(session_id)
+            if len(self._logs) > self.max_sessions:
+                self._logs.popitem(last=False)
+            return log
+
+    def __len__(self):
+        return len(self._logs)
+
+
+def shared_text(value: str) -> str:
+    """Return one shared object for identical long strings such as rendered system messages."""
+    return sys.intern(value)
+
+
+def state_size_bytes(state: dict) -> int:
+    return asizeof({key: value for key, value in state.items() if key not in SHARED_STATE_KEYS})
+
+
+@dataclass(slots=True)
+class SessionStats:
+    conversation_id: str
+    study_id: str
+    state_bytes: int
+    messages: int
+    input_active: int
+    last_seen: float
+    # Counters flushed to Mongo if the session is evicted
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    pending_errors: tuple = ()
+
+
+class SessionRegistry:
+    """Thread-safe table of live sessions in this process, keyed by runtime session id."""
+
+    def __init__(self, stale_after_s: float = STALE_SESSION_S, max_sessions: int = MAX_TRACKED_SESSIONS):
+        self.stale_after_s = stale_after_s
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # Least recently seen first
+        self._sessions: dict[str, SessionStats] = {}
+
+    def record(self, session_key: str, state: dict):
+        if not session_key:
+            return
+        conversation_id = str(state.get("id", ""))
+        messages = len(state.get("messages") or [])
+        with self._lock:
+            previous = self._sessions.get(session_key)
+        # Sizing the whole state is expensive; it only grows noticeably when a message is added
+        if previous and previous.conversation_id == conversation_id and previous.messages == messages:
+            state_bytes = previous.state_bytes
+        else:
+            state_bytes = state_size_bytes(state)
+        errors = state.get("errors")
+        stats = SessionStats(
+            conversation_id=conversation_id,
+            study_id=str(state.get("study_id", "")),
+            state_bytes=state_bytes,
+            messages=messages,
+            input_active=int(state.get("input_active", 0) or 0),
+            last_seen=time.time(),
+            prompt_tokens=int(state.get("prompt_tokens", 0) or 0),
+            completion_tokens=int(state.get("completion_tokens", 0) or 0),
+            pending_errors=tuple(errors.pending()) if isinstance(errors, ErrorLog) else (),
+        )
+        with self._lock:
+            self._sessions.pop(session_key, None)
+            self._sessions[session_key] = stats
+            if len(self._sessions) > self.max_sessions:
+                self._prune(stats.last_seen)
+
+    def _prune(self, now: float):
+        cutoff = now - self.stale_after_s
+        for key in [key for key, stats in self._sessions.items() if stats.last_seen < cutoff]:
+            del self._sessions[key]
+        while len(self._sessions) > self.max_sessions:
+            del self._sessions[next(iter(self._sessions))]
+
+    def remove(self, session_key: str):
+        with self._lock:
+            self._sessions.pop(session_key, None)
+
+    def snapshot(self) -> dict[str, SessionStats]:
+        """Sessions seen within stale_after_s; older ones are gone or waiting for the reaper."""
+        cutoff = time.time() - self.stale_after_s
+        with self._lock:
+            return {key: stats for key, stats in self._sessions.items() if stats.last_seen >= cutoff}
+
+    def idle_sessions(self, idle_timeout_s: float) -> dict[str, SessionStats]:
+        cutoff = time.time() - idle_timeout_s
+        with self._lock:
+            return {key: stats for key, stats in self._sessions.items() if stats.last_seen < cutoff}
+
+    def totals(self) -> dict:
+        sessions = self.snapshot()
+        total_bytes = sum(stats.state_bytes for stats in sessions.values())
+        count = len(sessions)
+        return {
+            "sessions": count,
+            "state_bytes": total_bytes,
+            "mean_state_bytes": total_bytes // count if count else 0,
+            "max_state_bytes": max((stats.state_bytes for stats in sessions.values()), default=0),
+        }
+
+
+SESSION_REGISTRY = SessionRegistry()
+
+
+def mark_abandoned(collection, stats: SessionStats):
+    """Flush the session's counters and mark an unfinished conversation as abandoned."""
+    current_time = get_current_time_in_berlin()
+    update = {"$set": {
+        "status": "abandoned",
+        "abandoned_at": current_time,
+        "updated_at": current_time,
+        "prompt_tokens": stats.prompt_tokens,
+        "completion_tokens": stats.completion_tokens,
+    }}
+    if stats.pending_errors:
+        update["$push"] = push_errors(stats.pending_errors)
+    collection.update_one({"session_id": stats.conversation_id, "input_active": 1}, update)
+
+
+class IdleSessionReaper(threading.Thread):
+    """Background thread that evicts sessions nobody has touched for idle_timeout_s."""
+
+    def __init__(self, registry: SessionRegistry, collection, close_session, idle_timeout_s: float, interval_s: float = 60):
+        super().__init__(name="idle-session-reaper", daemon=True)
+        self.registry = registry
+        self.collection = collection
+        self.close_session = close_session
+        self.idle_timeout_s = idle_timeout_s
+        self.interval_s = interval_s
+        # Keep idle sessions in the table until they are flushed
+        registry.stale_after_s = max(registry.stale_after_s, idle_timeout_s)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval_s)
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Idle session reaper failed")
+
+    def reap(self) -> int:
+        evicted = 0
+        for session_key, stats in self.registry.idle_sessions(self.idle_timeout_s).items():
+            if stats.input_active == 1 and stats.conversation_id:
+                try:
+                    mark_abandoned(self.collection, stats)
+                except PyMongoError as e:
+                    # Keep the session so the flush is retried on the next pass
+                    logger.warning("Could not flush idle session %s: %s", stats.conversation_id, e)
+                    continue
+            try:
+                self.close_session(session_key)
+            except Exception as e:
+                logger.warning("Could not close idle session %s: %s", session_key, e)
+            self.registry.remove(session_key)
+            evicted += 1
+        return evicted
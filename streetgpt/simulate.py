@@ -0,0 +1,330 @@
+"""Synthetic participants for end-to-end throughput tests of the ASGI backend.
+
+Each simulated participant gets a launch URL built like the Qualtrics redirect
+from ``build_chatbot_question_js``: a ResponseId as ``id``, a survey claim from
+config/claims.yaml with a credence of 6-10, the control/treatment split,
+English or German, Prolific ids and a Qualtrics ``return_url``. It then chats
+through ``/api/session`` and ``/api/chat`` with scripted replies. When the
+assistant asks for a 1-10 rating, the participant answers with its credence.
+The run stops at the handoff. Participants arrive as a Poisson process at
+``--rate`` per second.
+
+A completed participant passes if the final return URL still carries
+``chat_return=1`` and the ``discussion_claim*`` fields. Participants held in the
+waiting room keep polling, as the chat page does, until they are admitted or
+screened out. The report gives completion throughput, turn and first-delta
+latency, waiting-room outcomes, and every failure. Point
+the server at a stub model by setting OPENAI_BASE_URL for the app when only the
+app itself is under test.
+
+    python -m streetgpt.simulate --base-url http://127.0.0.1:8000 --participants 200 --rate 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import secrets
+import string
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import httpx
+
+from streetgpt.claims import load_claim_registry
+from streetgpt.core import get_secret
+from streetgpt.metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+RETURN_URL_FIELDS = ("discussion_claim", "discussion_claim_initial_credence", "discussion_claim_final_credence")
+RATING_QUESTION = re.compile(r"\b1\s*(?:-|–|to|bis)\s*10\b|\bscale\b|\bskala\b", re.IGNORECASE)
+NICKNAMES = ["Sam", "Alex", "Robin", "Kim", "Jo", "Charlie", "Toni", "Mika"]
+
+SCRIPTS = {
+    "english": [
+        "yes",
+        "{nickname}",
+        "I mean it literally: {claim}",
+        "Mostly things I have read online and what people I trust have told me.",
+        "The main reason is that the official explanations never convinced me.",
+        "I suppose I could look at what independent sources say.",
+        "If several sources I trust disagreed, I would be less sure.",
+        "I haven't really checked that, to be honest.",
+        "That's a fair point, I'm not sure.",
+        "I think I would need more evidence either way.",
+    ],
+    "german": [
+        "ja",
+        "{nickname}",
+        "Ich meine es wörtlich: {claim}",
+        "Vor allem Dinge, die ich online gelesen habe, und was mir Leute erzählt haben, denen ich vertraue.",
+        "Der Hauptgrund ist, dass mich die offiziellen Erklärungen nie überzeugt haben.",
+        "Ich könnte schauen, was unabhängige Quellen dazu sagen.",
+        "Wenn mehrere Quellen, denen ich vertraue, widersprechen würden, wäre ich unsicherer.",
+        "Ehrlich gesagt habe ich das nie richtig überprüft.",
+        "Guter Punkt, da bin ich mir nicht sicher.",
+        "Ich glaube, ich bräuchte mehr Belege, so oder so.",
+    ],
+}
+
+
+@dataclass
+class Participant:
+    response_id: str
+    language: str
+    control_flag: bool
+    survey_claim: str
+    credence: int
+    control_claim: str
+    prolific_pid: str
+    study_id: str
+    session_id: str
+    nickname: str
+
+    def launch_params(self, password: str) -> dict:
+        # Same parameters, in the same order, as buildChatbotUrl in the Qualtrics JS
+        params = {
+            "password": password,
+            "id": self.response_id,
+            "launch_nonce": str(int(time.time() * 1000)),
+            "return_url": self.return_url(),
+            "language": self.language,
+            "survey_claim": self.survey_claim,
+            "survey_claim_initial_credence": str(self.credence),
+        }
+        if self.control_flag:
+            params["control_flag"] = "1"
+            params["control_claim"] = self.control_claim
+        params.update({"prolific_pid": self.prolific_pid, "study_id": self.study_id, "session_id": self.session_id})
+        return params
+
+    def return_url(self) -> str:
+        query = {
+            "chat_return": "1",
+            "PROLIFIC_PID": self.prolific_pid,
+            "STUDY_ID": self.study_id,
+            "SESSION_ID": self.session_id,
+        }
+        return "https://survey.example.qualtrics.com/jfe/form/SV_simulated?" + urlencode(query)
+
+
+@dataclass
+class ParticipantResult:
+    response_id: str
+    language: str
+    control_flag: bool
+    turns: int = 0
+    completed: bool = False
+    screened_out: bool = False
+    waited_s: float = 0.0
+    return_url_ok: bool = False
+    missing_fields: list[str] = field(default_factory=list)
+    duration_s: float = 0.0
+    turn_latencies_s: list[float] = field(default_factory=list)
+    first_delta_latencies_s: list[float] = field(default_factory=list)
+    error: str = ""
+
+
+def random_participant(rng: random.Random, claims: list[str], study_id: str, control_share: float, german_share: float):
+    survey_claim = rng.choice(claims)
+    control_claims = [claim for claim in claims if claim != survey_claim] or claims
+    return Participant(
+        response_id="R_" + "".join(rng.choices(string.ascii_letters + string.digits, k=15)),
+        language="german" if rng.random() < german_share else "english",
+        control_flag=rng.random() < control_share,
+        survey_claim=survey_claim,
+        credence=rng.randint(6, 10),
+        control_claim=rng.choice(control_claims),
+        prolific_pid=secrets.token_hex(12),
+        study_id=study_id,
+        session_id=secrets.token_hex(12),
+        nickname=rng.choice(NICKNAMES),
+    )
+
+
+def scripted_reply(participant: Participant, turn: int, last_assistant: str, ratings_given: int) -> str:
+    if turn > 0 and RATING_QUESTION.search(last_assistant or ""):
+        # The first rating is the survey credence; later ones drift down a little
+        return str(max(1, participant.credence - min(ratings_given, 1) * random.randint(0, 3)))
+    script = SCRIPTS.get(participant.language, SCRIPTS["english"])
+    line = script[turn] if turn < len(script) else script[-1 - (turn % 3)]
+    return line.format(nickname=participant.nickname, claim=participant.survey_claim)
+
+
+def missing_return_fields(return_url: str) -> list[str]:
+    params = parse_qs(urlsplit(return_url or "").query)
+    missing = [name for name in RETURN_URL_FIELDS if not params.get(name)]
+    if params.get("chat_return") != ["1"]:
+        missing.append("chat_return")
+    return missing
+
+
+async def read_events(response: httpx.Response):
+    event, data = "", ""
+    async for line in response.aiter_lines():
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: "):
+            data += line[6:]
+        elif not line and event:
+            yield event, json.loads(data) if data else {}
+            event, data = "", ""
+
+
+async def run_participant(
+    http: httpx.AsyncClient, participant: Participant, password: str, max_turns: int, think_time_s: float
+) -> ParticipantResult:
+    result = ParticipantResult(participant.response_id, participant.language, participant.control_flag)
+    started = time.perf_counter()
+    try:
+        response = await http.post("/api/session", params=participant.launch_params(password))
+        response.raise_for_status()
+        session = response.json()
+        # Waiting room: poll like the chat page until admitted or screened out
+        while session.get("waiting"):
+            await asyncio.sleep(session.get("retry_after_s", 5))
+            response = await http.post(
+                "/api/session", params={**participant.launch_params(password), "ticket": session["ticket"]}
+            )
+            response.raise_for_status()
+            session = response.json()
+        result.waited_s = time.perf_counter() - started
+        if session.get("screened_out"):
+            result.screened_out = True
+            result.duration_s = result.waited_s
+            return result
+        last_assistant, ratings_given, return_url = session.get("opening_message", ""), 0, ""
+        while result.turns < max_turns:
+            message = scripted_reply(participant, result.turns, last_assistant, ratings_given)
+            ratings_given += message.isdigit()
+            if think_time_s:
+                await asyncio.sleep(random.expovariate(1 / think_time_s))
+            turn_started = time.perf_counter()
+            reply, done = "", None
+            async with http.stream(
+                "POST", "/api/chat", json={"session_id": session["session_id"], "password": password, "message": message}
+            ) as stream:
+                stream.raise_for_status()
+                async for event, data in read_events(stream):
+                    if event == "delta":
+                        if not reply:
+                            result.first_delta_latencies_s.append(time.perf_counter() - turn_started)
+                        reply += data.get("text", "")
+                    elif event == "reset":
+                        reply = ""
+                    elif event == "error":
+                        raise RuntimeError(data.get("message", "chat error"))
+                    elif event == "done":
+                        done = data
+            result.turn_latencies_s.append(time.perf_counter() - turn_started)
+            result.turns += 1
+            last_assistant = reply
+            if done is None:
+                raise RuntimeError("stream ended without a done event")
+            if done.get("input_active") == 0:
+                result.completed = True
+                return_url = done.get("return_url", "")
+                break
+        if result.completed:
+            result.missing_fields = missing_return_fields(return_url)
+            result.return_url_ok = not result.missing_fields
+        else:
+            result.error = f"no handoff after {max_turns} turns"
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.duration_s = time.perf_counter() - started
+    return result
+
+
+async def simulate(args: argparse.Namespace, claims: list[str]) -> tuple[list[ParticipantResult], float]:
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.participants, max_keepalive_connections=args.participants)
+    timeout = httpx.Timeout(args.timeout, connect=10)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as http:
+        tasks = []
+        for _ in range(args.participants):
+            participant = random_participant(rng, claims, args.study_id, args.control_share, args.german_share)
+            tasks.append(asyncio.create_task(
+                run_participant(http, participant, args.password, args.max_turns, args.think_time)
+            ))
+            if args.rate > 0:
+                await asyncio.sleep(rng.expovariate(args.rate))
+        results = await asyncio.gather(*tasks)
+    return results, time.perf_counter() - started
+
+
+def summarize(results: list[ParticipantResult], elapsed_s: float) -> dict:
+    completed = [r for r in results if r.completed]
+    waits = [r.waited_s for r in results]
+    latencies = [value for r in results for value in r.turn_latencies_s]
+    first_deltas = [value for r in results for value in r.first_delta_latencies_s]
+    return {
+        "participants": len(results),
+        "completed": len(completed),
+        "return_url_ok": sum(r.return_url_ok for r in results),
+        "failed": sum(1 for r in results if r.error),
+        "screened_out": sum(r.screened_out for r in results),
+        "launch_wait_p95_s": percentile(waits, 0.95),
+        "elapsed_s": round(elapsed_s, 1),
+        "completions_per_minute": round(len(completed) / elapsed_s * 60, 2) if elapsed_s else None,
+        "mean_turns": round(sum(r.turns for r in results) / len(results), 1) if results else None,
+        "turn_latency_p50_s": percentile(latencies, 0.5),
+        "turn_latency_p95_s": percentile(latencies, 0.95),
+        "first_delta_p50_s": percentile(first_deltas, 0.5),
+        "first_delta_p95_s": percentile(first_deltas, 0.95),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Drive the ASGI backend with synthetic participants.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="Where streetgpt.asgi is served.")
+    parser.add_argument("--password", default=get_secret("PASSWORD", ""), help="App password (default: PASSWORD).")
+    parser.add_argument("--participants", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=1.0, help="Mean arrivals per second; 0 launches everyone at once.")
+    parser.add_argument("--control-share", type=float, default=0.5, help="Fraction of participants in the control condition.")
+    parser.add_argument("--german-share", type=float, default=0.0, help="Fraction of participants chatting in German.")
+    parser.add_argument("--study-id", default="simulated-study")
+    parser.add_argument("--max-turns", type=int, default=30, help="Give up on a participant after this many messages.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds a participant waits before each reply.")
+    parser.add_argument("--timeout", type=float, default=120, help="Read timeout per request in seconds.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the participant mix.")
+    parser.add_argument("--min-completion-rate", type=float, default=1.0, help="Exit 1 below this share of passing participants.")
+    parser.add_argument("--json-out", type=Path, help="Write per-participant results and the summary as JSON.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="[simulate] %(message)s")
+    # One line per request would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    registry = load_claim_registry(on_error=logger.warning)
+    claims = sorted(registry.claims().values()) or ["The moon landing was staged."]
+    results, elapsed_s = asyncio.run(simulate(args, claims))
+
+    summary = summarize(results, elapsed_s)
+    for name, value in summary.items():
+        logger.info("%s: %s", name, value)
+    for result in results:
+        if result.error or result.missing_fields:
+            logger.warning("%s: %s", result.response_id, result.error or f"return URL lacks {', '.join(result.missing_fields)}")
+    if args.json_out:
+        args.json_out.write_text(
+            json.dumps({"summary": summary, "results": [asdict(r) for r in results]}, indent=2),
+            encoding="utf-8",
+        )
+    passed = summary["return_url_ok"] / summary["participants"] if summary["participants"] else 0
+    return 0 if passed >= args.min_completion_rate else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+"""Speculative generation of the first assistant turn.
+
+Most participants answer the opening message with a short consent ("yes", "ok",
+"sure"). When a new conversation is launched, the reply to the canonical consent
+is generated in the background while the participant reads. If their first
+message is one of the consent replies, the prepared answer is replayed right
+away; any other reply discards it. Speculative spend is capped per hour.
+
+Enable with SPECULATIVE_FIRST_TURN=1.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from cachetools import TTLCache
+
+from streetgpt.cache import first_turn_key, normalize_reply
+from streetgpt.core import (
+    aiter_response_deltas,
+    get_secret,
+    iter_response_deltas,
+    num_tokens_from_prompt,
+    parse_bool_param,
+    parse_int_param,
+)
+from streetgpt.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# language -> (reply generated for, replies that count as the same answer)
+CONSENT_REPLIES = {
+    "english": ("yes", frozenset({
+        "yes", "yes please", "yes sure", "yeah", "yep", "y", "ok", "okay", "ok sure", "sure", "sounds good", "lets go",
+        "yes i am ready", "i am ready", "ready", "go ahead", "yes go ahead", "fine",
+    })),
+    "german": ("ja", frozenset({
+        "ja", "ja gerne", "ja klar", "klar", "gerne", "ok", "okay", "einverstanden", "ja einverstanden", "passt",
+        "los gehts", "bereit", "ja bitte",
+    })),
+}
+# Unclaimed speculations are dropped after this long
+SPECULATION_TTL_S = 15 * 60
+SPECULATION_WAIT_S = 60
+
+
+@dataclass(slots=True)
+class SpeculativeReply:
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+
+
+def consent_reply(language: str, reply: str = "") -> str:
+    """The canonical consent for language; with reply, "" unless reply is a consent."""
+    canonical, accepted = CONSENT_REPLIES.get(language, CONSENT_REPLIES["english"])
+    if reply and normalize_reply(reply) not in accepted:
+        return ""
+    return canonical
+
+
+def make_generate(client, model: str, reasoning_effort: str | None = "low"):
+    def generate(messages: list[dict]) -> tuple[str, int]:
+        deltas = list(iter_response_deltas(client, model, messages, reasoning_effort))
+        return "".join(deltas), len(deltas)
+    return generate
+
+
+def make_agenerate(client, model: str, reasoning_effort: str | None = "low"):
+    async def agenerate(messages: list[dict]) -> tuple[str, int]:
+        deltas = [delta async for delta in aiter_response_deltas(client, model, messages, reasoning_effort)]
+        return "".join(deltas), len(deltas)
+    return agenerate
+
+
+def speculative_prompt(context: list[dict], language: str) -> list[dict]:
+    return context + [{"role": "user", "content": consent_reply(language)}]
+
+
+class FirstTurnSpeculator:
+    """Pending speculative first replies by session, with an hourly token budget."""
+
+    def __init__(self, token_budget_per_hour: int, max_inflight: int = 8):
+        self.token_budget_per_hour = token_budget_per_hour
+        self._pending: TTLCache = TTLCache(maxsize=4096, ttl=SPECULATION_TTL_S)
+        self._executor: ThreadPoolExecutor | None = None
+        self._max_inflight = max_inflight
+        self._inflight = 0
+        self._hour = 0
+        self._spent = 0
+        self._lock = threading.Lock()
+        self.stats = {"started": 0, "used": 0, "discarded": 0, "skipped": 0}
+
+    def _reserve(self) -> bool:
+        hour = int(time.time() // 3600)
+        with self._lock:
+            if hour != self._hour:
+                self._hour, self._spent = hour, 0
+            if self._spent >= self.token_budget_per_hour or self._inflight >= self._max_inflight:
+                self.stats["skipped"] += 1
+                return False
+            self._inflight += 1
+            self.stats["started"] += 1
+            return True
+
+    def _finish(self, reply: SpeculativeReply | None):
+        with self._lock:
+            self._inflight -= 1
+            if reply:
+                self._spent += reply.prompt_tokens + reply.completion_tokens
+
+    def _remember(self, session_id: str, key: str, handle):
+        with self._lock:
+            self._pending[session_id] = (key, handle)
+
+    def start(self, session_id: str, context: list[dict], language: str, model: str, generate) -> bool:
+        """Run generate(messages) -> (text, completion_tokens) on a worker thread."""
+        if not session_id or not self._reserve():
+            return False
+        messages = speculative_prompt(context, language)
+
+        def run() -> SpeculativeReply | None:
+            reply = None
+            try:
+                with METRICS.inflight("speculative"):
+                    text, completion_tokens = generate(messages)
+                reply = SpeculativeReply(text, num_tokens_from_prompt(messages), completion_tokens)
+            except Exception as e:
+                logger.warning("Speculative first turn failed for %s: %s", session_id, e)
+            finally:
+                self._finish(reply)
+            return reply
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._max_inflight, thread_name_prefix="speculative")
+        self._remember(session_id, first_turn_key(context, consent_reply(language), model), self._executor.submit(run))
+        return True
+
+    def astart(self, session_id: str, context: list[dict], language: str, model: str, agenerate) -> bool:
+        """Async counterpart of start; agenerate(messages) is awaited on the running loop."""
+        if not session_id or not self._reserve():
+            return False
+        messages = speculative_prompt(context, language)
+
+        async def run() -> SpeculativeReply | None:
+            reply = None
+            try:
+                with METRICS.inflight("speculative"):
+                    text, completion_tokens = await agenerate(messages)
+                reply = SpeculativeReply(text, num_tokens_from_prompt(messages), completion_tokens)
+            except Exception as e:
+                logger.warning("Speculative first turn failed for %s: %s", session_id, e)
+            finally:
+                self._finish(reply)
+            return reply
+
+        self._remember(session_id, first_turn_key(context, consent_reply(language), model), asyncio.create_task(run()))
+        return True
+
+    def take(self, session_id: str, context: list[dict], language: str, reply: str, model: str):
+        """Pop this session's speculation; return its Future/Task if reply and prompt match, else None."""
+        with self._lock:
+            pending = self._pending.pop(session_id, None)
+        if pending is None:
+            return None
+        key, handle = pending
+        matches = bool(consent_reply(language, reply)) and key == first_turn_key(context, consent_reply(language), model)
+        with self._lock:
+            self.stats["used" if matches else "discarded"] += 1
+        return handle if matches else None
+
+
+def wait_for_speculation(handle: Future, timeout_s: float = SPECULATION_WAIT_S) -> SpeculativeReply | None:
+    try:
+        return handle.result(timeout=timeout_s)
+    except Exception:
+        return None
+
+
+async def await_speculation(handle: asyncio.Task, timeout_s: float = SPECULATION_WAIT_S) -> SpeculativeReply | None:
+    try:
+        return await asyncio.wait_for(asyncio.shield(handle), timeout_s)
+    except Exception:
+        return None
+
+
+def make_first_turn_speculator() -> FirstTurnSpeculator | None:
+    """Build the speculator from SPECULATIVE_* settings, or None when disabled."""
+    if not parse_bool_param(get_secret("SPECULATIVE_FIRST_TURN"), False):
+        return None
+    return FirstTurnSpeculator(
+        token_budget_per_hour=parse_int_param(get_secret("SPECULATIVE_TOKEN_BUDGET_PER_HOUR"), 200000),
+        max_inflight=parse_int_param(get_secret("SPECULATIVE_MAX_INFLIGHT"), 8),
+    )
@@ -0,0 +1,351 @@
+"""Per-turn tracing in the OpenTelemetry span model.
+
+Each chat turn is one trace: a root ``chat_turn`` span with a child span per
+pipeline stage (input, prompt assembly, first-turn lookup, OpenAI streaming per
+attempt, token counting, end detection, outcome extraction, return URL, Mongo
+write). Every span carries the session ID, condition, language and model, so a
+slow participant's turns can be pulled out and compared stage by stage.
+
+Spans are exported from a background thread, never on the request path:
+
+- TRACE_FILE=/path/turns.jsonl appends one JSON object per span.
+- OTEL_EXPORTER_OTLP_ENDPOINT=http://collector:4318 posts OTLP/HTTP JSON to
+  <endpoint>/v1/traces (OTEL_EXPORTER_OTLP_TRACES_ENDPOINT overrides the full URL),
+  so any OpenTelemetry collector, Jaeger or Tempo can ingest them.
+
+With neither set, tracing is off and every call below is a no-op.
+"""
+
+from __future__ import annotations
+
+import abc
+import atexit
+import contextlib
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+
+from streetgpt.core import get_secret
+
+logger = logging.getLogger(__name__)
+
+EXPORT_INTERVAL_S = 2.0
+EXPORT_BATCH_SIZE = 512
+EXPORT_QUEUE_SIZE = 10000
+
+# OTLP status codes
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+# OTLP span kinds
+KIND_INTERNAL, KIND_SERVER = 1, 2
+
+
+def turn_attributes(session_id: str, control_flag=False, language: str = "", model: str = "") -> dict:
+    """Attributes shared by every span of a turn."""
+    attributes = {
+        "session.id": str(session_id or ""),
+        "study.condition": "control" if control_flag else "treatment",
+        "study.language": str(language or ""),
+    }
+    if model:
+        attributes["llm.model"] = str(model)
+    return attributes
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "status", "status_message", "_start_perf")
+
+    def __init__(self, name: str, parent_id: str = "", kind: int = KIND_INTERNAL, attributes: dict | None = None):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        # Wall clock for the timestamp, monotonic clock for the duration
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self.end_ns = 0
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_exception(self, e: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(e).__name__}: {e}"[:500]
+
+    def end(self):
+        if not self.end_ns:
+            self.end_ns = self.start_ns + time.perf_counter_ns() - self._start_perf
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns else 0.0
+
+
+class TurnTrace:
+    """One chat turn: a root span and its stage spans, exported together when the turn ends."""
+
+    def __init__(self, exporter, name: str = "chat_turn", attributes: dict | None = None):
+        self._exporter = exporter
+        self.trace_id = secrets.token_hex(16)
+        self.attributes = dict(attributes or {})
+        self.root = Span(name, kind=KIND_SERVER)
+        self.spans: list[Span] = []
+        self._finished = False
+
+    def set_attributes(self, attributes: dict):
+        """Update the attributes stamped on every span, e.g. the model once it is routed."""
+        self.attributes.update(attributes)
+
+    def count(self, name: str) -> int:
+        return sum(1 for span in self.spans if span.name == name)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, parent_id=self.root.span_id, attributes=attributes)
+        self.spans.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end()
+
+    def finish(self, error: BaseException | None = None):
+        if self._finished:
+            return
+        self._finished = True
+        if error is not None:
+            self.root.record_exception(error)
+        self.root.end()
+        self._exporter.export(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc if isinstance(exc, Exception) else None)
+        return False
+
+    def span_records(self) -> list[dict]:
+        """Flat span dicts with the shared attributes merged in, root first."""
+        records = []
+        for span in (self.root, *self.spans):
+            records.append({
+                "trace_id": self.trace_id,
+                "span_id": span.span_id,
+                "parent_span_id": span.parent_id,
+                "name": span.name,
+                "kind": span.kind,
+                "start_time_unix_nano": span.start_ns,
+                "end_time_unix_nano": span.end_ns,
+                "duration_ms": round(span.duration_ms, 3),
+                "attributes": {**self.attributes, **span.attributes},
+                "status": {"code": span.status, "message": span.status_message},
+            })
+        return records
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value):
+        pass
+
+    def record_exception(self, e: BaseException):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _NoopTrace:
+    """Stand-in used when tracing is off."""
+
+    def set_attributes(self, attributes: dict):
+        pass
+
+    def count(self, name: str) -> int:
+        return 0
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes):
+        yield NOOP_SPAN
+
+    def finish(self, error: BaseException | None = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_TRACE = _NoopTrace()
+
+
+async def atraced(trace, events):
+    """Wrap an async event stream so its trace ends when the stream does."""
+    with trace:
+        async for event in events:
+            yield event
+
+
+### Exporters ##
+
+class BatchSpanExporter(abc.ABC):
+    """Queues finished traces and writes them in batches from a daemon thread."""
+
+    def __init__(self, interval_s: float = EXPORT_INTERVAL_S):
+        self._queue: queue.Queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._interval_s = interval_s
+        self._stopped = threading.Event()
+        self._write_lock = threading.Lock()
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def export(self, trace: TurnTrace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> list[dict]:
+        records = []
+        while len(records) < EXPORT_BATCH_SIZE:
+            try:
+                records.extend(self._queue.get_nowait().span_records())
+            except queue.Empty:
+                break
+        return records
+
+    def _run(self):
+        while not self._stopped.wait(self._interval_s):
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            while records := self._drain():
+                try:
+                    self.write(records)
+                except Exception as e:
+                    logger.warning("Could not export %d spans: %s", len(records), e)
+
+    @abc.abstractmethod
+    def write(self, records: list[dict]):
+        """Send one batch of span records; an exception drops the batch."""
+
+    def close(self):
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self.flush()
+
+
+class JsonlSpanExporter(BatchSpanExporter):
+    def __init__(self, path: str, interval_s: float = EXPORT_INTERVAL_S):
+        self.path = path
+        super().__init__(interval_s)
+
+    def write(self, records: list[dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(record: dict) -> dict:
+    span = {
+        "traceId": record["trace_id"],
+        "spanId": record["span_id"],
+        "name": record["name"],
+        "kind": record["kind"],
+        "startTimeUnixNano": str(record["start_time_unix_nano"]),
+        "endTimeUnixNano": str(record["end_time_unix_nano"]),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in record["attributes"].items()],
+        "status": record["status"],
+    }
+    if record["parent_span_id"]:
+        span["parentSpanId"] = record["parent_span_id"]
+    return span
+
+
+class OtlpHttpSpanExporter(BatchSpanExporter):
+    """Posts spans to an OpenTelemetry collector using the OTLP/HTTP JSON encoding."""
+
+    def __init__(self, endpoint: str, service_name: str, interval_s: float = EXPORT_INTERVAL_S):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        # Imported here so JSONL-only and untraced deployments do not need httpx
+        import httpx
+
+        self._client = httpx.Client(timeout=5.0)
+        super().__init__(interval_s)
+
+    def write(self, records: list[dict]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "streetgpt"}, "spans": [otlp_span(record) for record in records]}],
+        }]}
+        response = self._client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+
+class MultiSpanExporter:
+    def __init__(self, exporters):
+        self.exporters = list(exporters)
+
+    def export(self, trace: TurnTrace):
+        for exporter in self.exporters:
+            exporter.export(trace)
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+
+class Tracer:
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def turn(self, attributes: dict | None = None, name: str = "chat_turn"):
+        if self.exporter is None:
+            return NOOP_TRACE
+        return TurnTrace(self.exporter, name, attributes)
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+def make_tracer(service_name: str = "streetgpt") -> Tracer:
+    exporters = []
+    trace_file = get_secret("TRACE_FILE", "")
+    if trace_file:
+        exporters.append(JsonlSpanExporter(trace_file))
+    endpoint = get_secret("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "")
+    if not endpoint and get_secret("OTEL_EXPORTER_OTLP_ENDPOINT", ""):
+        endpoint = get_secret("OTEL_EXPORTER_OTLP_ENDPOINT").rstrip("/") + "/v1/traces"
+    if endpoint:
+        exporters.append(OtlpHttpSpanExporter(endpoint, get_secret("OTEL_SERVICE_NAME", service_name)))
+    if not exporters:
+        return Tracer()
+    return Tracer(exporters[0] if len(exporters) == 1 else MultiSpanExporter(exporters))
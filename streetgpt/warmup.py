@@ -0,0 +1,107 @@
+"""Pay cold-start costs before participants arrive.
+
+``warm_up`` loads the tokenizer, builds the conversation indexes and opens the
+Mongo and OpenAI connection pools. The container runs ``python -m
+streetgpt.warmup`` before starting the server, so the healthcheck only passes
+once indexes exist and both backends answered; the ASGI backend and the
+Streamlit app also call ``warm_up`` in-process to fill their own pools.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import time
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from streetgpt.core import (
+    ensure_conversation_indexes,
+    get_secret,
+    get_token_encoding,
+    load_system_messages,
+    make_openai_client,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def warm_tokenizer() -> None:
+    get_token_encoding().encode("warmup")
+
+
+def warm_mongo(collection, timeout_s: float = 30) -> bool:
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            collection.database.client.admin.command("ping")
+            ensure_conversation_indexes(collection)
+            return True
+        except PyMongoError as e:
+            if time.monotonic() >= deadline:
+                logger.warning("Mongo warmup failed: %s", e)
+                return False
+            time.sleep(1)
+
+
+def warm_openai(client) -> bool:
+    # Listing models is free and leaves a warm keep-alive TLS connection in the pool
+    try:
+        client.models.list()
+        return True
+    except Exception as e:
+        logger.warning("OpenAI warmup failed: %s: %s", type(e).__name__, e)
+        return False
+
+
+async def awarm_openai(client) -> bool:
+    try:
+        await client.models.list()
+        return True
+    except Exception as e:
+        logger.warning("OpenAI warmup failed: %s: %s", type(e).__name__, e)
+        return False
+
+
+def warm_up(collection=None, openai_client=None, mongo_timeout_s: float = 30) -> dict[str, bool]:
+    results = {"tokenizer": False, "mongo": False, "openai": False}
+    try:
+        warm_tokenizer()
+        results["tokenizer"] = True
+    except Exception as e:
+        logger.warning("Tokenizer warmup failed: %s: %s", type(e).__name__, e)
+    if collection is not None:
+        results["mongo"] = warm_mongo(collection, mongo_timeout_s)
+    if openai_client is not None and get_secret("OPENAI_API_KEY"):
+        results["openai"] = warm_openai(openai_client)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Warm tokenizer, Mongo indexes and the OpenAI connection.")
+    parser.add_argument("--mongo-timeout", type=float, default=30, help="Seconds to wait for Mongo to accept connections.")
+    parser.add_argument("--skip-openai", action="store_true", help="Do not contact the OpenAI API.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[warmup] %(message)s")
+
+    load_system_messages(on_error=logger.warning)
+
+    collection = None
+    mongo_uri = get_secret("MONGO_URI")
+    if mongo_uri:
+        mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        collection = mongo_client[get_secret("MONGO_DB_NAME", "streetgpt")]["conversations"]
+
+    openai_client = None
+    if not args.skip_openai:
+        openai_client = make_openai_client()
+
+    results = warm_up(collection, openai_client, mongo_timeout_s=args.mongo_timeout)
+    logger.info("%s", ", ".join(f"{name}={'ok' if ok else 'skipped/failed'}" for name, ok in results.items()))
+    # Never block the server from starting; the app reports backend errors itself.
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())